@@ -0,0 +1,306 @@
+import operator
+import re
+
+from summary import SERVER_FIELDS
+
+_F = {name: index for index, name in enumerate(SERVER_FIELDS)}
+
+
+def _percent(used, total):
+    return used / total * 100 if total else 0
+
+
+# 指标名 -> 从汇总行中取值的函数
+METRICS = {
+    "cpu": lambda r: r[_F["cpu"]],
+    "memory": lambda r: _percent(r[_F["mem_used"]], r[_F["mem_total"]]),
+    "swap": lambda r: _percent(r[_F["swap_used"]], r[_F["swap_total"]]),
+    "disk": lambda r: _percent(r[_F["disk_used"]], r[_F["disk_total"]]),
+    "load": lambda r: r[_F["load_1"]],
+    "net_in_speed": lambda r: r[_F["net_in_speed"]],
+    "net_out_speed": lambda r: r[_F["net_out_speed"]],
+    "net_all_speed": lambda r: r[_F["net_in_speed"]] + r[_F["net_out_speed"]],
+    "transfer_in": lambda r: r[_F["net_in_transfer"]],
+    "transfer_out": lambda r: r[_F["net_out_transfer"]],
+    "transfer_all": lambda r: r[_F["net_in_transfer"]] + r[_F["net_out_transfer"]],
+    "offline": lambda r: 0 if r[_F["online"]] else 1,
+}
+
+# 指标的显示名称与单位类型（percent / bytes / speed / number）
+METRIC_LABELS = {
+    "cpu": ("CPU", "percent"),
+    "memory": ("内存", "percent"),
+    "swap": ("交换", "percent"),
+    "disk": ("磁盘", "percent"),
+    "load": ("负载", "number"),
+    "net_in_speed": ("下行速度", "speed"),
+    "net_out_speed": ("上行速度", "speed"),
+    "net_all_speed": ("总网速", "speed"),
+    "transfer_in": ("下行流量", "bytes"),
+    "transfer_out": ("上行流量", "bytes"),
+    "transfer_all": ("总流量", "bytes"),
+    "offline": ("离线", "number"),
+}
+
+# 哪吒告警规则类型 -> 本地指标名
+NEZHA_RULE_TYPES = {
+    "cpu": "cpu",
+    "memory": "memory",
+    "swap": "swap",
+    "disk": "disk",
+    "load1": "load",
+    "net_in_speed": "net_in_speed",
+    "net_out_speed": "net_out_speed",
+    "net_all_speed": "net_all_speed",
+    "transfer_in": "transfer_in",
+    "transfer_out": "transfer_out",
+    "transfer_all": "transfer_all",
+    "offline": "offline",
+}
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+_DURATION = re.compile(r"^(\d+)([smh]?)$")
+_DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(text):
+    """解析 30s / 5m / 1h 形式的持续时间，返回秒数，格式错误返回 None"""
+    match = _DURATION.match(text.strip().lower())
+    if not match:
+        return None
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+_THRESHOLD = re.compile(r"^(\d+(?:\.\d+)?)\s*([%kmgt]?)b?$")
+_THRESHOLD_UNITS = {"": 1, "%": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+
+
+def parse_threshold(text):
+    """解析阈值，支持 95% 与 500M / 100G 等字节单位，格式错误返回 None"""
+    match = _THRESHOLD.match(text.strip().lower())
+    if not match:
+        return None
+    return float(match.group(1)) * _THRESHOLD_UNITS[match.group(2)]
+
+
+class CompiledRule:
+    """编译后的单条规则：比较函数、阈值与适用的服务器集合已预先确定"""
+
+    __slots__ = (
+        "key",
+        "name",
+        "metric",
+        "op",
+        "compare",
+        "threshold",
+        "duration",
+        "servers",
+        "exclude",
+        "owner",
+    )
+
+    def __init__(
+        self,
+        key,
+        name,
+        metric,
+        op,
+        threshold,
+        duration=0,
+        servers=None,
+        exclude=None,
+        owner=None,
+    ):
+        self.key = key
+        self.name = name
+        self.metric = metric
+        self.op = op
+        self.compare = OPERATORS[op]
+        self.threshold = threshold
+        self.duration = duration
+        # servers 为 None 表示全部服务器，exclude 中的服务器不适用
+        self.servers = servers
+        self.exclude = exclude or frozenset()
+        # 用户自定义规则的创建者；哪吒面板规则为 None，通知面板订阅者
+        self.owner = owner
+
+    def applies(self, server_id):
+        if server_id in self.exclude:
+            return False
+        return self.servers is None or server_id in self.servers
+
+
+def compile_user_rule(rule):
+    """将数据库中的用户规则编译为 CompiledRule"""
+    servers = frozenset([rule["server_id"]]) if rule["server_id"] else None
+    label = METRIC_LABELS[rule["metric"]][0]
+    return CompiledRule(
+        f"user:{rule['id']}",
+        f"规则 #{rule['id']} {label} {rule['op']} {rule['threshold']:g}",
+        rule["metric"],
+        rule["op"],
+        rule["threshold"],
+        rule["duration"],
+        servers,
+        owner=rule["telegram_id"],
+    )
+
+
+def compile_nezha_rules(data):
+    """
+    将 /alert-rule 返回的哪吒告警规则编译为 CompiledRule 列表。
+    哪吒规则在 value > max 或 value < min 时触发；cover 为 0 时适用于除 ignore 外的全部服务器，
+    为 1 时只适用于 ignore 中的服务器。不支持的规则类型会被跳过
+    """
+    compiled = []
+    if not data or not data.get("success"):
+        return compiled
+    for alert in data.get("data") or []:
+        if not alert.get("enable", True):
+            continue
+        for index, rule in enumerate(alert.get("rules") or []):
+            metric = NEZHA_RULE_TYPES.get(rule.get("type"))
+            if metric is None:
+                continue
+            ignore = frozenset(
+                int(server_id)
+                for server_id, flag in (rule.get("ignore") or {}).items()
+                if flag
+            )
+            if rule.get("cover", 0) == 0:
+                servers, exclude = None, ignore
+            else:
+                servers, exclude = ignore, None
+            key = f"nezha:{alert.get('id')}:{index}"
+            name = alert.get("name", "未命名规则")
+            duration = rule.get("duration") or 0
+            if metric == "offline":
+                compiled.append(
+                    CompiledRule(key, name, metric, ">=", 1, duration, servers, exclude)
+                )
+                continue
+            if rule.get("max"):
+                compiled.append(
+                    CompiledRule(
+                        f"{key}:max",
+                        name,
+                        metric,
+                        ">",
+                        rule["max"],
+                        duration,
+                        servers,
+                        exclude,
+                    )
+                )
+            if rule.get("min"):
+                compiled.append(
+                    CompiledRule(
+                        f"{key}:min",
+                        name,
+                        metric,
+                        "<",
+                        rule["min"],
+                        duration,
+                        servers,
+                        exclude,
+                    )
+                )
+    return compiled
+
+
+class AlertEngine:
+    """
+    本地告警引擎：按面板保存编译后的规则，对每次轮询得到的快照差异求值。
+    同一指标的规则共享一次取值；持续时间通过记录每个（规则, 服务器）首次越限的时间实现
+    """
+
+    def __init__(self):
+        # dashboard_id -> {metric: [CompiledRule, ...]}
+        self.rules = {}
+        # dashboard_id -> {rule.key: CompiledRule}
+        self.keys = {}
+        # dashboard_id -> {(rule.key, server_id): 首次越限时间}
+        self.windows = {}
+        # 规则有变化、下次需要对全部服务器求值的面板
+        self.dirty = set()
+
+    def set_rules(self, dashboard_id, rules):
+        by_metric = {}
+        for rule in rules:
+            by_metric.setdefault(rule.metric, []).append(rule)
+        if by_metric:
+            self.rules[dashboard_id] = by_metric
+            self.keys[dashboard_id] = {rule.key: rule for rule in rules}
+            self.dirty.add(dashboard_id)
+        else:
+            self.rules.pop(dashboard_id, None)
+            self.keys.pop(dashboard_id, None)
+        # 规则已不存在的窗口状态一并清除
+        keys = {rule.key for rule in rules}
+        windows = self.windows.get(dashboard_id, {})
+        for window_key in [k for k in windows if k[0] not in keys]:
+            del windows[window_key]
+
+    def evaluate(self, dashboard_id, delta, now):
+        """
+        对快照差异（delta.SnapshotDelta）求值，返回本次满足持续时间条件的
+        [(规则, 汇总行, 当前值), ...]。只重新计算新增与变化的服务器，其余服务器
+        只检查已越限窗口的持续时间；规则变更后的第一次求值覆盖全部服务器。
+        冷却与去重由调用方处理
+        """
+        by_metric = self.rules.get(dashboard_id)
+        if not by_metric:
+            return []
+        if dashboard_id in self.dirty:
+            self.dirty.discard(dashboard_id)
+            rows = delta.rows.values()
+        else:
+            rows = delta.updated
+        windows = self.windows.setdefault(dashboard_id, {})
+        id_index = _F["id"]
+        online_index = _F["online"]
+        evaluated = set()
+        fired = []
+        for row in rows:
+            server_id = row[id_index]
+            evaluated.add(server_id)
+            online = row[online_index]
+            for metric, rules in by_metric.items():
+                # 离线服务器的资源数据已过时，只参与离线规则
+                if not online and metric != "offline":
+                    for rule in rules:
+                        windows.pop((rule.key, server_id), None)
+                    continue
+                value = METRICS[metric](row)
+                for rule in rules:
+                    if not rule.applies(server_id):
+                        continue
+                    window_key = (rule.key, server_id)
+                    if rule.compare(value, rule.threshold):
+                        started = windows.setdefault(window_key, now)
+                        if now - started >= rule.duration:
+                            fired.append((rule, row, value))
+                    else:
+                        windows.pop(window_key, None)
+
+        # 未变化的服务器沿用上次的求值结果，只检查持续时间
+        keys = self.keys.get(dashboard_id, {})
+        for window_key, started in list(windows.items()):
+            rule_key, server_id = window_key
+            if server_id in evaluated:
+                continue
+            row = delta.rows.get(server_id)
+            rule = keys.get(rule_key)
+            # 服务器已移除或规则已删除（如恢复的旧窗口）时丢弃该窗口
+            if row is None or rule is None:
+                del windows[window_key]
+                continue
+            if now - started >= rule.duration:
+                fired.append((rule, row, METRICS[rule.metric](row)))
+        return fired
@@ -0,0 +1,86 @@
+"""
+冷启动基准：在全新子进程中测量导入 bot 模块、post_init（数据库初始化与规则加载）
+以及预热完成、就绪探针返回 200 所需的时间，取多次运行的中位数。
+不连接 Telegram，使用临时目录中的空数据库。
+
+用法：python benchmarks/cold_start.py [运行次数]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import asyncio, json, time
+start = time.perf_counter()
+import bot
+imported = time.perf_counter()
+
+from telegram.ext import ApplicationBuilder
+
+
+async def main():
+    application = ApplicationBuilder().token("0:benchmark").build()
+    await bot.post_init(application)
+    initialized = time.perf_counter()
+    await bot.warm_up(None)
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{bot.HEALTH_PORT}/readyz") as resp:
+            assert resp.status == 200, resp.status
+    ready = time.perf_counter()
+    await bot.post_shutdown(application)
+    print(json.dumps({
+        "import": imported - start,
+        "init": initialized - imported,
+        "ready": ready - start,
+    }))
+
+
+asyncio.run(main())
+"""
+
+
+def run_once(port):
+    with tempfile.TemporaryDirectory() as workdir:
+        os.mkdir(os.path.join(workdir, "db"))
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            TELEGRAM_TOKEN="0:benchmark",
+            HEALTH_PORT=str(port),
+            ALERT_POLL_INTERVAL="0",
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD],
+            cwd=workdir,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_once(18080 + i) for i in range(runs)]
+    print(f"运行次数: {runs}")
+    for key, label in (
+        ("import", "导入 bot 模块"),
+        ("init", "post_init"),
+        ("ready", "进程启动到就绪"),
+    ):
+        values = [r[key] * 1000 for r in results]
+        print(
+            f"{label:<12}中位数 {statistics.median(values):8.1f} ms  最大 {max(values):8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
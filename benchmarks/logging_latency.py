@@ -0,0 +1,127 @@
+"""
+日志阻塞基准：模拟并发的 /overview（等待上游后汇总服务器，每台服务器输出一条 is_online 日志），
+日志输出到每次写入都有固定延迟的慢速流，比较直接输出（原 logging.basicConfig）
+与队列输出（logs.setup_logging）时事件循环的阻塞情况，
+并以关闭逐台服务器日志（off）的结果作为汇总本身的基线。
+用每 5ms 唤醒一次的监测任务测量事件循环延迟，并统计全部请求完成所需时间。
+
+用法：python benchmarks/logging_latency.py [概览次数] [每次服务器数量] [写入延迟毫秒]
+"""
+
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logs import TEXT_FORMAT, setup_logging  # noqa: E402
+from models import ServerRecord  # noqa: E402
+from summary import summarize_servers  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from snapshot_memory import fake_server  # noqa: E402
+
+MONITOR_INTERVAL = 0.005
+
+
+class SlowStream:
+    """每次写入阻塞 delay 秒，模拟缓慢的 stdout 管道或磁盘"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.writes += 1
+
+    def flush(self):
+        pass
+
+
+async def monitor(lags, done):
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(MONITOR_INTERVAL)
+        lags.append(time.perf_counter() - start - MONITOR_INTERVAL)
+
+
+async def overview(records):
+    # 模拟等待面板响应
+    await asyncio.sleep(random.uniform(0, 0.05))
+    summarize_servers(records)
+    logging.getLogger("bot").info("概览已发送")
+
+
+async def run(records, overviews):
+    lags = []
+    done = asyncio.Event()
+    watcher = asyncio.ensure_future(monitor(lags, done))
+    start = time.perf_counter()
+    await asyncio.gather(*(overview(records) for _ in range(overviews)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await watcher
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "max_lag_ms": lags[-1] * 1000,
+        "p99_lag_ms": lags[int(len(lags) * 0.99) - 1] * 1000,
+        "median_lag_ms": statistics.median(lags) * 1000,
+    }
+
+
+def configure_direct(stream):
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+
+def main(overviews, servers, delay_ms):
+    random.seed(0)
+    records = [ServerRecord.from_api(fake_server(i)) for i in range(1, servers + 1)]
+    print(f"{overviews} 次并发概览，每次 {servers} 台服务器，每次写入延迟 {delay_ms}ms")
+    print(
+        f"{'输出方式':<8}{'总耗时(s)':>10}{'最大延迟(ms)':>14}"
+        f"{'p99(ms)':>10}{'中位数(ms)':>12}{'已写入':>8}{'丢弃':>8}"
+    )
+    for mode in ("off", "direct", "queue"):
+        stream = SlowStream(delay_ms / 1000)
+        listener = None
+        if mode == "queue":
+            listener = setup_logging(levels="summary=DEBUG", stream=stream)
+        else:
+            configure_direct(stream)
+        # 复现每台服务器一条在线判断日志的负载
+        logging.getLogger("summary").setLevel(
+            logging.INFO if mode == "off" else logging.DEBUG
+        )
+        result = asyncio.run(run(records, overviews))
+        written = stream.writes
+        dropped = 0
+        if listener is not None:
+            dropped = logging.getLogger().handlers[0].dropped
+            # 停止前丢弃积压，不计入结果
+            while not listener.queue.empty():
+                listener.queue.get_nowait()
+            listener.stop()
+        print(
+            f"{mode:<8}{result['elapsed']:>10.2f}{result['max_lag_ms']:>14.1f}"
+            f"{result['p99_lag_ms']:>10.1f}{result['median_lag_ms']:>12.2f}"
+            f"{written:>8}{dropped:>8}"
+        )
+
+
+if __name__ == "__main__":
+    args = [float(arg) for arg in sys.argv[1:4]]
+    defaults = [50, 200, 0.2]
+    overviews, servers, delay_ms = args + defaults[len(args) :]
+    main(int(overviews), int(servers), delay_ms)
@@ -0,0 +1,56 @@
+"""
+搜索索引基准：在指定数量的服务器上测量 SearchIndex.search 的耗时，
+覆盖直接匹配、模糊匹配与无结果的查询。内联查询在每次按键时都会在事件循环中执行搜索，
+任一查询的最长耗时超过预算时以非零状态退出。
+
+用法：python benchmarks/search.py [服务器数量] [预算毫秒]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import ServerRecord  # noqa: E402
+from search import SearchIndex  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from snapshot_memory import fake_server  # noqa: E402
+
+QUERIES = ("web-", "xyzq", "node-99", "nod-99", "hk12", "webb-12", "debian", "1")
+PREFIXES = ("web", "db", "node", "cache", "hk", "jp", "us")
+ROUNDS = 5
+
+
+def main(count, budget_ms):
+    random.seed(0)
+    servers = []
+    for server_id in range(1, count + 1):
+        server = fake_server(server_id)
+        server["name"] = f"{random.choice(PREFIXES)}-{server_id}"
+        servers.append(ServerRecord.from_api(server))
+    index = SearchIndex(servers)
+
+    print(f"{count} 台服务器，每个查询 {ROUNDS} 次，预算 {budget_ms}ms")
+    print(f"{'查询':<10}{'最长(ms)':>10}{'结果数':>8}")
+    worst = 0
+    for query in QUERIES:
+        durations = []
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            results = index.search(query)
+            durations.append((time.perf_counter() - start) * 1000)
+        worst = max(worst, max(durations))
+        print(f"{query:<10}{max(durations):>10.2f}{len(results):>8}")
+    if worst > budget_ms:
+        print(f"超出预算：最长 {worst:.2f}ms > {budget_ms}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    args = [float(arg) for arg in sys.argv[1:3]]
+    defaults = [10000, 50]
+    count, budget_ms = args + defaults[len(args) :]
+    main(int(count), budget_ms)
@@ -0,0 +1,109 @@
+"""
+缓存快照内存占用基准：对比 10k 台服务器的 /server 响应以原始嵌套字典、
+紧凑行（状态后端中保存的格式）与 ServerRecord 列表保存时的单台服务器内存占用。
+
+用法：python benchmarks/snapshot_memory.py [服务器数量]
+"""
+
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import ServerRecord, compact_servers, parse_server_records  # noqa: E402
+
+
+def fake_server(server_id):
+    """构造与哪吒 v1 /server 返回结构一致的服务器数据"""
+    return {
+        "id": server_id,
+        "name": f"server-{server_id:05d}",
+        "uuid": f"{random.getrandbits(128):032x}",
+        "note": "",
+        "public_note": "",
+        "display_index": 0,
+        "hide_for_guest": False,
+        "enable_ddns": False,
+        "last_active": "2026-10-19T08:00:00.123456789+08:00",
+        "host": {
+            "platform": "debian",
+            "platform_version": "12",
+            "cpu": ["AMD EPYC 7763 64-Core Processor 2 Virtual Core"],
+            "gpu": None,
+            "mem_total": 4 * 1024**3,
+            "disk_total": 80 * 1024**3,
+            "swap_total": 1024**3,
+            "arch": "x86_64",
+            "virtualization": "kvm",
+            "boot_time": 1760000000,
+            "version": "1.0.0",
+        },
+        "state": {
+            "cpu": random.random() * 100,
+            "mem_used": random.randrange(4 * 1024**3),
+            "swap_used": random.randrange(1024**3),
+            "disk_used": random.randrange(80 * 1024**3),
+            "net_in_transfer": random.randrange(1024**4),
+            "net_out_transfer": random.randrange(1024**4),
+            "net_in_speed": random.randrange(1024**2),
+            "net_out_speed": random.randrange(1024**2),
+            "uptime": random.randrange(10**7),
+            "load_1": random.random() * 4,
+            "load_5": random.random() * 4,
+            "load_15": random.random() * 4,
+            "tcp_conn_count": random.randrange(1000),
+            "udp_conn_count": random.randrange(100),
+            "process_count": random.randrange(500),
+            "temperatures": None,
+            "gpu": None,
+        },
+        "geoip": {
+            "ip": {
+                "ipv4_addr": f"203.0.{server_id // 256 % 256}.{server_id % 256}",
+                "ipv6_addr": "",
+            },
+            "country_code": "hk",
+        },
+    }
+
+
+def measure(build):
+    """返回 build() 结果在内存中保留的字节数"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(0)
+    payload = json.dumps(
+        {"success": True, "data": [fake_server(i) for i in range(1, count + 1)]}
+    )
+
+    raw, raw_bytes = measure(lambda: json.loads(payload))
+    compact, compact_bytes = measure(lambda: compact_servers(json.loads(payload)))
+    # 中间结果在构建后释放，只统计记录本身（含字符串）保留的内存
+    records, record_bytes = measure(
+        lambda: parse_server_records(compact_servers(json.loads(payload)))
+    )
+    assert len(records) == count and isinstance(records[0], ServerRecord)
+
+    print(f"服务器数量: {count}")
+    for label, size in (
+        ("原始嵌套字典", raw_bytes),
+        ("紧凑行", compact_bytes),
+        ("ServerRecord", record_bytes),
+    ):
+        print(f"{label:<14}{size / 1024**2:8.2f} MiB  {size / count:8.0f} B/台")
+    print(f"ServerRecord 相比原始字典减少 {(1 - record_bytes / raw_bytes) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
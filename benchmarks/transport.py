@@ -0,0 +1,110 @@
+"""
+传输层基准：在本地启动一个模拟哪吒面板的 aiohttp 服务（/api/v1/server 返回指定数量的服务器，
+可附加固定延迟），分别用 aiohttp 与 httpx 传输发起多轮并发请求，
+比较吞吐、延迟分位数以及服务端观察到的 TCP 连接数。
+
+本地模拟服务只提供明文 HTTP/1.1；httpx 的 HTTP/2 多路复用需要面板经 HTTPS（ALPN）提供 HTTP/2
+并安装 h2，此时同一面板的并发请求只占用一个连接。
+
+用法：python benchmarks/transport.py [并发数] [轮数] [服务器数量] [延迟毫秒]
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+from transport import TRANSPORTS
+
+
+def fake_servers(count):
+    return [
+        {
+            "id": i,
+            "name": f"server-{i}",
+            "host": {"platform": "debian", "cpu": ["4 Virtual Core"], "mem_total": 8 << 30},
+            "state": {"cpu": 12.5, "mem_used": 3 << 30, "net_in_speed": 1024 * i},
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+async def start_server(count, delay):
+    body = json.dumps({"success": True, "data": fake_servers(count)})
+    connections = set()
+
+    async def server(request):
+        connections.add(id(request.transport))
+        if delay:
+            await asyncio.sleep(delay)
+        return web.Response(text=body, content_type="application/json")
+
+    app = web.Application()
+    app.router.add_get("/api/v1/server", server)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/api/v1/server", connections
+
+
+async def run(name, url, connections, concurrency, rounds):
+    transport = TRANSPORTS[name]()
+    connections.clear()
+    latencies = []
+
+    async def one():
+        start = time.perf_counter()
+        status, data = await transport.request("GET", url)
+        assert status == 200 and data["success"], status
+        latencies.append(time.perf_counter() - start)
+
+    try:
+        # 预热一次，建立连接池
+        await one()
+        latencies.clear()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await asyncio.gather(*(one() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await transport.close()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "connections": len(connections),
+    }
+
+
+async def main(concurrency, rounds, count, delay_ms):
+    runner, url, connections = await start_server(count, delay_ms / 1000)
+    try:
+        print(
+            f"并发 {concurrency}，{rounds} 轮，每个响应 {count} 台服务器，"
+            f"服务端延迟 {delay_ms}ms"
+        )
+        print(f"{'传输':<8}{'请求数':>8}{'请求/秒':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'连接数':>8}")
+        for name in TRANSPORTS:
+            result = await run(name, url, connections, concurrency, rounds)
+            print(
+                f"{name:<8}{result['requests']:>8}{result['rps']:>10.1f}"
+                f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['connections']:>8}"
+            )
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:5]]
+    defaults = [20, 10, 200, 20]
+    asyncio.run(main(*(args + defaults[len(args):])))
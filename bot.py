@@ -1,39 +1,97 @@
 import asyncio
+import contextvars
+import hashlib
 import logging
 import math
+import re
+import signal
+import socket
 import time
 from datetime import datetime, timezone
-from dateutil import parser
 from dotenv import load_dotenv
-import pytz
 import os
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    CallbackQuery,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
+)
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
+    InlineQueryHandler,
     ContextTypes,
+    TypeHandler,
     filters,
 )
+from telegram.error import BadRequest
 
 from nezha_api import NezhaAPI
 from database import Database
-
-# 配置日志
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+from vault import CredentialVault, load_key
+from ratelimit import UpstreamLimiter, current_user
+from pagination import ResultPages
+from state import ShardCoordinator, create_state_backend
+from summary import SERVER_FIELDS, is_online, summarize_servers
+from health import HealthServer
+from outbox import AlertDigest, OutboundRateLimiter
+from persistence import SQLitePersistence
+from render import RenderCache
+from snapshots import WarmSnapshotStore
+from conversations import ConversationStore
+from updates import UserOrderedApplication
+from logs import DEFAULT_LOG_LEVELS, bind_log_context, log_context, setup_logging
+from top import DEFAULT_TOP_N, MAX_TOP_N, TOP_METRICS, top_servers
+from export import (
+    FORMATS,
+    HISTORY_COLUMNS,
+    SERVER_COLUMNS,
+    THREAD_THRESHOLD,
+    encode,
+    history_rows,
+    server_rows,
+    write_export,
+)
+from thresholds import TrafficThresholds
+from cycles import CycleTracker, compact_cycles
+from delta import SnapshotDiffer
+from services import HistoryCache, availability_windows, summarize_histories
+from alerts import (
+    METRIC_LABELS,
+    METRICS,
+    OPERATORS,
+    AlertEngine,
+    compile_nezha_rules,
+    compile_user_rule,
+    parse_duration,
+    parse_threshold,
 )
-logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# 配置日志：记录经队列交给后台线程格式化与输出，慢速的 stdout 或磁盘不会阻塞事件循环
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    levels=os.getenv("LOG_LEVELS", DEFAULT_LOG_LEVELS),
+    samples=os.getenv("LOG_SAMPLE", ""),
+    fmt=os.getenv("LOG_FORMAT", "text"),
+)
+logger = logging.getLogger(__name__)
+
 # 定义常量和配置
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 DATABASE_PATH = "db/users.db"
-# 从环境变量读取流量告警阈值 (GB)，默认为 0 (不告警)
+# 未设置 ENCRYPTION_KEY 时使用的密钥文件
+ENCRYPTION_KEY_PATH = "db/secret.key"
+# 从环境变量读取全局默认流量告警阈值 (GB)，默认为 0 (不告警)。
+# 面板与单台服务器的阈值可通过 /threshold 命令单独设置
 UPLOAD_ALERT_THRESHOLD_GB = float(os.getenv("UPLOAD_ALERT_THRESHOLD_GB", 0))
 DOWNLOAD_ALERT_THRESHOLD_GB = float(os.getenv("DOWNLOAD_ALERT_THRESHOLD_GB", 0))
 
@@ -41,30 +99,559 @@ UPLOAD_ALERT_THRESHOLD_BYTES = UPLOAD_ALERT_THRESHOLD_GB * (1024**3)
 DOWNLOAD_ALERT_THRESHOLD_BYTES = DOWNLOAD_ALERT_THRESHOLD_GB * (1024**3)
 
 
+# 状态后端：留空使用进程内状态，多实例部署时设置为 redis://host:6379/0
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+# 实例标识，多实例部署时用于分片
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# 设置后使用 webhook 接收更新，多个实例可以位于同一负载均衡之后
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+# 每个面板地址的上游请求速率（次/秒）与突发上限，超出时返回最近的快照
+UPSTREAM_RATE = float(os.getenv("UPSTREAM_RATE", 2))
+UPSTREAM_BURST = int(os.getenv("UPSTREAM_BURST", 10))
+# 同时处理的更新数量：排队等待面板令牌或发送配额的更新不会阻塞其他用户，
+# 上游请求在用户之间公平轮转；同一用户的更新仍按顺序处理
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 64))
+
+
 # 定义阶段
 BIND_USERNAME, BIND_PASSWORD, BIND_DASHBOARD, BIND_ALIAS = range(4)
-SEARCH_SERVER = range(1)
+SEARCH_SERVER = 0
+
+# /server 搜索结果上限，超过一页时分页显示
+SERVER_SEARCH_LIMIT = 100
+
+# 内联查询结果在 Telegram 侧的缓存时间（秒）
+INLINE_CACHE_TIME = 10
 
 # 群组消息存活时间（秒）
 GROUP_MESSAGE_LIFETIME = 180  # 3分钟
+# 群组中同一面板的 /overview、/services 在该时间（秒）内重复发送时，
+# 不再请求面板与发送新结果，而是回复指向已有的结果消息，0 表示关闭
+COMMAND_DEDUP_WINDOW = int(os.getenv("COMMAND_DEDUP_WINDOW", 60))
+
+# 待删除消息的检查间隔（秒）
+DELETION_CHECK_INTERVAL = 5
+
+# 实例心跳间隔与过期时间（秒）
+WORKER_HEARTBEAT_INTERVAL = 15
+WORKER_HEARTBEAT_TTL = 45
+
+# 告警轮询间隔（秒，0 为关闭）与同一告警的冷却时间（秒）
+ALERT_POLL_INTERVAL = int(os.getenv("ALERT_POLL_INTERVAL", 60))
+ALERT_COOLDOWN = int(os.getenv("ALERT_COOLDOWN", 3600))
+# 同一会话在该时间（秒）内的告警合并为一条摘要发送，0 表示逐条发送
+ALERT_DIGEST_WINDOW = int(os.getenv("ALERT_DIGEST_WINDOW", 10))
+
+# 循环流量预计在多少小时内耗尽时提前告警，0 表示不告警
+CYCLE_WARN_HOURS = float(os.getenv("CYCLE_WARN_HOURS", 72))
+
+# 面板中配置的告警规则的重新加载间隔（秒）
+NEZHA_RULE_REFRESH_INTERVAL = 600
+
+# 后台轮询使用的子进程数量，0 表示在主事件循环中轮询
+POLLER_PROCESSES = int(os.getenv("POLLER_PROCESSES", 0))
+# 轮询得到的汇总结果在该时间（秒）内直接用于 /overview，不再请求面板
+SUMMARY_MAX_AGE = int(os.getenv("SUMMARY_MAX_AGE", 10))
+# 获取概览时等待面板的最长时间（秒），超时或失败时先返回最近一次的快照，请求在后台继续完成
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", 5))
+# 面板快照写入数据库的间隔（秒）
+SNAPSHOT_SAVE_INTERVAL = 300
+# 多步对话（如 /bind）无操作超过该时间（秒）后结束，已输入的内容随之清除
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", 600))
+# 对话数据批量写入数据库的间隔（秒）
+CONVERSATION_SAVE_INTERVAL = 30
+
+# 健康检查端口（/healthz 存活探针、/readyz 就绪探针），0 表示不启用
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", 0))
+# 启动预热：预先连接最近活跃用户的默认面板
+WARMUP_WINDOW = 24 * 3600  # 只预热该时间（秒）内活跃过的用户
+WARMUP_LIMIT = int(os.getenv("WARMUP_LIMIT", 50))
+WARMUP_CONCURRENCY = 10
+WARMUP_TIMEOUT = 15
+# 收到停止信号后等待正在处理的更新完成的最长时间（秒）
+DRAIN_TIMEOUT = int(os.getenv("DRAIN_TIMEOUT", 20))
+
+# 用户活跃时间写入数据库的最小间隔（秒）
+ACTIVITY_UPDATE_INTERVAL = 600
+# 处理时间超过该值（秒）的更新以 INFO 级别记录，其余为 DEBUG
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", 1))
+# 当前更新开始处理的时间，用于记录处理耗时
+update_started = contextvars.ContextVar("update_started", default=None)
+
+# 后台刷新 token 的检查间隔与提前量（秒）
+TOKEN_REFRESH_INTERVAL = 60
+TOKEN_REFRESH_MARGIN = 300
 
 # 初始化数据库
-db = Database(DATABASE_PATH)
+db = Database(DATABASE_PATH, CredentialVault(load_key(ENCRYPTION_KEY_PATH)))
+
+# 服务器、计划任务列表的分页结果缓存
+result_pages = ResultPages()
+
+# 运行状态（快照、限流计数、待删除消息、告警去重），多实例部署时共享
+state = create_state_backend(STATE_BACKEND)
+coordinator = ShardCoordinator(state, WORKER_ID, WORKER_HEARTBEAT_TTL)
+
+# 多进程轮询器，在 post_init 中按需创建，未启用时为 None
+sharded_poller = None
+
+# 启动阶段与健康检查探针
+health = HealthServer(HEALTH_PORT)
+
+# telegram_id -> 最近一次写入数据库的活跃时间
+user_activity = {}
+
+# 是否正在停机排空
+draining = False
+
+# 告警发送前按会话合并
+alert_digest = AlertDigest(ALERT_DIGEST_WINDOW)
+
+# 本地告警引擎，以及规则的内存副本（规则变更时从数据库重新加载）
+alert_engine = AlertEngine()
+# dashboard_id -> [用户规则]
+user_alert_rules = {}
+# dashboard_id -> 订阅面板告警的 telegram_id 集合
+alert_subscribers = {}
+# dashboard_id -> (加载时间, [面板中配置的规则])
+nezha_alert_rules = {}
+# dashboard_id -> {(rule_key, server_id): 开始时间}，停机前面板规则的告警窗口，
+# 面板规则在轮询时才加载，加载后再恢复
+pending_alert_windows = {}
+
+# 后台轮询的快照差异计算，告警只处理有变化的服务器
+snapshot_differ = SnapshotDiffer()
+
+# 循环流量跟踪，用于计算消耗速率与预计耗尽时间
+cycle_tracker = CycleTracker()
+
+# 服务监测历史汇总缓存，按 (dashboard_id, server_id) 保存
+history_cache = HistoryCache()
+
+# 概览、服务器详情与可用性的渲染结果，按快照版本在用户之间共用
+render_cache = RenderCache()
+
+# 每个面板最近一次的概览汇总，持久化到数据库，面板不可用时降级使用
+warm_store = WarmSnapshotStore(db)
+# 多步对话中已输入的内容，按用户保存，过期或对话结束时清除
+conversation_store = ConversationStore(db, CONVERSATION_TTL)
+# dashboard_id -> 正在进行的概览刷新任务，并发请求共同等待
+summary_refreshes = {}
+
+# 流量阈值查找表，阈值变更时从数据库重新加载
+traffic_thresholds = TrafficThresholds(
+    UPLOAD_ALERT_THRESHOLD_BYTES, DOWNLOAD_ALERT_THRESHOLD_BYTES
+)
+
+# 上游限流器，同一面板地址的所有会话共享
+upstream_limiter = UpstreamLimiter(state, UPSTREAM_RATE, UPSTREAM_BURST)
+
+# NezhaAPI 会话缓存（按 dashboard id），复用已解密的凭据与有效 token
+api_sessions = {}
+
+
+def get_api(user):
+    """获取 dashboard 对应的 NezhaAPI 会话，不存在时创建"""
+    dashboard_id = user["id"]
+    api = api_sessions.get(dashboard_id)
+    if api is None:
+
+        async def save_token(token, token_expires):
+            await db.save_token(dashboard_id, token, token_expires)
+
+        api = NezhaAPI(
+            user["dashboard_url"],
+            user["username"],
+            user["password"],
+            token=user["token"],
+            token_expires=user["token_expires"],
+            on_token=save_token,
+            limiter=upstream_limiter,
+            state=state,
+            cache_key=f"dashboard:{dashboard_id}",
+        )
+        api_sessions[dashboard_id] = api
+    return api
+
+
+async def refresh_tokens(context: ContextTypes.DEFAULT_TYPE):
+    """
+    后台任务：在 token 过期前主动刷新，避免空闲后首个请求多一次往返
+    """
+
+    async def refresh(dashboard_id, api):
+        try:
+            await api.authenticate(margin=TOKEN_REFRESH_MARGIN)
+        except Exception as e:
+            logger.warning(f"刷新面板 {dashboard_id} 的 token 失败: {e}")
+
+    await asyncio.gather(
+        *(
+            refresh(dashboard_id, api)
+            for dashboard_id, api in list(api_sessions.items())
+        )
+    )
+
+
+async def worker_heartbeat(context: ContextTypes.DEFAULT_TYPE):
+    """后台任务：上报实例心跳并更新分片所需的存活实例列表"""
+    try:
+        await coordinator.heartbeat()
+    except Exception as e:
+        logger.warning(f"上报实例心跳失败: {e}")
+
 
+async def fetch_summary(api, dashboard_id):
+    """请求 /server 并在本地汇总，结果写入状态后端与面板快照"""
+    records = await api.get_server_records()
+    if records is None:
+        return None
+    summary = summarize_servers(records, await api.get_group_map())
+    await state.set_snapshot(f"{api.cache_key}/summary", summary, api.SNAPSHOT_TTL)
+    warm_store.put(dashboard_id, summary)
+    return summary
 
-# 添加获取当前时间函数
-def get_localized_time_string():
+
+def summary_refresh_done(dashboard_id, task):
+    summary_refreshes.pop(dashboard_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"刷新面板 {dashboard_id} 的概览失败: {task.exception()}")
+
+
+async def get_summary(api, dashboard_id):
+    """
+    获取面板的概览统计：后台轮询的汇总结果足够新时直接使用，
+    否则请求 /server 并在本地汇总。
+    面板请求失败或超过 UPSTREAM_DEADLINE 时，返回最近一次的汇总并标记 stale，
+    请求在后台继续完成并更新快照
+    """
+    summary = await state.get_snapshot(f"{api.cache_key}/summary")
+    if summary and time.time() - summary["fetched_at"] <= SUMMARY_MAX_AGE:
+        return summary
+    task = summary_refreshes.get(dashboard_id)
+    if task is None:
+        task = asyncio.ensure_future(fetch_summary(api, dashboard_id))
+        summary_refreshes[dashboard_id] = task
+        task.add_done_callback(lambda t: summary_refresh_done(dashboard_id, t))
+
+    error = None
+    try:
+        fresh = await asyncio.wait_for(asyncio.shield(task), UPSTREAM_DEADLINE)
+        if fresh is not None:
+            return fresh
+    except asyncio.TimeoutError:
+        logger.info(f"面板 {dashboard_id} 响应超过 {UPSTREAM_DEADLINE} 秒，返回快照")
+    except Exception as e:
+        error = e
+
+    stale = summary or warm_store.get(dashboard_id)
+    if stale is None:
+        if error is not None:
+            raise error
+        # 没有可用的快照，只能继续等待本次请求
+        return await asyncio.shield(task)
+    return dict(stale, stale=True)
+
+
+async def poll_dashboard(dashboard):
+    """在主进程中轮询单个面板，结果格式与 poller.poll_partition 相同"""
+    api = get_api(dashboard)
+    result = {"id": dashboard["id"]}
+    try:
+        records = await api.get_server_records()
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    if records is None:
+        result["error"] = "获取服务器信息失败"
+        return result
+    result["summary"] = summarize_servers(records, await api.get_group_map())
+    # 循环流量统计获取失败不影响概览与告警
+    try:
+        result["cycles"] = compact_cycles(await api.get_services_status())
+    except Exception:
+        result["cycles"] = None
+    result["token"] = api.token
+    result["token_expires"] = api.token_expires
+    return result
+
+
+async def send_traffic_alerts(context, dashboard, rows):
+    """
+    流量超过阈值时通知面板所有者，冷却时间内同一告警只发送一次。
+    后台轮询只传入快照差异中新增与变化的服务器
+    """
+    id_index = SERVER_FIELDS.index("id")
+    name_index = SERVER_FIELDS.index("name")
+    checks = (
+        ("out", "上行", SERVER_FIELDS.index("net_out_transfer"), 0),
+        ("in", "下行", SERVER_FIELDS.index("net_in_transfer"), 1),
+    )
+    for row in rows:
+        limits = traffic_thresholds.get(dashboard["id"], row[id_index])
+        for direction, label, index, limit_index in checks:
+            value = row[index]
+            threshold = limits[limit_index]
+            if threshold <= 0 or value <= threshold:
+                continue
+            # 多实例共享去重状态
+            alert_key = f"traffic:{dashboard['id']}:{row[id_index]}:{direction}"
+            if not await state.mark_alert(alert_key, ALERT_COOLDOWN):
+                continue
+            await alert_digest.add(
+                context.bot,
+                dashboard["telegram_id"],
+                f"🚨 [{dashboard['alias']}] 服务器 {row[name_index]} {label}流量超限: "
+                f"{format_bytes(value)} / {format_bytes(threshold)}",
+            )
+
+
+async def recheck_traffic_alerts(context, dashboard):
+    """
+    阈值变更后按最近一次的汇总检查全部服务器，
+    已超过新阈值的服务器不必等到流量再次变化才告警
+    """
+    summary = await state.get_snapshot(
+        f"dashboard:{dashboard['id']}/summary"
+    ) or warm_store.get(dashboard["id"])
+    if summary:
+        await send_traffic_alerts(context, dashboard, summary["servers"])
+
+
+def apply_alert_rules(dashboard_id):
+    """合并用户规则与面板规则，更新告警引擎"""
+    rules = list(user_alert_rules.get(dashboard_id, []))
+    if alert_subscribers.get(dashboard_id):
+        rules += nezha_alert_rules.get(dashboard_id, (0, []))[1]
+    alert_engine.set_rules(dashboard_id, rules)
+
+
+async def load_traffic_thresholds():
+    """从数据库整体加载流量阈值到内存查找表"""
+    traffic_thresholds.load(await db.get_traffic_thresholds())
+
+
+async def load_alert_rules():
+    """从数据库加载用户告警规则与订阅"""
+    user_alert_rules.clear()
+    for rule in await db.get_alert_rules():
+        user_alert_rules.setdefault(rule["dashboard_id"], []).append(
+            compile_user_rule(rule)
+        )
+    alert_subscribers.clear()
+    for telegram_id, dashboard_id in await db.get_alert_subscriptions():
+        alert_subscribers.setdefault(dashboard_id, set()).add(telegram_id)
+    for dashboard_id in (
+        set(alert_engine.rules) | set(user_alert_rules) | set(alert_subscribers)
+    ):
+        apply_alert_rules(dashboard_id)
+
+
+async def refresh_nezha_alert_rules(dashboard):
+    """有订阅者时定期重新加载面板中配置的告警规则"""
+    dashboard_id = dashboard["id"]
+    if not alert_subscribers.get(dashboard_id):
+        return
+    loaded_at = nezha_alert_rules.get(dashboard_id, (0, []))[0]
+    if time.time() - loaded_at < NEZHA_RULE_REFRESH_INTERVAL:
+        return
+    try:
+        data = await get_api(dashboard).get_alert_rules()
+    except Exception as e:
+        logger.warning(f"获取面板 {dashboard_id} 的告警规则失败: {e}")
+        return
+    nezha_alert_rules[dashboard_id] = (time.time(), compile_nezha_rules(data))
+    apply_alert_rules(dashboard_id)
+    # 恢复停机前的窗口，面板中已删除的规则的窗口丢弃
+    pending = pending_alert_windows.pop(dashboard_id, None)
+    if pending:
+        keys = alert_engine.keys.get(dashboard_id, {})
+        alert_engine.windows.setdefault(dashboard_id, {}).update(
+            (window_key, started)
+            for window_key, started in pending.items()
+            if window_key[0] in keys
+        )
+
+
+def format_metric_value(metric, value):
+    unit = METRIC_LABELS[metric][1]
+    if unit == "percent":
+        return f"{value:.1f}%"
+    if unit == "bytes":
+        return format_bytes(value)
+    if unit == "speed":
+        return f"{format_bytes(value)}/s"
+    return f"{value:g}"
+
+
+async def send_rule_alerts(context, dashboard, delta):
+    """对快照差异求值告警规则，并在冷却时间外通知规则创建者或面板订阅者"""
+    id_index = SERVER_FIELDS.index("id")
+    name_index = SERVER_FIELDS.index("name")
+    for rule, row, value in alert_engine.evaluate(dashboard["id"], delta, time.time()):
+        recipients = (
+            [rule.owner] if rule.owner else alert_subscribers.get(dashboard["id"], ())
+        )
+        if not recipients:
+            continue
+        alert_key = f"rule:{dashboard['id']}:{rule.key}:{row[id_index]}"
+        if not await state.mark_alert(alert_key, ALERT_COOLDOWN):
+            continue
+        label = METRIC_LABELS[rule.metric][0]
+        if rule.metric == "offline":
+            detail = "已离线"
+        else:
+            detail = (
+                f"{label} {format_metric_value(rule.metric, value)} "
+                f"{rule.op} {format_metric_value(rule.metric, rule.threshold)}"
+            )
+        text = (
+            f"🚨 [{dashboard['alias']}] {rule.name}\n服务器 {row[name_index]}：{detail}"
+        )
+        for chat_id in recipients:
+            await alert_digest.add(context.bot, chat_id, text)
+
+
+def format_duration(seconds):
+    if seconds < 3600:
+        return f"{max(seconds, 0) / 60:.0f} 分钟"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} 小时"
+    return f"{seconds / 86400:.1f} 天"
+
+
+async def send_cycle_alerts(context, dashboard, changed):
+    """只检查本次流量有变化的服务器，预计在周期结束前耗尽时提前通知面板所有者"""
+    if CYCLE_WARN_HOURS <= 0:
+        return
+    now = time.time()
+    for key in changed:
+        _, rule_id, server_id = key
+        rate, exhausted_at = cycle_tracker.projection(key, now)
+        if exhausted_at is None:
+            continue
+        rule = cycle_tracker.rules[dashboard["id"]][rule_id]
+        if rule["to"] and exhausted_at >= rule["to"]:
+            continue
+        if exhausted_at - now > CYCLE_WARN_HOURS * 3600:
+            continue
+        alert_key = f"cycle:{dashboard['id']}:{rule_id}:{server_id}"
+        if not await state.mark_alert(alert_key, ALERT_COOLDOWN):
+            continue
+        name = rule["server_name"].get(server_id, f"服务器ID {server_id}")
+        if exhausted_at <= now:
+            detail = "已用尽"
+        else:
+            detail = (
+                f"按当前速率 {format_bytes(rate * 86400)}/天，"
+                f"预计 {format_duration(exhausted_at - now)} 后耗尽"
+            )
+        await alert_digest.add(
+            context.bot,
+            dashboard["telegram_id"],
+            f"⏳ [{dashboard['alias']}] 循环流量规则 {rule['name']}：服务器 {name} "
+            f"已使用 {format_bytes(rule['transfer'][server_id])} / {format_bytes(rule['max'])}，{detail}",
+        )
+
+
+def needs_polling(dashboard_id):
+    """
+    开启循环流量耗尽预警（同时记录循环流量采样），或面板有告警规则、
+    流量阈值、规则订阅时才需要后台轮询
+    """
+    return bool(
+        CYCLE_WARN_HOURS > 0
+        or dashboard_id in alert_engine.rules
+        or alert_subscribers.get(dashboard_id)
+        or traffic_thresholds.active(dashboard_id)
+    )
+
+
+async def poll_dashboards(context: ContextTypes.DEFAULT_TYPE):
+    """
+    后台任务：轮询本实例负责且需要检查告警的面板，保存汇总结果并检查告警。
+    设置 POLLER_PROCESSES 时请求与汇总在子进程中完成。
+    单个面板处理失败只记录日志，不影响其余面板
+    """
+    dashboards = [
+        d
+        for d in await db.get_dashboards()
+        if coordinator.owns(d["id"]) and needs_polling(d["id"])
+    ]
+    if sharded_poller is not None:
+        results = await sharded_poller.poll(dashboards)
+    else:
+        results = await asyncio.gather(
+            *(poll_dashboard(d) for d in dashboards), return_exceptions=True
+        )
+        results = [
+            {"id": d["id"], "error": str(r)} if isinstance(r, Exception) else r
+            for d, r in zip(dashboards, results)
+        ]
+
+    by_id = {d["id"]: d for d in dashboards}
+    for result in results:
+        dashboard = by_id[result["id"]]
+        if "error" in result:
+            logger.warning(f"轮询面板 {dashboard['id']} 失败: {result['error']}")
+            continue
+        try:
+            await handle_poll_result(context, dashboard, result)
+        except Exception:
+            logger.exception(f"处理面板 {dashboard['id']} 的轮询结果失败")
+
+
+async def handle_poll_result(context, dashboard, result):
+    """保存一个面板的轮询结果并检查告警"""
+    # 子进程中刷新过的 token 同样持久化
+    if result["token"] != dashboard["token"]:
+        await db.save_token(dashboard["id"], result["token"], result["token_expires"])
+    summary = result["summary"]
+    delta = snapshot_differ.diff(dashboard["id"], summary)
+    summary["version"] = delta.version
+    await state.set_snapshot(
+        f"dashboard:{dashboard['id']}/summary", summary, NezhaAPI.SNAPSHOT_TTL
+    )
+    warm_store.put(dashboard["id"], summary)
+    await send_traffic_alerts(context, dashboard, delta.updated)
+    await refresh_nezha_alert_rules(dashboard)
+    await send_rule_alerts(context, dashboard, delta)
+    if result.get("cycles") is not None:
+        changed = cycle_tracker.update(
+            dashboard["id"], result["cycles"], summary["fetched_at"]
+        )
+        await send_cycle_alerts(context, dashboard, changed)
+
+
+async def close_api(dashboard_id):
+    """关闭并移除 dashboard 对应的 NezhaAPI 会话及上一次的快照"""
+    snapshot_differ.forget(dashboard_id)
+    api = api_sessions.pop(dashboard_id, None)
+    if api is not None:
+        await api.close()
+
+
+# 添加获取当前时间函数，传入时间戳时格式化该时间
+def get_localized_time_string(timestamp=None):
     tz_str = os.environ.get("TZ")
+    if timestamp is None:
+        timestamp = time.time()
 
     if tz_str:
+        # 延迟导入，缩短启动时间
+        import pytz
+
         try:
             tz = pytz.timezone(tz_str)
-            localized_time = datetime.now(tz)
+            localized_time = datetime.fromtimestamp(timestamp, tz)
             return localized_time.strftime("%Y-%m-%d %H:%M:%S %Z%z")
         except pytz.exceptions.UnknownTimeZoneError:
             return "Error: Invalid Time Zone in TZ environment variable."
     else:
-        utc_time = datetime.utcnow()
+        utc_time = datetime.fromtimestamp(timestamp, timezone.utc)
         return utc_time.strftime("%Y-%m-%d %H:%M:%S UTC")
 
 
@@ -80,29 +667,6 @@ def format_bytes(size_in_bytes):
     return formatted_size
 
 
-def is_online(server):
-    """根据last_active判断服务器是否在线，如果最后活跃时间在10秒内则为在线。"""
-    now_utc = datetime.now(timezone.utc)
-    last_active_str = server.get("last_active")
-    if not last_active_str:
-        return False
-    try:
-        last_active_dt = parser.isoparse(last_active_str)
-    except ValueError:
-        return False
-    last_active_utc = last_active_dt.astimezone(timezone.utc)
-    diff = now_utc - last_active_utc
-    is_on = diff.total_seconds() < 10
-    logger.info(
-        "Checking online: diff=%s now=%s last=%s is_online=%s",
-        diff,
-        now_utc,
-        last_active_utc,
-        is_on,
-    )
-    return is_on
-
-
 # 添加 IP 地址掩码函数
 def mask_ipv4(ipv4_address):
     if ipv4_address == "未知" or ipv4_address == "❌":
@@ -126,6 +690,327 @@ def mask_ipv6(ipv6_address):
     return masked_ip
 
 
+def format_server_detail(server):
+    """根据 ServerRecord 构建单台服务器的详情文本"""
+    status = "❇️在线" if is_online(server) else "❌离线"
+
+    # 对 IP 地址进行掩码处理
+    ipv4 = mask_ipv4(server.ipv4 or "未知")
+    ipv6 = mask_ipv6(server.ipv6 or "❌")
+
+    cpu_info = ", ".join(server.cpu_info) or "未知"
+    uptime_days = server.uptime // 86400
+    uptime_hours = (server.uptime % 86400) // 3600
+    mem_used, mem_total = server.mem_used, server.mem_total
+    swap_used, swap_total = server.swap_used, server.swap_total
+    disk_used, disk_total = server.disk_used, server.disk_total
+
+    return f"""**{server.name}** {status}
+==========================
+**ID**: {server.id}
+**IPv4**: {ipv4}
+**IPv6**: {ipv6}
+**平台**： {server.platform or "未知"}
+**CPU 信息**： {cpu_info}
+**运行时间**： {uptime_days} 天 {uptime_hours} 小时
+**负载**： {server.load_1:.2f} {server.load_5:.2f} {server.load_15:.2f}
+**CPU**： {server.cpu:.2f}% [{server.arch}]
+**内存**： {mem_used / mem_total * 100 if mem_total else 0:.1f}% [{format_bytes(mem_used)}/{format_bytes(mem_total)}]
+**交换**： {swap_used / swap_total * 100 if swap_total else 0:.1f}% [{format_bytes(swap_used)}/{format_bytes(swap_total)}]
+**磁盘**： {disk_used / disk_total * 100 if disk_total else 0:.1f}% [{format_bytes(disk_used)}/{format_bytes(disk_total)}]
+**流量**： ↓{format_bytes(server.net_in_transfer)}     ↑{format_bytes(server.net_out_transfer)}
+**网速**： ↓{format_bytes(server.net_in_speed)}/s     ↑{format_bytes(server.net_out_speed)}/s
+
+**更新于**： {get_localized_time_string()}
+"""
+
+
+def format_last_active(last_active_str):
+    """将 last_active 转换为本地时区（如果设置了TZ）的时间字符串"""
+    if not last_active_str:
+        return "未知时间"
+    # 延迟导入，缩短启动时间
+    from dateutil import parser
+
+    try:
+        last_active_dt_utc = parser.isoparse(last_active_str).astimezone(timezone.utc)
+    except ValueError:
+        return "无效时间格式"
+    tz_str = os.environ.get("TZ")
+    if tz_str:
+        import pytz
+
+        try:
+            target_tz = pytz.timezone(tz_str)
+            return last_active_dt_utc.astimezone(target_tz).strftime(
+                "%Y-%m-%d %H:%M:%S %Z%z"
+            )
+        except pytz.exceptions.UnknownTimeZoneError:
+            pass
+    return last_active_dt_utc.strftime("%Y-%m-%d %H:%M:%S UTC")
+
+
+def traffic_alert_lines(summary, dashboard_id):
+    """根据流量阈值检查汇总结果中的每台服务器"""
+    lines = []
+    id_index = SERVER_FIELDS.index("id")
+    name_index = SERVER_FIELDS.index("name")
+    in_index = SERVER_FIELDS.index("net_in_transfer")
+    out_index = SERVER_FIELDS.index("net_out_transfer")
+    for row in summary["servers"]:
+        server_name = row[name_index]
+        current_net_in = row[in_index]
+        current_net_out = row[out_index]
+        upload, download = traffic_thresholds.get(dashboard_id, row[id_index])
+        if upload > 0 and current_net_out > upload:
+            lines.append(
+                f"服务器 **{server_name}** 上行流量超限: {format_bytes(current_net_out)} / {format_bytes(upload)}"
+            )
+        if download > 0 and current_net_in > download:
+            lines.append(
+                f"服务器 **{server_name}** 下行流量超限: {format_bytes(current_net_in)} / {format_bytes(download)}"
+            )
+    return lines
+
+
+def overview_keyboard(summary):
+    """概览的刷新按钮，携带后台轮询快照的版本号，用于跳过未变化的刷新"""
+    version = summary.get("version")
+    callback_data = (
+        f"refresh_overview_{version}" if version is not None else "refresh_overview"
+    )
+    keyboard = [[InlineKeyboardButton("刷新", callback_data=callback_data)]]
+    # 旧版本保存的快照中没有分组统计
+    if "groups" in summary:
+        keyboard.append(
+            [
+                InlineKeyboardButton("按分组", callback_data="breakdown_groups"),
+                InlineKeyboardButton("按地区", callback_data="breakdown_countries"),
+            ]
+        )
+    return InlineKeyboardMarkup(keyboard)
+
+
+def format_overview(summary, dashboard_id):
+    """构建服务器概览文本"""
+    used_mem, total_mem = summary["mem_used"], summary["mem_total"]
+    used_swap, total_swap = summary["swap_used"], summary["swap_total"]
+    used_disk, total_disk = summary["disk_used"], summary["disk_total"]
+    net_in_transfer = summary["net_in_transfer"]
+    net_out_transfer = summary["net_out_transfer"]
+    transfer_ratio = (
+        (net_out_transfer / net_in_transfer * 100) if net_in_transfer else 0
+    )
+
+    response = ""
+    if summary.get("stale"):
+        response += (
+            "⚠️ **面板暂时无法访问或响应过慢，以下为 "
+            f"{get_localized_time_string(summary['fetched_at'])} 的数据**\n\n"
+        )
+    response += f"""📊 **统计信息**
+===========================
+**服务器数量**： {summary["total"]}
+**在线服务器**： {summary["online"]}
+**内存**： {used_mem / total_mem * 100 if total_mem else 0:.1f}% [{format_bytes(used_mem)}/{format_bytes(total_mem)}]
+**交换**： {used_swap / total_swap * 100 if total_swap else 0:.1f}% [{format_bytes(used_swap)}/{format_bytes(total_swap)}]
+**磁盘**： {used_disk / total_disk * 100 if total_disk else 0:.1f}% [{format_bytes(used_disk)}/{format_bytes(total_disk)}]
+**下行速度**： ↓{format_bytes(summary["net_in_speed"])}/s
+**上行速度**： ↑{format_bytes(summary["net_out_speed"])}/s
+**下行流量**： ↓{format_bytes(net_in_transfer)}
+**上行流量**： ↑{format_bytes(net_out_transfer)}
+**流量对等性**： {transfer_ratio:.1f}%
+"""
+    # 添加离线设备信息
+    if summary["offline"]:
+        response += "\n\n🔌 **离线设备**\n===========================\n"
+        response += "\n".join(
+            f"服务器 **{name}** 离线，最后在线: {format_last_active(last_active)}"
+            for name, last_active in summary["offline"]
+        )
+
+    # 添加流量告警信息
+    traffic_alerts = traffic_alert_lines(summary, dashboard_id)
+    if traffic_alerts:
+        response += "\n\n🚨 **流量告警**\n===========================\n"
+        response += "\n".join(traffic_alerts)
+
+    response += f"\n\n**更新于**： {get_localized_time_string()}"
+    return response
+
+
+def summary_version(summary):
+    """汇总结果的版本：后台轮询的汇总带有版本号，按需汇总的结果以汇总时间区分"""
+    version = summary.get("version")
+    return summary["fetched_at"] if version is None else version
+
+
+def render_overview(summary, dashboard_id):
+    """概览文本与刷新按钮，同一快照只渲染一次"""
+    return render_cache.get_or_render(
+        dashboard_id,
+        "overview",
+        (summary_version(summary), summary.get("stale", False)),
+        lambda: (format_overview(summary, dashboard_id), overview_keyboard(summary)),
+    )
+
+
+def render_server_detail(api, dashboard_id, server):
+    """服务器详情文本与按钮，同一 /server 响应只渲染一次"""
+
+    def render():
+        keyboard = [
+            [InlineKeyboardButton("刷新", callback_data=f"refresh_server_{server.id}")],
+            [
+                InlineKeyboardButton(
+                    "服务监测", callback_data=f"service_history_{server.id}"
+                )
+            ],
+        ]
+        return format_server_detail(server), InlineKeyboardMarkup(keyboard)
+
+    return render_cache.get_or_render(
+        dashboard_id, ("server", server.id), api.versions.get("/server"), render
+    )
+
+
+async def get_cached_summary(api, dashboard_id):
+    """
+    优先使用已有的汇总结果（后台轮询、最近一次查看或面板快照），不论新旧，
+    都没有时才请求面板
+    """
+    summary = await state.get_snapshot(f"{api.cache_key}/summary")
+    if summary is None:
+        summary = warm_store.get(dashboard_id)
+    if summary is None:
+        summary = await get_summary(api, dashboard_id)
+    return summary
+
+
+def format_top(summary, metric, n):
+    """构建指标排行文本"""
+    label = METRIC_LABELS[metric][0]
+    ranked = top_servers(summary["servers"], metric, n)
+    name_index = SERVER_FIELDS.index("name")
+    response = f"🏆 **{label}前 {n} 的服务器**\n===========================\n"
+    if not ranked:
+        response += "暂无在线服务器。\n"
+    for rank, (value, row) in enumerate(ranked, 1):
+        response += (
+            f"{rank}. **{row[name_index]}**： {format_metric_value(metric, value)}\n"
+        )
+    response += f"\n**数据时间**： {get_localized_time_string(summary['fetched_at'])}"
+    return response
+
+
+def top_keyboard(metric, n):
+    """切换排行指标的按钮，当前指标带有标记"""
+    buttons = [
+        InlineKeyboardButton(
+            ("✅ " if name == metric else "") + METRIC_LABELS[name][0],
+            callback_data=f"top_{n}_{name}",
+        )
+        for name in TOP_METRICS
+    ]
+    return InlineKeyboardMarkup([buttons[i : i + 3] for i in range(0, len(buttons), 3)])
+
+
+def render_top(summary, dashboard_id, metric, n):
+    """指标排行文本与按钮，同一快照的同一排行只渲染一次"""
+    return render_cache.get_or_render(
+        dashboard_id,
+        ("top", metric, n),
+        summary_version(summary),
+        lambda: (format_top(summary, metric, n), top_keyboard(metric, n)),
+    )
+
+
+# 分组 / 地区统计的标题
+BREAKDOWN_TITLES = {"groups": "📂 **按分组统计**", "countries": "🌏 **按地区统计**"}
+# 分组详情中最多列出的服务器数量，其余只显示在按钮中
+BUCKET_SERVER_LINES = 30
+
+
+def bucket_label(kind, name):
+    """地区统计在国家代码前加上旗帜"""
+    if kind == "countries" and len(name) == 2 and name.isascii() and name.isalpha():
+        flag = "".join(chr(0x1F1E6 + ord(c) - ord("A")) for c in name)
+        return f"{flag} {name}"
+    return name
+
+
+def sorted_buckets(summary, kind):
+    """按服务器数量从多到少排列，按钮中用序号指代分组"""
+    return sorted(
+        summary.get(kind, {}).items(), key=lambda item: (-item[1]["total"], item[0])
+    )
+
+
+def format_bucket_stats(bucket):
+    mem_used, mem_total = bucket["mem_used"], bucket["mem_total"]
+    disk_used, disk_total = bucket["disk_used"], bucket["disk_total"]
+    return (
+        f"在线 {bucket['online']}/{bucket['total']}，"
+        f"内存 {mem_used / mem_total * 100 if mem_total else 0:.1f}%，"
+        f"磁盘 {disk_used / disk_total * 100 if disk_total else 0:.1f}%，"
+        f"网速 ↓{format_bytes(bucket['net_in_speed'])}/s ↑{format_bytes(bucket['net_out_speed'])}/s，"
+        f"流量 ↓{format_bytes(bucket['net_in_transfer'])} ↑{format_bytes(bucket['net_out_transfer'])}"
+    )
+
+
+def render_breakdown(summary, dashboard_id, kind):
+    """分组 / 地区统计总览，每个分组一个按钮，可继续查看其中的服务器"""
+
+    def render():
+        buckets = sorted_buckets(summary, kind)
+        response = f"{BREAKDOWN_TITLES[kind]}\n===========================\n"
+        response += "\n".join(
+            f"**{bucket_label(kind, name)}**：{format_bucket_stats(bucket)}"
+            for name, bucket in buckets
+        )
+        response += (
+            f"\n\n**数据时间**： {get_localized_time_string(summary['fetched_at'])}"
+        )
+        keyboard = [
+            InlineKeyboardButton(
+                f"{bucket_label(kind, name)} ({bucket['online']}/{bucket['total']})",
+                callback_data=f"bucket_{kind}_{index}",
+            )
+            for index, (name, bucket) in enumerate(buckets)
+        ]
+        rows = [keyboard[i : i + 2] for i in range(0, len(keyboard), 2)]
+        return response, InlineKeyboardMarkup(rows)
+
+    return render_cache.get_or_render(
+        dashboard_id, ("breakdown", kind), summary_version(summary), render
+    )
+
+
+def format_bucket(summary, kind, name, bucket):
+    """单个分组 / 地区的统计与其中的服务器，数据全部来自快照"""
+    rows = {row[0]: row for row in summary["servers"]}
+    name_index = SERVER_FIELDS.index("name")
+    online_index = SERVER_FIELDS.index("online")
+    cpu_index = SERVER_FIELDS.index("cpu")
+    mem_used_index = SERVER_FIELDS.index("mem_used")
+    mem_total_index = SERVER_FIELDS.index("mem_total")
+    response = f"**{bucket_label(kind, name)}**\n===========================\n"
+    response += format_bucket_stats(bucket) + "\n\n"
+    servers = sorted(
+        (rows[server_id] for server_id in bucket["servers"] if server_id in rows),
+        key=lambda row: row[name_index],
+    )
+    for row in servers[:BUCKET_SERVER_LINES]:
+        status = "❇️" if row[online_index] else "❌"
+        mem_total = row[mem_total_index]
+        mem = row[mem_used_index] / mem_total * 100 if mem_total else 0
+        response += f"{status} **{row[name_index]}** CPU {row[cpu_index]:.1f}% 内存 {mem:.1f}%\n"
+    if len(servers) > BUCKET_SERVER_LINES:
+        response += f"……共 {len(servers)} 台服务器\n"
+    response += f"\n**数据时间**： {get_localized_time_string(summary['fetched_at'])}"
+    return response, [(row[name_index], f"server_detail_{row[0]}") for row in servers]
+
+
 async def delete_message_later(
     context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int
 ):
@@ -138,6 +1023,14 @@ async def delete_message_later(
         logger.warning(f"删除消息失败: {e}")
 
 
+async def process_deletions(context: ContextTypes.DEFAULT_TYPE):
+    """
+    后台任务：删除到期的群组消息（多实例时由取出该消息的实例负责）
+    """
+    for chat_id, message_id in await state.pop_due_deletions(time.time()):
+        await delete_message_later(context, chat_id, message_id)
+
+
 async def send_message_with_auto_delete(
     update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, **kwargs
 ):
@@ -145,24 +1038,166 @@ async def send_message_with_auto_delete(
     发送消息并在群组中自动设置延迟删除
     """
     message = await update.message.reply_text(text, **kwargs)
+    await schedule_group_cleanup(update, message)
+    return message
+
 
+async def schedule_group_cleanup(update: Update, message):
+    """群组中延迟删除命令消息与机器人的回复"""
     # 如果是群组消息，设置定时删除
     if update.effective_chat.type in ["group", "supergroup"]:
+        now = time.time()
         # 延迟5秒删除原始命令消息
-        context.job_queue.run_once(
-            lambda ctx: delete_message_later(
-                ctx, update.message.chat_id, update.message.message_id
-            ),
-            5,  # 5秒后删除原始命令
+        await state.schedule_deletion(
+            update.message.chat_id, update.message.message_id, now + 5
         )
-
         # 设置定时删除回复的消息
-        context.job_queue.run_once(
-            lambda ctx: delete_message_later(ctx, message.chat_id, message.message_id),
-            GROUP_MESSAGE_LIFETIME,
+        await state.schedule_deletion(
+            message.chat_id, message.message_id, now + GROUP_MESSAGE_LIFETIME
         )
 
-    return message
+
+def dedup_enabled(update: Update):
+    return COMMAND_DEDUP_WINDOW > 0 and update.effective_chat.type in [
+        "group",
+        "supergroup",
+    ]
+
+
+def panel_key(dashboard):
+    """
+    面板账号的标识：群组成员各自绑定同一面板时 dashboard id 不同，
+    按面板地址与用户名识别为同一面板
+    """
+    identity = f"{dashboard['dashboard_url'].rstrip('/')}\n{dashboard['username']}"
+    return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+
+def recent_reply_key(update: Update, command, dashboard):
+    return f"reply:{update.effective_chat.id}:{command}:{panel_key(dashboard)}"
+
+
+async def remember_reply(update: Update, command, dashboard, message, version=None):
+    """
+    记录群组中命令的结果消息：{"message_id", "sent_at", "version"}，
+    记录不会比消息本身存活更久
+    """
+    if not dedup_enabled(update):
+        return
+    await state.set_snapshot(
+        recent_reply_key(update, command, dashboard),
+        {"message_id": message.message_id, "sent_at": time.time(), "version": version},
+        min(COMMAND_DEDUP_WINDOW, GROUP_MESSAGE_LIFETIME),
+    )
+
+
+async def find_recent_reply(update: Update, command, dashboard):
+    """群组中窗口内（任一成员）同一面板相同命令的结果消息记录，没有时返回 None"""
+    if not dedup_enabled(update):
+        return None
+    return await state.get_snapshot(recent_reply_key(update, command, dashboard))
+
+
+async def point_to_recent_reply(update: Update, recent, hint=""):
+    """
+    回复一条指向已有结果消息的提示，提示随原结果消息一起删除。
+    原消息已被删除时返回 False，由调用方照常处理命令
+    """
+    age = max(0, int(time.time() - recent["sent_at"]))
+    try:
+        message = await update.message.reply_text(
+            f"🔁 {age} 秒前已有相同的查询，结果见这条消息。{hint}",
+            reply_to_message_id=recent["message_id"],
+        )
+    except BadRequest as e:
+        logger.info(f"已有的结果消息不可用: {e}")
+        return False
+    await state.schedule_deletion(
+        update.message.chat_id, update.message.message_id, time.time() + 5
+    )
+    await state.schedule_deletion(
+        message.chat_id, message.message_id, recent["sent_at"] + GROUP_MESSAGE_LIFETIME
+    )
+    return True
+
+
+async def refresh_recent_overview(update, context, recent, api, dashboard):
+    """
+    已有概览消息之后若后台轮询得到了新的汇总，直接用它编辑该消息，不请求面板
+    """
+    summary = await state.get_snapshot(f"{api.cache_key}/summary")
+    if summary is None or summary_version(summary) == recent["version"]:
+        return
+    response, reply_markup = render_overview(summary, dashboard["id"])
+    try:
+        await context.bot.edit_message_text(
+            response,
+            chat_id=update.effective_chat.id,
+            message_id=recent["message_id"],
+            parse_mode="Markdown",
+            reply_markup=reply_markup,
+        )
+    except BadRequest as e:
+        logger.info(f"更新已有的概览消息失败: {e}")
+        return
+    recent["version"] = summary_version(summary)
+    remaining = recent["sent_at"] + min(COMMAND_DEDUP_WINDOW, GROUP_MESSAGE_LIFETIME)
+    if remaining > time.time():
+        await state.set_snapshot(
+            recent_reply_key(update, "overview", dashboard),
+            recent,
+            remaining - time.time(),
+        )
+
+
+def describe_update(update: Update):
+    """日志中的处理器标识：命令名、去掉编号的回调数据或更新类型"""
+    if update.callback_query:
+        return "callback:" + re.sub(
+            r"_-?\d[\d.]*", "", update.callback_query.data or ""
+        )
+    if update.inline_query:
+        return "inline"
+    if update.message and update.message.text:
+        text = update.message.text
+        if text.startswith("/"):
+            return text.split()[0].split("@")[0]
+    return "message"
+
+
+async def track_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    记录当前更新对应的用户，供上游请求公平调度使用；
+    并按间隔在后台更新用户活跃时间，供启动预热使用
+    """
+    update_started.set(time.perf_counter())
+    bind_log_context(
+        update=update.update_id,
+        user=update.effective_user.id if update.effective_user else None,
+        handler=describe_update(update),
+    )
+    if update.effective_user:
+        telegram_id = update.effective_user.id
+        current_user.set(telegram_id)
+        now = time.time()
+        if now - user_activity.get(telegram_id, 0) >= ACTIVITY_UPDATE_INTERVAL:
+            user_activity[telegram_id] = now
+            context.application.create_task(db.touch_user(telegram_id, now))
+
+
+async def log_update_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """所有处理器执行完成后记录本次更新的处理时间，慢更新以 INFO 级别输出"""
+    started = update_started.get()
+    if started is not None:
+        duration = time.perf_counter() - started
+        logger.log(
+            logging.INFO if duration >= SLOW_UPDATE_SECONDS else logging.DEBUG,
+            "更新处理完成",
+            extra={"fields": {"duration_ms": round(duration * 1000, 1)}},
+        )
+    # 后续在同一任务中产生的日志不再属于本次更新
+    update_started.set(None)
+    log_context.set({})
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -185,6 +1220,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /server - 查看单台服务器状态
 /cron - 执行计划任务
 /services - 查看服务状态总览
+/alert - 管理告警规则
+/threshold - 设置流量告警阈值
+/top - 查看指标最高的服务器
+/export - 导出服务器列表
 /help - 获取帮助
         """,
     )
@@ -198,20 +1237,26 @@ async def bind_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ConversationHandler.END
 
+    # 重新开始绑定时丢弃上一次未完成的输入
+    conversation_store.clear(update.effective_user.id)
     # 在私聊中直接使用 reply_text
     await update.message.reply_text("请输入您的用户名：")
     return BIND_USERNAME
 
 
 async def bind_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["username"] = update.message.text.strip()
+    conversation_store.update(
+        update.effective_user.id, username=update.message.text.strip()
+    )
     # 在私聊中直接使用 reply_text
     await update.message.reply_text("请输入您的密码：")
     return BIND_PASSWORD
 
 
 async def bind_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["password"] = update.message.text.strip()
+    conversation_store.update(
+        update.effective_user.id, password=update.message.text.strip()
+    )
     # 在私聊中直接使用 reply_text
     await update.message.reply_text(
         "请输入您的 Dashboard 地址（例如：https://nezha.example.com）："
@@ -221,7 +1266,7 @@ async def bind_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def bind_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     dashboard_url = update.message.text.strip()
-    context.user_data["dashboard_url"] = dashboard_url
+    conversation_store.update(update.effective_user.id, dashboard_url=dashboard_url)
     # 在私聊中直接使用 reply_text
     await update.message.reply_text("请为这个面板设置一个别名（如：主面板、备用等）：")
     return BIND_ALIAS
@@ -229,11 +1274,16 @@ async def bind_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def bind_alias(update: Update, context: ContextTypes.DEFAULT_TYPE):
     alias = update.message.text.strip()
-    context.user_data["alias"] = alias
     telegram_id = update.effective_user.id
-    username = context.user_data["username"]
-    password = context.user_data["password"]
-    dashboard_url = context.user_data["dashboard_url"]
+    # 无论绑定成功与否对话都在此结束，立即清除已输入的凭据
+    data = conversation_store.get(telegram_id)
+    conversation_store.clear(telegram_id)
+    if not all(key in data for key in ("username", "password", "dashboard_url")):
+        await update.message.reply_text("绑定已超时，请重新使用 /bind 命令。")
+        return ConversationHandler.END
+    username = data["username"]
+    password = data["password"]
+    dashboard_url = data["dashboard_url"]
 
     # 测试连接
     try:
@@ -244,8 +1294,11 @@ async def bind_alias(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"绑定失败：{e}\n请检查您的信息并重新绑定。")
         return ConversationHandler.END
 
-    # 保存到数据库
-    await db.add_user(telegram_id, username, password, dashboard_url, alias)
+    # 保存到数据库，登录得到的 token 一并加密保存，后续命令无需重新登录
+    dashboard_id = await db.add_user(
+        telegram_id, username, password, dashboard_url, alias
+    )
+    await db.save_token(dashboard_id, api.token, api.token_expires)
     await update.message.reply_text("绑定成功！您现在可以使用机器人的功能了。")
     return ConversationHandler.END
 
@@ -289,137 +1342,33 @@ async def overview(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    api = NezhaAPI(user["dashboard_url"], user["username"], user["password"])
+    api = get_api(user)
+    recent = await find_recent_reply(update, "overview", user)
+    if recent is not None:
+        await refresh_recent_overview(update, context, recent, api, user)
+        if await point_to_recent_reply(update, recent, "点击“刷新”可获取最新数据。"):
+            return
+
     try:
-        data = await api.get_overview()
+        summary = await get_summary(api, user["id"])
     except Exception as e:
         await send_message_with_auto_delete(update, context, f"获取数据失败：{e}")
-        await api.close()
         return
 
-    if data and data.get("success"):
-        servers = data["data"]
-        online_servers = 0
-        offline_servers_info = []
-        traffic_alerts = []
-        total_servers = len(servers)
-        total_mem = 0
-        used_mem = 0
-        total_swap = 0
-        used_swap = 0
-        total_disk = 0
-        used_disk = 0
-        net_in_speed = 0
-        net_out_speed = 0
-        net_in_transfer = 0
-        net_out_transfer = 0
-
-        for s in servers:
-            server_name = s.get("name", "未知")
-            if is_online(s):
-                online_servers += 1
-            else:
-                last_active_str = s.get("last_active")
-                last_active_formatted = "未知时间"
-                if last_active_str:
-                    try:
-                        # 解析时间并转换为本地时区（如果设置了TZ）
-                        last_active_dt_utc = parser.isoparse(
-                            last_active_str
-                        ).astimezone(timezone.utc)
-                        tz_str = os.environ.get("TZ")
-                        if tz_str:
-                            try:
-                                target_tz = pytz.timezone(tz_str)
-                                last_active_dt_local = last_active_dt_utc.astimezone(
-                                    target_tz
-                                )
-                                last_active_formatted = last_active_dt_local.strftime(
-                                    "%Y-%m-%d %H:%M:%S %Z%z"
-                                )
-                            except pytz.exceptions.UnknownTimeZoneError:
-                                last_active_formatted = last_active_dt_utc.strftime(
-                                    "%Y-%m-%d %H:%M:%S UTC"
-                                )
-                        else:
-                            last_active_formatted = last_active_dt_utc.strftime(
-                                "%Y-%m-%d %H:%M:%S UTC"
-                            )
-                    except ValueError:
-                        last_active_formatted = "无效时间格式"
-                offline_servers_info.append(
-                    f"服务器 **{server_name}** 离线，最后在线: {last_active_formatted}"
-                )
-
-            # 累加统计信息
-            if s.get("host"):
-                total_mem += s["host"].get("mem_total", 0)
-                total_swap += s["host"].get("swap_total", 0)
-                total_disk += s["host"].get("disk_total", 0)
-            if s.get("state"):
-                used_mem += s["state"].get("mem_used", 0)
-                used_swap += s["state"].get("swap_used", 0)
-                used_disk += s["state"].get("disk_used", 0)
-                net_in_speed += s["state"].get("net_in_speed", 0)
-                net_out_speed += s["state"].get("net_out_speed", 0)
-                current_net_in = s["state"].get("net_in_transfer", 0)
-                current_net_out = s["state"].get("net_out_transfer", 0)
-                net_in_transfer += current_net_in
-                net_out_transfer += current_net_out
-
-                # 检查流量阈值
-                if (
-                    UPLOAD_ALERT_THRESHOLD_BYTES > 0
-                    and current_net_out > UPLOAD_ALERT_THRESHOLD_BYTES
-                ):
-                    traffic_alerts.append(
-                        f"服务器 **{server_name}** 上行流量超限: {format_bytes(current_net_out)} / {format_bytes(UPLOAD_ALERT_THRESHOLD_BYTES)}"
-                    )
-                if (
-                    DOWNLOAD_ALERT_THRESHOLD_BYTES > 0
-                    and current_net_in > DOWNLOAD_ALERT_THRESHOLD_BYTES
-                ):
-                    traffic_alerts.append(
-                        f"服务器 **{server_name}** 下行流量超限: {format_bytes(current_net_in)} / {format_bytes(DOWNLOAD_ALERT_THRESHOLD_BYTES)}"
-                    )
-
-        transfer_ratio = (
-            (net_out_transfer / net_in_transfer * 100) if net_in_transfer else 0
+    if summary:
+        response, reply_markup = render_overview(summary, user["id"])
+        message = await send_message_with_auto_delete(
+            update,
+            context,
+            response,
+            parse_mode="Markdown",
+            reply_markup=reply_markup,
         )
-
-        response = f"""📊 **统计信息**
-===========================
-**服务器数量**： {total_servers}
-**在线服务器**： {online_servers}
-**内存**： {used_mem / total_mem * 100 if total_mem else 0:.1f}% [{format_bytes(used_mem)}/{format_bytes(total_mem)}]
-**交换**： {used_swap / total_swap * 100 if total_swap else 0:.1f}% [{format_bytes(used_swap)}/{format_bytes(total_swap)}]
-**磁盘**： {used_disk / total_disk * 100 if total_disk else 0:.1f}% [{format_bytes(used_disk)}/{format_bytes(total_disk)}]
-**下行速度**： ↓{format_bytes(net_in_speed)}/s
-**上行速度**： ↑{format_bytes(net_out_speed)}/s
-**下行流量**： ↓{format_bytes(net_in_transfer)}
-**上行流量**： ↑{format_bytes(net_out_transfer)}
-**流量对等性**： {transfer_ratio:.1f}%
-"""
-        # 添加离线设备信息
-        if offline_servers_info:
-            response += "\n\n🔌 **离线设备**\n===========================\n"
-            response += "\n".join(offline_servers_info)
-
-        # 添加流量告警信息
-        if traffic_alerts:
-            response += "\n\n🚨 **流量告警**\n===========================\n"
-            response += "\n".join(traffic_alerts)
-
-        response += f"\n\n**更新于**： {get_localized_time_string()}"
-
-        keyboard = [[InlineKeyboardButton("刷新", callback_data="refresh_overview")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await send_message_with_auto_delete(
-            update, context, response, parse_mode="Markdown", reply_markup=reply_markup
+        await remember_reply(
+            update, "overview", user, message, summary_version(summary)
         )
     else:
         await send_message_with_auto_delete(update, context, "获取服务器信息失败。")
-    await api.close()
 
 
 async def server_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -439,37 +1388,93 @@ async def server_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def search_server(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query_text = update.message.text.strip()
     user = await db.get_user(update.effective_user.id)
-    api = NezhaAPI(user["dashboard_url"], user["username"], user["password"])
+    api = get_api(user)
     try:
-        results = await api.search_servers(query_text)
+        results = await api.search_servers(query_text, limit=SERVER_SEARCH_LIMIT)
     except Exception as e:
         await send_message_with_auto_delete(update, context, f"搜索失败：{e}")
-        await api.close()
         return ConversationHandler.END
 
     if not results:
         await send_message_with_auto_delete(update, context, "未找到匹配的服务器。")
-        await api.close()
         return ConversationHandler.END
 
-    keyboard = [
-        [InlineKeyboardButton(s["name"], callback_data=f"server_detail_{s['id']}")]
-        for s in results
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    token = result_pages.store((s.name, f"server_detail_{s.id}") for s in results)
+    reply_markup = result_pages.keyboard(token)
     await send_message_with_auto_delete(
         update, context, "请选择服务器：", reply_markup=reply_markup
     )
-    await api.close()
     return ConversationHandler.END
 
 
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    内联查询：在任意聊天输入 @机器人 关键字，直接从搜索索引返回匹配的服务器
+    """
+    inline = update.inline_query
+    user = await db.get_user(inline.from_user.id)
+    if not user:
+        await inline.answer(
+            [],
+            is_personal=True,
+            cache_time=0,
+            button=InlineQueryResultsButton(
+                text="请先私聊机器人绑定账号", start_parameter="bind"
+            ),
+        )
+        return
+
+    api = get_api(user)
+    try:
+        # 优先使用已有快照构建的索引，避免每次输入都请求面板
+        index = await api.get_search_index(refresh=False)
+    except Exception as e:
+        logger.warning(f"内联搜索失败: {e}")
+        index = None
+
+    results = []
+    for server in index.search(inline.query) if index else []:
+        mem_total = server.mem_total
+        mem_percent = server.mem_used / mem_total * 100 if mem_total else 0
+        status = "❇️在线" if is_online(server) else "❌离线"
+        results.append(
+            InlineQueryResultArticle(
+                id=str(server.id),
+                title=server.name,
+                description=f"{status} | CPU {server.cpu:.1f}% | 内存 {mem_percent:.1f}%",
+                input_message_content=InputTextMessageContent(
+                    render_server_detail(api, user["id"], server)[0],
+                    parse_mode="Markdown",
+                ),
+            )
+        )
+    await inline.answer(results, is_personal=True, cache_time=INLINE_CACHE_TIME)
+
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
 
+    # 翻页只在本地缓存的结果中切片，不请求面板
+    if data == "noop":
+        await query.answer()
+        return
+
+    if data.startswith("page_"):
+        _, token, page = data.split("_")
+        reply_markup = result_pages.keyboard(token, int(page))
+        if reply_markup is None:
+            await query.answer("结果已过期，请重新查询。", show_alert=True)
+            return
+        await query.answer()
+        await query.edit_message_reply_markup(reply_markup=reply_markup)
+        return
+
     if data.startswith("unbind_"):
         if data == "unbind_all":
+            for dashboard in await db.get_all_dashboards(query.from_user.id):
+                await close_api(dashboard["id"])
+                warm_store.forget(dashboard["id"])
             await db.delete_user(query.from_user.id)
             await edit_message_with_auto_delete(
                 query, "已解绑所有面板，您可以使用 /bind 重新绑定。"
@@ -484,6 +1489,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             was_default = current_dashboard and current_dashboard["is_default"]
 
             has_remaining = await db.delete_dashboard(query.from_user.id, dashboard_id)
+            await close_api(dashboard_id)
+            warm_store.forget(dashboard_id)
 
             if not has_remaining:
                 await edit_message_with_auto_delete(
@@ -570,312 +1577,107 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("请先使用 /bind 命令绑定您的账号。", show_alert=True)
         return
 
-    # 实现刷新频率限制
-    last_refresh_time = context.user_data.get("last_refresh_time", 0)
-    current_time = time.time()
-    if data.startswith("refresh_"):
-        if current_time - last_refresh_time < 1:
-            await query.answer("刷新太频繁，请稍后再试。", show_alert=True)
-            return
-        else:
-            context.user_data["last_refresh_time"] = current_time
-
+    # 刷新频率由上游限流器控制，超出时返回最近一次的快照
     await query.answer()
 
-    api = NezhaAPI(user["dashboard_url"], user["username"], user["password"])
+    api = get_api(user)
 
-    if data.startswith("server_detail_"):
+    if data.startswith("server_detail_") or data.startswith("refresh_server_"):
         server_id = int(data.split("_")[-1])
         try:
             server = await api.get_server_detail(server_id)
         except Exception as e:
             await edit_message_with_auto_delete(query, f"获取服务器详情失败：{e}")
-            await api.close()
             return
 
-        await api.close()
-
         if not server:
             await edit_message_with_auto_delete(query, "未找到该服务器。")
             return
 
-        name = server.get("name", "未知")
-        online_status = is_online(server)
-        status = "❇️在线" if online_status else "❌离线"
-        ipv4 = server.get("geoip", {}).get("ip", {}).get("ipv4_addr", "未知")
-        ipv6 = server.get("geoip", {}).get("ip", {}).get("ipv6_addr", "❌")
-
-        # 对 IP 地址进行掩码处理
-        ipv4 = mask_ipv4(ipv4)
-        ipv6 = mask_ipv6(ipv6)
-
-        platform = server.get("host", {}).get("platform", "未知")
-        cpu_info = (
-            ", ".join(server.get("host", {}).get("cpu", []))
-            if server.get("host")
-            else "未知"
-        )
-        uptime_seconds = server.get("state", {}).get("uptime", 0)
-        uptime_days = uptime_seconds // 86400
-        uptime_hours = (uptime_seconds % 86400) // 3600
-        load_1 = server.get("state", {}).get("load_1", 0)
-        load_5 = server.get("state", {}).get("load_5", 0)
-        load_15 = server.get("state", {}).get("load_15", 0)
-        cpu_usage = server.get("state", {}).get("cpu", 0)
-        mem_used = server.get("state", {}).get("mem_used", 0)
-        mem_total = server.get("host", {}).get("mem_total", 1)
-        swap_used = server.get("state", {}).get("swap_used", 0)
-        swap_total = server.get("host", {}).get("swap_total", 1)
-        disk_used = server.get("state", {}).get("disk_used", 0)
-        disk_total = server.get("host", {}).get("disk_total", 1)
-        net_in_transfer = server.get("state", {}).get("net_in_transfer", 0)
-        net_out_transfer = server.get("state", {}).get("net_out_transfer", 0)
-        net_in_speed = server.get("state", {}).get("net_in_speed", 0)
-        net_out_speed = server.get("state", {}).get("net_out_speed", 0)
-        arch = server.get("host", {}).get("arch", "")
-
-        response = f"""**{name}** {status}
-==========================
-**ID**: {server.get('id', '未知')}
-**IPv4**: {ipv4}
-**IPv6**: {ipv6}
-**平台**： {platform}
-**CPU 信息**： {cpu_info}
-**运行时间**： {uptime_days} 天 {uptime_hours} 小时
-**负载**： {load_1:.2f} {load_5:.2f} {load_15:.2f}
-**CPU**： {cpu_usage:.2f}% [{arch}]
-**内存**： {mem_used / mem_total * 100 if mem_total else 0:.1f}% [{format_bytes(mem_used)}/{format_bytes(mem_total)}]
-**交换**： {swap_used / swap_total * 100 if swap_total else 0:.1f}% [{format_bytes(swap_used)}/{format_bytes(swap_total)}]
-**磁盘**： {disk_used / disk_total * 100 if disk_total else 0:.1f}% [{format_bytes(disk_used)}/{format_bytes(disk_total)}]
-**流量**： ↓{format_bytes(net_in_transfer)}     ↑{format_bytes(net_out_transfer)}
-**网速**： ↓{format_bytes(net_in_speed)}/s     ↑{format_bytes(net_out_speed)}/s
-
-**更新于**： {get_localized_time_string()}
-"""
-        # 添加刷新按钮
-        keyboard = [
-            [InlineKeyboardButton("刷新", callback_data=f"refresh_server_{server_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        response, reply_markup = render_server_detail(api, user["id"], server)
         await edit_message_with_auto_delete(
             query, response, parse_mode="Markdown", reply_markup=reply_markup
         )
 
-    elif data.startswith("refresh_server_"):
-        server_id = int(data.split("_")[-1])
-        # 重新获取服务器详情，与上面相同的代码
+    elif data.startswith("refresh_overview"):
+        # 重新获取概览数据，与 overview 函数类似
         try:
-            server = await api.get_server_detail(server_id)
+            summary = await get_summary(api, user["id"])
         except Exception as e:
-            await edit_message_with_auto_delete(query, f"获取服务器详情失败：{e}")
-            await api.close()
-            return
-
-        await api.close()
-
-        if not server:
-            await edit_message_with_auto_delete(query, "未找到该服务器。")
+            await edit_message_with_auto_delete(query, f"获取数据失败：{e}")
             return
 
-        # 同上，构建响应和刷新按钮
-        name = server.get("name", "未知")
-        online_status = is_online(server)
-        status = "❇️在线" if online_status else "❌离线"
-        ipv4 = server.get("geoip", {}).get("ip", {}).get("ipv4_addr", "未知")
-        ipv6 = server.get("geoip", {}).get("ip", {}).get("ipv6_addr", "❌")
-
-        # 对 IP 地址进行掩码处理
-        ipv4 = mask_ipv4(ipv4)
-        ipv6 = mask_ipv6(ipv6)
-
-        platform = server.get("host", {}).get("platform", "未知")
-        cpu_info = (
-            ", ".join(server.get("host", {}).get("cpu", []))
-            if server.get("host")
-            else "未知"
-        )
-        uptime_seconds = server.get("state", {}).get("uptime", 0)
-        uptime_days = uptime_seconds // 86400
-        uptime_hours = (uptime_seconds % 86400) // 3600
-        load_1 = server.get("state", {}).get("load_1", 0)
-        load_5 = server.get("state", {}).get("load_5", 0)
-        load_15 = server.get("state", {}).get("load_15", 0)
-        cpu_usage = server.get("state", {}).get("cpu", 0)
-        mem_used = server.get("state", {}).get("mem_used", 0)
-        mem_total = server.get("host", {}).get("mem_total", 1)
-        swap_used = server.get("state", {}).get("swap_used", 0)
-        swap_total = server.get("host", {}).get("swap_total", 1)
-        disk_used = server.get("state", {}).get("disk_used", 0)
-        disk_total = server.get("host", {}).get("disk_total", 1)
-        net_in_transfer = server.get("state", {}).get("net_in_transfer", 0)
-        net_out_transfer = server.get("state", {}).get("net_out_transfer", 0)
-        net_in_speed = server.get("state", {}).get("net_in_speed", 0)
-        net_out_speed = server.get("state", {}).get("net_out_speed", 0)
-        arch = server.get("host", {}).get("arch", "")
-
-        response = f"""**{name}** {status}
-==========================
-**ID**: {server.get('id', '未知')}
-**IPv4**: {ipv4}
-**IPv6**: {ipv6}
-**平台**： {platform}
-**CPU 信息**： {cpu_info}
-**运行时间**： {uptime_days} 天 {uptime_hours} 小时
-**负载**： {load_1:.2f} {load_5:.2f} {load_15:.2f}
-**CPU**： {cpu_usage:.2f}% [{arch}]
-**内存**： {mem_used / mem_total * 100 if mem_total else 0:.1f}% [{format_bytes(mem_used)}/{format_bytes(mem_total)}]
-**交换**： {swap_used / swap_total * 100 if swap_total else 0:.1f}% [{format_bytes(swap_used)}/{format_bytes(swap_total)}]
-**磁盘**： {disk_used / disk_total * 100 if disk_total else 0:.1f}% [{format_bytes(disk_used)}/{format_bytes(disk_total)}]
-**流量**： ↓{format_bytes(net_in_transfer)}     ↑{format_bytes(net_out_transfer)}
-**网速**： ↓{format_bytes(net_in_speed)}/s     ↑{format_bytes(net_out_speed)}/s
-
-**更新于**： {get_localized_time_string()}
-"""
-        keyboard = [
-            [InlineKeyboardButton("刷新", callback_data=f"refresh_server_{server_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await edit_message_with_auto_delete(
-            query, response, parse_mode="Markdown", reply_markup=reply_markup
-        )
+        if summary:
+            # 后台轮询的快照与消息中显示的版本相同时，无需重新渲染和编辑
+            rendered = data[len("refresh_overview_") :]
+            if rendered and rendered == str(summary.get("version")):
+                return
+            response, reply_markup = render_overview(summary, user["id"])
+            # 使用 edit_message_with_auto_delete 而不是 send_message_with_auto_delete
+            await edit_message_with_auto_delete(
+                query,
+                response,
+                parse_mode="Markdown",
+                reply_markup=reply_markup,
+            )
+        else:
+            await edit_message_with_auto_delete(query, "获取服务器信息失败。")
 
-    elif data == "refresh_overview":
-        # 重新获取概览数据，与 overview 函数类似
+    elif data.startswith("top_"):
+        _, n, metric = data.split("_", 2)
+        if metric not in METRICS or not n.isdigit():
+            return
         try:
-            data = await api.get_overview()
+            summary = await get_cached_summary(api, user["id"])
         except Exception as e:
             await edit_message_with_auto_delete(query, f"获取数据失败：{e}")
-            await api.close()
             return
 
-        if data and data.get("success"):
-            servers = data["data"]
-            online_servers = 0
-            offline_servers_info = []
-            traffic_alerts = []
-            total_servers = len(servers)
-            total_mem = 0
-            used_mem = 0
-            total_swap = 0
-            used_swap = 0
-            total_disk = 0
-            used_disk = 0
-            net_in_speed = 0
-            net_out_speed = 0
-            net_in_transfer = 0
-            net_out_transfer = 0
-
-            for s in servers:
-                server_name = s.get("name", "未知")
-                if is_online(s):
-                    online_servers += 1
-                else:
-                    last_active_str = s.get("last_active")
-                    last_active_formatted = "未知时间"
-                    if last_active_str:
-                        try:
-                            # 解析时间并转换为本地时区（如果设置了TZ）
-                            last_active_dt_utc = parser.isoparse(
-                                last_active_str
-                            ).astimezone(timezone.utc)
-                            tz_str = os.environ.get("TZ")
-                            if tz_str:
-                                try:
-                                    target_tz = pytz.timezone(tz_str)
-                                    last_active_dt_local = (
-                                        last_active_dt_utc.astimezone(target_tz)
-                                    )
-                                    last_active_formatted = (
-                                        last_active_dt_local.strftime(
-                                            "%Y-%m-%d %H:%M:%S %Z%z"
-                                        )
-                                    )
-                                except pytz.exceptions.UnknownTimeZoneError:
-                                    last_active_formatted = last_active_dt_utc.strftime(
-                                        "%Y-%m-%d %H:%M:%S UTC"
-                                    )
-                            else:
-                                last_active_formatted = last_active_dt_utc.strftime(
-                                    "%Y-%m-%d %H:%M:%S UTC"
-                                )
-                        except ValueError:
-                            last_active_formatted = "无效时间格式"
-                    offline_servers_info.append(
-                        f"服务器 **{server_name}** 离线，最后在线: {last_active_formatted}"
-                    )
-
-                # 累加统计信息
-                if s.get("host"):
-                    total_mem += s["host"].get("mem_total", 0)
-                    total_swap += s["host"].get("swap_total", 0)
-                    total_disk += s["host"].get("disk_total", 0)
-                if s.get("state"):
-                    used_mem += s["state"].get("mem_used", 0)
-                    used_swap += s["state"].get("swap_used", 0)
-                    used_disk += s["state"].get("disk_used", 0)
-                    net_in_speed += s["state"].get("net_in_speed", 0)
-                    net_out_speed += s["state"].get("net_out_speed", 0)
-                    current_net_in = s["state"].get("net_in_transfer", 0)
-                    current_net_out = s["state"].get("net_out_transfer", 0)
-                    net_in_transfer += current_net_in
-                    net_out_transfer += current_net_out
-
-                    # 检查流量阈值
-                    if (
-                        UPLOAD_ALERT_THRESHOLD_BYTES > 0
-                        and current_net_out > UPLOAD_ALERT_THRESHOLD_BYTES
-                    ):
-                        traffic_alerts.append(
-                            f"服务器 **{server_name}** 上行流量超限: {format_bytes(current_net_out)} / {format_bytes(UPLOAD_ALERT_THRESHOLD_BYTES)}"
-                        )
-                    if (
-                        DOWNLOAD_ALERT_THRESHOLD_BYTES > 0
-                        and current_net_in > DOWNLOAD_ALERT_THRESHOLD_BYTES
-                    ):
-                        traffic_alerts.append(
-                            f"服务器 **{server_name}** 下行流量超限: {format_bytes(current_net_in)} / {format_bytes(DOWNLOAD_ALERT_THRESHOLD_BYTES)}"
-                        )
-
-            transfer_ratio = (
-                (net_out_transfer / net_in_transfer * 100) if net_in_transfer else 0
-            )
-
-            response = f"""📊 **统计信息**
-===========================
-**服务器数量**： {total_servers}
-**在线服务器**： {online_servers}
-**内存**： {used_mem / total_mem * 100 if total_mem else 0:.1f}% [{format_bytes(used_mem)}/{format_bytes(total_mem)}]
-**交换**： {used_swap / total_swap * 100 if total_swap else 0:.1f}% [{format_bytes(used_swap)}/{format_bytes(total_swap)}]
-**磁盘**： {used_disk / total_disk * 100 if total_disk else 0:.1f}% [{format_bytes(used_disk)}/{format_bytes(total_disk)}]
-**下行速度**： ↓{format_bytes(net_in_speed)}/s
-**上行速度**： ↑{format_bytes(net_out_speed)}/s
-**下行流量**： ↓{format_bytes(net_in_transfer)}
-**上行流量**： ↑{format_bytes(net_out_transfer)}
-**流量对等性**： {transfer_ratio:.1f}%
-"""
-            # 添加离线设备信息
-            if offline_servers_info:
-                response += "\n\n🔌 **离线设备**\n===========================\n"
-                response += "\n".join(offline_servers_info)
-
-            # 添加流量告警信息
-            if traffic_alerts:
-                response += "\n\n🚨 **流量告警**\n===========================\n"
-                response += "\n".join(traffic_alerts)
-
-            response += f"\n\n**更新于**： {get_localized_time_string()}"
-
-            keyboard = [
-                [InlineKeyboardButton("刷新", callback_data="refresh_overview")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            # 使用 edit_message_with_auto_delete 而不是 send_message_with_auto_delete
+        if summary:
+            response, reply_markup = render_top(summary, user["id"], metric, int(n))
             await edit_message_with_auto_delete(
                 query, response, parse_mode="Markdown", reply_markup=reply_markup
             )
         else:
             await edit_message_with_auto_delete(query, "获取服务器信息失败。")
-        await api.close()
+
+    elif data.startswith("breakdown_") or data.startswith("bucket_"):
+        # 分组与地区统计在汇总时已经算好，直接使用快照
+        try:
+            summary = await get_cached_summary(api, user["id"])
+        except Exception as e:
+            await edit_message_with_auto_delete(query, f"获取数据失败：{e}")
+            return
+
+        if not summary:
+            await edit_message_with_auto_delete(query, "获取服务器信息失败。")
+            return
+
+        if data.startswith("breakdown_"):
+            kind = data[len("breakdown_") :]
+            if kind not in BREAKDOWN_TITLES:
+                return
+            response, reply_markup = render_breakdown(summary, user["id"], kind)
+        else:
+            _, kind, index = data.split("_")
+            buckets = sorted_buckets(summary, kind) if kind in BREAKDOWN_TITLES else []
+            if not index.isdigit() or int(index) >= len(buckets):
+                await edit_message_with_auto_delete(
+                    query, "该分组已不存在，请重新查看。"
+                )
+                return
+            name, bucket = buckets[int(index)]
+            response, buttons = render_cache.get_or_render(
+                user["id"],
+                ("bucket", kind, name),
+                summary_version(summary),
+                lambda: format_bucket(summary, kind, name, bucket),
+            )
+            # 翻页 token 有有效期，按钮列表每次重新保存
+            reply_markup = result_pages.keyboard(result_pages.store(buttons))
+        await edit_message_with_auto_delete(
+            query, response, parse_mode="Markdown", reply_markup=reply_markup
+        )
 
     elif data.startswith("cron_job_"):
         cron_id = int(data.split("_")[-1])
@@ -894,11 +1696,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             result = await api.run_cron_job(cron_id)
         except Exception as e:
             await edit_message_with_auto_delete(query, f"执行失败：{e}")
-            await api.close()
             return
 
-        await api.close()
-
         if result and result.get("success"):
             await edit_message_with_auto_delete(query, "计划任务已执行。")
         else:
@@ -908,16 +1707,20 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await edit_message_with_auto_delete(query, "操作已取消。")
 
     elif data == "view_loop_traffic":
-        await view_loop_traffic(query, context, api)
+        await view_loop_traffic(query, context, api, user)
 
     elif data == "refresh_loop_traffic":
-        await view_loop_traffic(query, context, api)
+        await view_loop_traffic(query, context, api, user)
 
     elif data == "view_availability":
-        await view_availability(query, context, api)
+        await view_availability(query, context, api, user)
+
+    elif data.startswith("service_history_"):
+        server_id = int(data.split("_")[-1])
+        await view_service_history(query, context, api, user, server_id)
 
     elif data == "refresh_availability":
-        await view_availability(query, context, api)
+        await view_availability(query, context, api, user)
 
     elif data.startswith("set_default_"):
         dashboard_id = int(data.split("_")[-1])
@@ -985,39 +1788,50 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
 
-async def view_loop_traffic(query, context, api):
+async def view_loop_traffic(query, context, api, user):
     # 获取服务状态
     try:
         services_data = await api.get_services_status()
     except Exception as e:
         await edit_message_with_auto_delete(query, f"获取服务信息失败：{e}")
-        await api.close()
         return
 
     if services_data and services_data.get("success"):
-        cycle_stats = services_data["data"].get("cycle_transfer_stats", {})
-        if not cycle_stats:
+        cycles = compact_cycles(services_data)
+        if not cycles:
             await edit_message_with_auto_delete(query, "暂无循环流量信息。")
-            await api.close()
             return
 
+        # 与后台轮询共用时间序列，只有流量变化的服务器会写入新的采样点
+        now = time.time()
+        cycle_tracker.update(user["id"], cycles, now)
+
         response = "**循环流量信息总览**\n==========================\n"
-        for stat_name, stats in cycle_stats.items():
-            rule_name = stats.get("name", "未知规则")
-            server_names = stats.get("server_name", {})
-            transfers = stats.get("transfer", {})
-            max_transfer = stats.get("max", 1)  # 最大流量（字节）
-
-            response += f"**规则：{rule_name}**\n"
-            for server_id_str, transfer_value in transfers.items():
-                server_id = str(server_id_str)
-                server_name = server_names.get(server_id, f"服务器ID {server_id}")
+        for rule_id, rule in cycles.items():
+            max_transfer = rule["max"]  # 最大流量（字节）
+            max_transfer_formatted = format_bytes(max_transfer)
+
+            response += f"**规则：{rule['name']}**\n"
+            for server_id, transfer_value in rule["transfer"].items():
+                server_name = rule["server_name"].get(
+                    server_id, f"服务器ID {server_id}"
+                )
                 transfer_formatted = format_bytes(transfer_value)
-                max_transfer_formatted = format_bytes(max_transfer)
                 percentage = (
                     (transfer_value / max_transfer * 100) if max_transfer else 0
                 )
                 response += f"服务器 **{server_name}**：已使用 {transfer_formatted} / {max_transfer_formatted}，已使用 {percentage:.2f}%\n"
+                rate, exhausted_at = cycle_tracker.projection(
+                    (user["id"], rule_id, server_id), now
+                )
+                if rate:
+                    response += f"  速率 {format_bytes(rate * 86400)}/天"
+                    if exhausted_at is not None and exhausted_at > now:
+                        if rule["to"] and exhausted_at >= rule["to"]:
+                            response += "，本周期内不会耗尽"
+                        else:
+                            response += f"，预计 {format_duration(exhausted_at - now)} 后耗尽 ⚠️"
+                    response += "\n"
             response += "--------------------------\n"
 
         response += f"**更新于**： {get_localized_time_string()}"
@@ -1032,59 +1846,121 @@ async def view_loop_traffic(query, context, api):
         )
     else:
         await edit_message_with_auto_delete(query, "获取循环流量信息失败。")
-    await api.close()
 
 
-async def view_availability(query, context, api):
+def format_availability(services):
+    """构建可用性监测总览文本"""
+    response = "**可用性监测信息总览**\n==========================\n"
+    for service in services.values():
+        status = "🟢 UP" if service.current_up else "🔴 DOWN"
+        if service.avg_delay is not None:
+            delay_text = f"，平均延迟 {service.avg_delay:.2f}ms"
+        else:
+            delay_text = ""
+        response += f"**{service.name}**：可用率 {service.availability:.2f}%，状态 {status}{delay_text}\n------------------\n"
+    response += f"\n**更新于**： {get_localized_time_string()}"
+    return response
+
+
+async def view_availability(query, context, api, user):
     # 获取服务状态
     try:
-        services_data = await api.get_services_status()
+        services = await api.get_service_records()
     except Exception as e:
         await edit_message_with_auto_delete(query, f"获取服务信息失败：{e}")
-        await api.close()
         return
-    # print("返回的服务数据:", services_data)
 
-    if services_data and services_data.get("success"):
-        services = services_data["data"].get("services", {})
+    if services is not None:
         if not services:
             await edit_message_with_auto_delete(query, "暂无可用性监测信息。")
-            await api.close()
             return
 
-        response = "**可用性监测信息总览**\n==========================\n"
-        for service_id, service_info in services.items():
-            service = service_info.get("service", {})
-            name = service_info.get("service_name", "未知")
-            total_up = service_info.get("total_up", 0)
-            total_down = service_info.get("total_down", 0)
-            total = total_up + total_down
-            availability = (total_up / total * 100) if total else 0
-            status = "🟢 UP" if service_info.get("current_up", 0) else "🔴 DOWN"
-            # 计算平均延迟
-            delays = service_info.get("delay", [])
-            if delays:
-                avg_delay = sum(delays) / len(delays)
-            else:
-                avg_delay = None
-            if avg_delay is not None:
-                delay_text = f"，平均延迟 {avg_delay:.2f}ms"
-            else:
-                delay_text = ""
-            response += f"**{name}**：可用率 {availability:.2f}%，状态 {status}{delay_text}\n------------------\n"
-        response += f"\n**更新于**： {get_localized_time_string()}"
+        def render():
+            # 添加刷新按钮
+            keyboard = [
+                [InlineKeyboardButton("刷新", callback_data="refresh_availability")]
+            ]
+            return format_availability(services), InlineKeyboardMarkup(keyboard)
 
-        # 添加刷新按钮
-        keyboard = [
-            [InlineKeyboardButton("刷新", callback_data="refresh_availability")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # 同一 /service 响应只渲染一次
+        response, reply_markup = render_cache.get_or_render(
+            user["id"], "availability", api.versions.get("/service"), render
+        )
         await edit_message_with_auto_delete(
             query, response, parse_mode="Markdown", reply_markup=reply_markup
         )
     else:
         await edit_message_with_auto_delete(query, "获取可用性监测信息失败。")
-    await api.close()
+
+
+async def get_service_history(api, dashboard_id, server_id):
+    """获取服务器的服务监测汇总，缓存有效期内直接返回缓存结果"""
+    key = (dashboard_id, server_id)
+    cached = history_cache.get(key)
+    if cached is not None:
+        return cached
+
+    histories, services = await asyncio.gather(
+        api.get_service_histories(server_id), api.get_service_records()
+    )
+    services = services or {}
+    summaries = summarize_histories(histories)
+    for summary in summaries:
+        service = services.get(str(summary["service_id"]))
+        summary["availability"] = availability_windows(service) if service else {}
+    result = {"services": summaries, "updated": get_localized_time_string()}
+    history_cache.set(key, result)
+    return result
+
+
+def format_service_history(result):
+    """构建服务器服务监测详情文本"""
+    response = "**服务监测详情**\n==========================\n"
+    for summary in result["services"]:
+        response += f"**{summary['name']}**\n"
+        if summary["p50"] is not None:
+            response += (
+                f"延迟：p50 {summary['p50']:.1f}ms / p95 {summary['p95']:.1f}ms / "
+                f"p99 {summary['p99']:.1f}ms，平均 {summary['avg']:.1f}ms\n"
+            )
+        response += (
+            f"样本：{summary['samples']} 个（失败 {summary['failed']}），"
+            f"跨度 {summary['span'] / 3600:.1f} 小时\n"
+        )
+        windows = [
+            f"{days}天 {value:.2f}%"
+            for days, value in summary["availability"].items()
+            if value is not None
+        ]
+        if windows:
+            response += f"可用率：{'，'.join(windows)}\n"
+        response += "------------------\n"
+    response += f"\n**更新于**： {result['updated']}"
+    return response
+
+
+async def view_service_history(query, context, api, user, server_id):
+    try:
+        result = await get_service_history(api, user["id"], server_id)
+    except Exception as e:
+        await edit_message_with_auto_delete(query, f"获取服务监测信息失败：{e}")
+        return
+
+    if not result["services"]:
+        await edit_message_with_auto_delete(query, "该服务器暂无服务监测信息。")
+        return
+
+    keyboard = [
+        [InlineKeyboardButton("刷新", callback_data=f"service_history_{server_id}")],
+        [InlineKeyboardButton("返回", callback_data=f"server_detail_{server_id}")],
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await edit_message_with_auto_delete(
+        query,
+        format_service_history(result),
+        parse_mode="Markdown",
+        reply_markup=reply_markup,
+    )
 
 
 async def cron_jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1095,32 +1971,343 @@ async def cron_jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    api = NezhaAPI(user["dashboard_url"], user["username"], user["password"])
+    api = get_api(user)
     try:
         data = await api.get_cron_jobs()
     except Exception as e:
         await send_message_with_auto_delete(update, context, f"获取计划任务失败：{e}")
-        await api.close()
         return
 
     if data and data.get("success"):
         cron_jobs = data["data"]
         if not cron_jobs:
             await send_message_with_auto_delete(update, context, "暂无计划任务。")
-            await api.close()
             return
 
-        keyboard = [
-            [InlineKeyboardButton(job["name"], callback_data=f"cron_job_{job['id']}")]
-            for job in cron_jobs
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        token = result_pages.store(
+            (job["name"], f"cron_job_{job['id']}") for job in cron_jobs
+        )
+        reply_markup = result_pages.keyboard(token)
         await send_message_with_auto_delete(
             update, context, "请选择要执行的计划任务：", reply_markup=reply_markup
         )
     else:
         await send_message_with_auto_delete(update, context, "获取计划任务失败。")
-    await api.close()
+
+
+TOP_USAGE = """用法：/top [指标] [数量]
+  例：/top cpu 10
+      /top transfer_all 20
+
+可用指标：{metrics}
+数量默认 {default}，最多 {max}"""
+
+
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """按指标列出当前默认面板中最高的若干台服务器，只使用已有的快照"""
+    user = await db.get_user(update.effective_user.id)
+    if not user:
+        await send_message_with_auto_delete(
+            update, context, "请先使用 /bind 命令绑定您的账号。"
+        )
+        return
+
+    args = context.args or []
+    metric = args[0].lower() if args else TOP_METRICS[0]
+    n = args[1] if len(args) > 1 else str(DEFAULT_TOP_N)
+    if metric not in METRICS or metric == "offline" or not n.isdigit():
+        usage = TOP_USAGE.format(
+            metrics=", ".join(m for m in METRICS if m != "offline"),
+            default=DEFAULT_TOP_N,
+            max=MAX_TOP_N,
+        )
+        await send_message_with_auto_delete(update, context, usage)
+        return
+    n = min(max(int(n), 1), MAX_TOP_N)
+
+    api = get_api(user)
+    try:
+        summary = await get_cached_summary(api, user["id"])
+    except Exception as e:
+        await send_message_with_auto_delete(update, context, f"获取数据失败：{e}")
+        return
+
+    if summary:
+        response, reply_markup = render_top(summary, user["id"], metric, n)
+        await send_message_with_auto_delete(
+            update, context, response, parse_mode="Markdown", reply_markup=reply_markup
+        )
+    else:
+        await send_message_with_auto_delete(update, context, "获取服务器信息失败。")
+
+
+EXPORT_USAGE = """用法：/export [格式] [history]
+  例：/export csv
+      /export ndjson history
+格式：{formats}（默认 csv）
+不带 history 时导出当前服务器列表，带 history 时导出后台轮询记录的循环流量采样"""
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """将当前默认面板的服务器快照或循环流量采样导出为文件"""
+    user = await db.get_user(update.effective_user.id)
+    if not user:
+        await send_message_with_auto_delete(
+            update, context, "请先使用 /bind 命令绑定您的账号。"
+        )
+        return
+
+    args = [arg.lower() for arg in context.args or []]
+    fmt = args[0] if args else "csv"
+    if fmt not in FORMATS or any(arg != "history" for arg in args[1:]):
+        await send_message_with_auto_delete(
+            update, context, EXPORT_USAGE.format(formats=", ".join(FORMATS))
+        )
+        return
+
+    if "history" in args:
+        dashboard_id = user["id"]
+        size = sum(
+            len(series)
+            for key, series in cycle_tracker.series.items()
+            if key[0] == dashboard_id
+        )
+        if not size:
+            await send_message_with_auto_delete(
+                update, context, "暂无循环流量采样记录。"
+            )
+            return
+        chunks = encode(fmt, HISTORY_COLUMNS, history_rows(cycle_tracker, dashboard_id))
+        name, caption = "cycle-history", f"[{user['alias']}] 循环流量采样 {size} 条"
+    else:
+        api = get_api(user)
+        try:
+            # 使用已有的 /server 快照，从未获取过时才请求面板
+            records = await api.get_server_records(refresh=False)
+        except Exception as e:
+            await send_message_with_auto_delete(update, context, f"获取数据失败：{e}")
+            return
+        if records is None:
+            await send_message_with_auto_delete(update, context, "获取服务器信息失败。")
+            return
+        size = len(records)
+        masks = {"ipv4": mask_ipv4, "ipv6": mask_ipv6}
+        chunks = encode(fmt, SERVER_COLUMNS, server_rows(records, masks))
+        name, caption = "servers", f"[{user['alias']}] 共 {size} 台服务器"
+
+    # 数据量较大时在工作线程中逐块生成文件
+    if size > THREAD_THRESHOLD:
+        path = await asyncio.to_thread(write_export, chunks, fmt)
+    else:
+        path = write_export(chunks, fmt)
+    filename = f"nezha-{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{FORMATS[fmt]}"
+    try:
+        with open(path, "rb") as f:
+            message = await update.message.reply_document(
+                document=f,
+                filename=filename,
+                caption=f"{caption}，导出于 {get_localized_time_string()}",
+            )
+    finally:
+        os.remove(path)
+    await schedule_group_cleanup(update, message)
+
+
+ALERT_USAGE = """用法：
+/alert add <指标> <比较符> <阈值> [持续时间] [服务器ID]
+  例：/alert add cpu > 90 5m
+      /alert add disk > 95%
+      /alert add transfer_out > 500G 0 12
+/alert del <规则ID> - 删除规则
+/alert sub - 订阅面板中配置的告警规则
+/alert unsub - 取消订阅
+
+可用指标：{metrics}
+比较符：{operators}"""
+
+
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """管理当前默认面板的告警规则与订阅"""
+    telegram_id = update.effective_user.id
+    user = await db.get_user(telegram_id)
+    if not user:
+        await send_message_with_auto_delete(
+            update, context, "请先使用 /bind 命令绑定您的账号。"
+        )
+        return
+
+    dashboard_id = user["id"]
+    args = context.args or []
+    action = args[0].lower() if args else "list"
+    usage = ALERT_USAGE.format(
+        metrics=", ".join(METRICS), operators=" ".join(OPERATORS)
+    )
+
+    if action == "add":
+        if len(args) < 4:
+            await send_message_with_auto_delete(update, context, usage)
+            return
+        metric, op = args[1].lower(), args[2]
+        threshold = parse_threshold(args[3])
+        duration = parse_duration(args[4]) if len(args) > 4 else 0
+        server_id = args[5] if len(args) > 5 else None
+        if (
+            metric not in METRICS
+            or op not in OPERATORS
+            or threshold is None
+            or duration is None
+            or (server_id is not None and not server_id.isdigit())
+        ):
+            await send_message_with_auto_delete(
+                update, context, f"规则格式错误。\n\n{usage}"
+            )
+            return
+        rule_id = await db.add_alert_rule(
+            telegram_id,
+            dashboard_id,
+            metric,
+            op,
+            threshold,
+            duration,
+            int(server_id) if server_id else None,
+        )
+        await load_alert_rules()
+        await send_message_with_auto_delete(
+            update, context, f"已添加告警规则 #{rule_id}，告警将私聊发送给您。"
+        )
+        return
+
+    if action == "del" and len(args) > 1 and args[1].isdigit():
+        if await db.delete_alert_rule(telegram_id, int(args[1])):
+            await load_alert_rules()
+            await send_message_with_auto_delete(
+                update, context, f"已删除告警规则 #{args[1]}。"
+            )
+        else:
+            await send_message_with_auto_delete(update, context, "未找到该规则。")
+        return
+
+    if action in ("sub", "unsub"):
+        await db.set_alert_subscription(telegram_id, dashboard_id, action == "sub")
+        await load_alert_rules()
+        message = (
+            f"已订阅面板 {user['alias']} 中配置的告警规则。"
+            if action == "sub"
+            else f"已取消订阅面板 {user['alias']} 的告警。"
+        )
+        await send_message_with_auto_delete(update, context, message)
+        return
+
+    # 列出当前面板的规则
+    lines = [f"面板 {user['alias']} 的告警规则："]
+    rules = [
+        r for r in user_alert_rules.get(dashboard_id, []) if r.owner == telegram_id
+    ]
+    for rule in rules:
+        duration = f"，持续 {rule.duration} 秒" if rule.duration else ""
+        scope = (
+            f"，服务器 {next(iter(rule.servers))}" if rule.servers else "，全部服务器"
+        )
+        lines.append(f"{rule.name}{duration}{scope}")
+    if not rules:
+        lines.append("（无）")
+    subscribed = telegram_id in alert_subscribers.get(dashboard_id, ())
+    lines.append(f"\n面板告警订阅：{'已订阅' if subscribed else '未订阅'}")
+    lines.append(f"\n{usage}")
+    await send_message_with_auto_delete(update, context, "\n".join(lines))
+
+
+THRESHOLD_USAGE = """用法：
+/threshold set <上行阈值> <下行阈值> [服务器ID] - 设置面板或单台服务器的流量阈值
+  例：/threshold set 1T 500G
+      /threshold set 200 0 12
+  数值不带单位时按 GB 计算，0 表示不告警
+/threshold del [服务器ID] - 删除阈值，恢复使用上一级设置"""
+
+
+def parse_traffic_threshold(text):
+    """解析流量阈值，不带单位时按 GB 计算"""
+    if text[-1:].isdigit():
+        text += "G"
+    return parse_threshold(text)
+
+
+async def threshold_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """管理当前默认面板的流量告警阈值"""
+    telegram_id = update.effective_user.id
+    user = await db.get_user(telegram_id)
+    if not user:
+        await send_message_with_auto_delete(
+            update, context, "请先使用 /bind 命令绑定您的账号。"
+        )
+        return
+
+    dashboard_id = user["id"]
+    args = context.args or []
+    action = args[0].lower() if args else "list"
+
+    if action == "set":
+        if len(args) < 3:
+            await send_message_with_auto_delete(update, context, THRESHOLD_USAGE)
+            return
+        upload = parse_traffic_threshold(args[1])
+        download = parse_traffic_threshold(args[2])
+        server_id = args[3] if len(args) > 3 else None
+        if (
+            upload is None
+            or download is None
+            or (server_id is not None and not server_id.isdigit())
+        ):
+            await send_message_with_auto_delete(
+                update, context, f"阈值格式错误。\n\n{THRESHOLD_USAGE}"
+            )
+            return
+        server_id = int(server_id) if server_id else TrafficThresholds.DASHBOARD
+        await db.set_traffic_threshold(dashboard_id, server_id, upload, download)
+        await load_traffic_thresholds()
+        render_cache.invalidate(dashboard_id)
+        await recheck_traffic_alerts(context, dict(user, telegram_id=telegram_id))
+        target = f"服务器 {server_id}" if server_id else f"面板 {user['alias']}"
+        await send_message_with_auto_delete(
+            update,
+            context,
+            f"已设置{target}的流量阈值：上行 {format_bytes(upload)}，下行 {format_bytes(download)}。",
+        )
+        return
+
+    if action == "del":
+        if len(args) > 1 and not args[1].isdigit():
+            await send_message_with_auto_delete(update, context, THRESHOLD_USAGE)
+            return
+        server_id = int(args[1]) if len(args) > 1 else TrafficThresholds.DASHBOARD
+        if await db.delete_traffic_threshold(dashboard_id, server_id):
+            await load_traffic_thresholds()
+            render_cache.invalidate(dashboard_id)
+            # 删除服务器阈值后可能回退到更低的面板阈值或默认值
+            await recheck_traffic_alerts(context, dict(user, telegram_id=telegram_id))
+            await send_message_with_auto_delete(update, context, "已删除流量阈值。")
+        else:
+            await send_message_with_auto_delete(update, context, "未找到该阈值设置。")
+        return
+
+    # 列出当前面板的阈值
+    def describe(limits):
+        upload, download = limits
+        return (
+            f"上行 {format_bytes(upload) if upload else '不告警'}，"
+            f"下行 {format_bytes(download) if download else '不告警'}"
+        )
+
+    settings = traffic_thresholds.for_dashboard(dashboard_id)
+    lines = [f"面板 {user['alias']} 的流量阈值："]
+    lines.append(
+        f"面板默认：{describe(traffic_thresholds.get(dashboard_id, TrafficThresholds.DASHBOARD))}"
+    )
+    for server_id, limits in sorted(settings.items()):
+        if server_id != TrafficThresholds.DASHBOARD:
+            lines.append(f"服务器 {server_id}：{describe(limits)}")
+    lines.append(f"\n{THRESHOLD_USAGE}")
+    await send_message_with_auto_delete(update, context, "\n".join(lines))
 
 
 async def services_overview(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1131,14 +2318,19 @@ async def services_overview(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
+    recent = await find_recent_reply(update, "services", user)
+    if recent is not None and await point_to_recent_reply(update, recent):
+        return
+
     keyboard = [
         [InlineKeyboardButton("查看循环流量信息", callback_data="view_loop_traffic")],
         [InlineKeyboardButton("查看可用性监测信息", callback_data="view_availability")],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await send_message_with_auto_delete(
+    message = await send_message_with_auto_delete(
         update, context, "请选择要查看的服务信息：", reply_markup=reply_markup
     )
+    await remember_reply(update, "services", user, message)
 
 
 async def dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1169,26 +2361,263 @@ async def edit_message_with_auto_delete(query: CallbackQuery, text: str, **kwarg
     """
     编辑消息并在群组中设置自动删除
     """
-    await query.edit_message_text(text, **kwargs)
+    try:
+        await query.edit_message_text(text, **kwargs)
+    except BadRequest as e:
+        # 缓存期内刷新得到的内容与原消息相同，无需修改
+        if "not modified" not in str(e):
+            raise
 
     # 如果是群组消息，设置定时删除
     if query.message.chat.type in ["group", "supergroup"]:
-        context = query.get_bot()
-        # 设置定时删除
-        context.job_queue.run_once(
-            lambda ctx: delete_message_later(
-                ctx, query.message.chat_id, query.message.message_id
-            ),
-            GROUP_MESSAGE_LIFETIME,
+        await state.schedule_deletion(
+            query.message.chat_id,
+            query.message.message_id,
+            time.time() + GROUP_MESSAGE_LIFETIME,
+        )
+
+
+async def warm_up(context: ContextTypes.DEFAULT_TYPE):
+    """后台任务：预先连接最近活跃用户的默认面板，建立连接、认证并缓存服务器列表"""
+    dashboards = await db.get_recent_dashboards(
+        time.time() - WARMUP_WINDOW, WARMUP_LIMIT
+    )
+    semaphore = asyncio.Semaphore(WARMUP_CONCURRENCY)
+
+    async def connect(dashboard):
+        async with semaphore:
+            try:
+                await get_api(dashboard).get_server_records()
+            except Exception as e:
+                logger.warning(f"预热面板 {dashboard['id']} 失败: {e}")
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(connect(d) for d in dashboards)), WARMUP_TIMEOUT
         )
+    except asyncio.TimeoutError:
+        logger.warning("启动预热超时，剩余面板将在首次使用时连接")
+    health.set_stage("ready", ready=True)
+
+
+async def save_snapshots(context):
+    """定期与停机时将变化过的面板快照写入数据库"""
+    try:
+        await warm_store.flush()
+    except Exception as e:
+        logger.warning(f"保存面板快照失败: {e}")
+
+
+async def save_conversations(context):
+    """清除过期的对话数据，并将变化批量写入数据库"""
+    conversation_store.evict_expired()
+    try:
+        await conversation_store.flush()
+    except Exception as e:
+        logger.warning(f"保存对话数据失败: {e}")
+
+
+def alert_windows_to_save():
+    """告警引擎中的窗口，以及尚未恢复（面板规则还未加载）的窗口"""
+    merged = {}
+    for source in (pending_alert_windows, alert_engine.windows):
+        for dashboard_id, windows in source.items():
+            if windows:
+                merged.setdefault(dashboard_id, {}).update(windows)
+    return merged
+
+
+async def save_runtime_state(application):
+    """停机时保存待删除消息、告警状态与未完成的对话，下次启动时恢复"""
+    await db.save_runtime_state("deletions", await state.export_deletions())
+    await db.save_runtime_state(
+        "alerts",
+        {
+            "marks": await state.export_alerts(),
+            "windows": {
+                str(dashboard_id): [
+                    [rule_key, server_id, started]
+                    for (rule_key, server_id), started in windows.items()
+                ]
+                for dashboard_id, windows in alert_windows_to_save().items()
+            },
+        },
+    )
+    await application.update_persistence()
+    await application.persistence.flush()
+    logger.info("运行状态已保存")
+
+
+async def restore_runtime_state():
+    """
+    恢复上次停机时保存的待删除消息与告警状态
+    （对话状态由 SQLitePersistence 恢复，已输入的内容由 ConversationStore 恢复）
+    """
+    now = time.time()
+    deletions = await db.pop_runtime_state("deletions", [])
+    for chat_id, message_id, due in deletions:
+        await state.schedule_deletion(chat_id, message_id, due)
+    alerts = await db.pop_runtime_state("alerts", {})
+    for key, expires in alerts.get("marks", {}).items():
+        if expires > now:
+            await state.mark_alert(key, expires - now)
+    for dashboard_id, windows in alerts.get("windows", {}).items():
+        dashboard_id = int(dashboard_id)
+        # 只恢复当前仍存在的规则的窗口，规则已删除时丢弃；
+        # 面板规则尚未加载，仍有订阅者时等到加载后再恢复
+        keys = alert_engine.keys.get(dashboard_id, {})
+        for rule_key, server_id, started in windows:
+            if rule_key in keys:
+                target = alert_engine.windows
+            elif rule_key.startswith("nezha:") and alert_subscribers.get(dashboard_id):
+                target = pending_alert_windows
+            else:
+                continue
+            target.setdefault(dashboard_id, {})[(rule_key, server_id)] = started
+    if deletions or alerts:
+        logger.info(f"已恢复 {len(deletions)} 条待删除消息与告警状态")
+
+
+async def drain(application):
+    """
+    收到停止信号后排空：停止接收新更新，在 DRAIN_TIMEOUT 内等待正在处理的更新完成，
+    然后保存运行状态并停止。再次收到信号时立即停止
+    """
+    global draining
+    if draining:
+        application.stop_running()
+        return
+    draining = True
+    health.set_stage("draining")
+    logger.info("收到停止信号，停止接收更新并等待处理中的请求完成")
+    if application.updater is not None and application.updater.running:
+        await application.updater.stop()
+    try:
+        await asyncio.wait_for(application.update_queue.join(), DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"等待处理中的更新超过 {DRAIN_TIMEOUT} 秒，直接保存状态")
+    try:
+        await save_runtime_state(application)
+    except Exception as e:
+        logger.error(f"保存运行状态失败: {e}")
+    finally:
+        # 保存失败也必须停止，否则进程不会退出
+        application.stop_running()
+
+
+async def post_init(application):
+    """
+    启动流程：在 Application 的事件循环中初始化数据库与内存中的规则，
+    随后在后台预热面板连接，预热完成后就绪探针才返回成功
+    """
+    global sharded_poller
+    if HEALTH_PORT:
+        await health.start()
+    health.set_stage("database")
+    await db.initialize()
+    health.set_stage("rules")
+    await asyncio.gather(
+        load_alert_rules(),
+        load_traffic_thresholds(),
+        warm_store.load(),
+        conversation_store.load(),
+    )
+    await restore_runtime_state()
+    if POLLER_PROCESSES > 0:
+        # 只在启用时才加载多进程轮询模块
+        from poller import ShardedPoller
+
+        sharded_poller = ShardedPoller(POLLER_PROCESSES, upstream_limiter)
+    # 由 drain 处理停止信号，先排空再退出
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(
+                sig, lambda: application.create_task(drain(application))
+            )
+        except NotImplementedError:
+            pass
+
+    # 预热作为一次性任务在开始接收更新的同时进行
+    health.set_stage("warm-up")
+    application.job_queue.run_once(warm_up, 0)
+
+
+async def post_stop(application):
+    # 停止接收更新后立即从负载均衡中摘除
+    health.set_stage("stopping")
+    # 发送仍在合并窗口中的告警
+    await alert_digest.flush()
+    # 保存最新的面板快照，下次启动时直接使用
+    await save_snapshots(application)
+    # 保存未完成的对话数据
+    await save_conversations(application)
+
+
+async def post_shutdown(application):
+    # 关闭轮询子进程
+    if sharded_poller is not None:
+        sharded_poller.shutdown()
+    # 关闭面板会话
+    await asyncio.gather(
+        *(close_api(dashboard_id) for dashboard_id in list(api_sessions))
+    )
+    await state.close()
+    await health.stop()
 
 
 def main():
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    # 数据库初始化与预热在 post_init 中完成
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .application_class(UserOrderedApplication)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .persistence(SQLitePersistence(db, CONVERSATION_TTL))
+        .rate_limiter(OutboundRateLimiter())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # 定期刷新即将过期的 token
+    application.job_queue.run_repeating(
+        refresh_tokens, interval=TOKEN_REFRESH_INTERVAL, first=TOKEN_REFRESH_INTERVAL
+    )
+
+    # 定期保存面板快照
+    application.job_queue.run_repeating(
+        save_snapshots, interval=SNAPSHOT_SAVE_INTERVAL, first=SNAPSHOT_SAVE_INTERVAL
+    )
+
+    # 定期清除过期的对话数据并写入数据库
+    application.job_queue.run_repeating(
+        save_conversations,
+        interval=CONVERSATION_SAVE_INTERVAL,
+        first=CONVERSATION_SAVE_INTERVAL,
+    )
+
+    # 删除到期的群组消息
+    application.job_queue.run_repeating(
+        process_deletions,
+        interval=DELETION_CHECK_INTERVAL,
+        first=DELETION_CHECK_INTERVAL,
+    )
+
+    # 实例心跳与告警轮询（多实例时按面板分片）
+    application.job_queue.run_repeating(
+        worker_heartbeat, interval=WORKER_HEARTBEAT_INTERVAL, first=0
+    )
+    if ALERT_POLL_INTERVAL > 0:
+        application.job_queue.run_repeating(
+            poll_dashboards, interval=ALERT_POLL_INTERVAL, first=ALERT_POLL_INTERVAL
+        )
 
-    # 初始化数据库
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(db.initialize())
+    # 记录请求用户（最先执行，不影响后续处理）
+    application.add_handler(TypeHandler(Update, track_user), group=-1)
+    # 记录更新处理耗时（最后执行）
+    application.add_handler(TypeHandler(Update, log_update_done), group=100)
 
     # 回调查询处理（放在最前面）
     application.add_handler(CallbackQueryHandler(button_handler))
@@ -1201,6 +2630,10 @@ def main():
     application.add_handler(CommandHandler("cron", cron_jobs))
     application.add_handler(CommandHandler("services", services_overview))
     application.add_handler(CommandHandler("dashboard", dashboard))
+    application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("threshold", threshold_command))
+    application.add_handler(CommandHandler("top", top_command))
+    application.add_handler(CommandHandler("export", export_command))
 
     # 绑定命令的会话处理
     bind_handler = ConversationHandler(
@@ -1218,6 +2651,11 @@ def main():
             BIND_ALIAS: [MessageHandler(filters.TEXT & ~filters.COMMAND, bind_alias)],
         },
         fallbacks=[],
+        # 无操作超过 CONVERSATION_TTL 后结束，与已输入内容的过期时间一致
+        conversation_timeout=CONVERSATION_TTL,
+        # 对话状态在停机时保存，重启后继续
+        name="bind",
+        persistent=True,
     )
     application.add_handler(bind_handler)
 
@@ -1230,11 +2668,31 @@ def main():
             ],
         },
         fallbacks=[],
+        conversation_timeout=CONVERSATION_TTL,
+        name="server",
+        persistent=True,
     )
     application.add_handler(server_handler)
 
-    # 在 run_polling 中指定 allowed_updates
-    application.run_polling(allowed_updates=["message", "callback_query"])
+    # 内联查询：@机器人 关键字 搜索服务器
+    application.add_handler(InlineQueryHandler(inline_query))
+
+    allowed_updates = ["message", "callback_query", "inline_query"]
+    if WEBHOOK_URL:
+        # webhook 模式，多个实例可以共享同一个入口
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=WEBHOOK_PORT,
+            url_path="telegram",
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/telegram",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+            # 停止信号由 drain 处理
+            stop_signals=None,
+        )
+    else:
+        # 在 run_polling 中指定 allowed_updates
+        application.run_polling(allowed_updates=allowed_updates, stop_signals=None)
 
 
 if __name__ == "__main__":
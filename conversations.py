@@ -0,0 +1,106 @@
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 对话数据在最后一次写入该时间（秒）后过期
+CONVERSATION_TTL = 600
+# 最多保存的用户数，超出时淘汰最久未更新的用户
+MAX_CONVERSATIONS = 10000
+
+
+class ConversationStore:
+    """
+    多步对话（如 /bind）中已输入的内容，按用户保存。
+    数据在最后一次写入 ttl 秒后过期，用户数超过 max_entries 时淘汰最久未更新的用户，
+    对话结束时由调用方 clear。
+    提供 db 时变化的用户记入 dirty，由 flush 批量写入数据库，启动时 load 恢复
+    """
+
+    def __init__(self, db=None, ttl=CONVERSATION_TTL, max_entries=MAX_CONVERSATIONS):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # user_id -> (更新时间, 数据)，按更新时间从旧到新排列
+        self._entries = OrderedDict()
+        # 尚未写入数据库的用户，包括已清除的用户
+        self.dirty = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        """用户当前对话的数据（副本），不存在或已过期时返回空字典"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return {}
+        if entry[0] + self.ttl <= time.time():
+            self._drop(user_id)
+            return {}
+        return dict(entry[1])
+
+    def update(self, user_id, **values):
+        data = self.get(user_id)
+        data.update(values)
+        self._entries[user_id] = (time.time(), data)
+        self._entries.move_to_end(user_id)
+        self._mark(user_id)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._mark(evicted)
+
+    def clear(self, user_id):
+        """对话结束（完成、失败或重新开始）时清除"""
+        self._drop(user_id)
+
+    def evict_expired(self):
+        """清除所有过期的数据，条目按更新时间排列，从最旧的开始检查即可"""
+        cutoff = time.time() - self.ttl
+        count = 0
+        while self._entries:
+            user_id, (updated_at, _) = next(iter(self._entries.items()))
+            if updated_at > cutoff:
+                break
+            self._drop(user_id)
+            count += 1
+        return count
+
+    def _drop(self, user_id):
+        if self._entries.pop(user_id, None) is not None:
+            self._mark(user_id)
+
+    def _mark(self, user_id):
+        if self.db is not None:
+            self.dirty.add(user_id)
+
+    async def load(self):
+        if self.db is None:
+            return
+        try:
+            rows = await self.db.get_conversations(time.time() - self.ttl)
+        except Exception as e:
+            logger.warning(f"载入对话数据失败: {e}")
+            return
+        for user_id, updated_at, data in sorted(rows, key=lambda row: row[1]):
+            self._entries[user_id] = (updated_at, data)
+        if rows:
+            logger.info(f"已恢复 {len(rows)} 个未完成的对话")
+
+    async def flush(self):
+        """将变化批量写入数据库：仍在对话中的用户写入，已清除或淘汰的用户删除"""
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        rows = [
+            (user_id, *self._entries[user_id])
+            for user_id in dirty
+            if user_id in self._entries
+        ]
+        removed = [user_id for user_id in dirty if user_id not in self._entries]
+        try:
+            await self.db.save_conversations(rows, removed)
+        except Exception:
+            # 下次 flush 时重试
+            self.dirty |= dirty
+            raise
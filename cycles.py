@@ -0,0 +1,110 @@
+from collections import deque
+
+# 计算消耗速率使用的时间窗口（秒）
+RATE_WINDOW = 6 * 3600
+# 每台服务器最多保留的采样点
+MAX_POINTS = 360
+
+
+def _timestamp(value):
+    if not value:
+        return None
+    from dateutil import parser
+
+    try:
+        return parser.isoparse(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def compact_cycles(services_data):
+    """
+    从 /service 返回的数据中提取循环流量统计，只保留跟踪所需的字段：
+    {rule_id: {"name", "max", "to", "server_name", "transfer"}}
+    """
+    if not services_data or not services_data.get("success"):
+        return {}
+    cycles = {}
+    for rule_id, stats in (
+        services_data["data"].get("cycle_transfer_stats") or {}
+    ).items():
+        cycles[str(rule_id)] = {
+            "name": stats.get("name", "未知规则"),
+            "max": stats.get("max", 0),
+            "to": _timestamp(stats.get("to")),
+            "server_name": {
+                str(k): v for k, v in (stats.get("server_name") or {}).items()
+            },
+            "transfer": {str(k): v for k, v in (stats.get("transfer") or {}).items()},
+        }
+    return cycles
+
+
+class CycleTracker:
+    """
+    循环流量跟踪：按 (面板, 规则, 服务器) 保存流量时间序列。
+    每次轮询只处理流量发生变化的服务器，速率与预计耗尽时间在读取时按当前时间计算
+    """
+
+    def __init__(self, window=RATE_WINDOW, max_points=MAX_POINTS):
+        self.window = window
+        self.max_points = max_points
+        # (dashboard_id, rule_id, server_id) -> deque[(时间, 已用流量)]
+        self.series = {}
+        # dashboard_id -> {rule_id: 规则信息}
+        self.rules = {}
+
+    def update(self, dashboard_id, cycles, now):
+        """写入一次轮询结果，返回流量有变化的 (dashboard_id, rule_id, server_id) 列表"""
+        previous = self.rules.get(dashboard_id, {})
+        # 已删除的规则，清除其时间序列
+        for rule_id in previous.keys() - cycles.keys():
+            for server_id in previous[rule_id]["transfer"]:
+                self.series.pop((dashboard_id, rule_id, server_id), None)
+        self.rules[dashboard_id] = cycles
+
+        changed = []
+        for rule_id, rule in cycles.items():
+            for server_id, value in rule["transfer"].items():
+                key = (dashboard_id, rule_id, server_id)
+                series = self.series.get(key)
+                if series and series[-1][1] == value:
+                    continue
+                # 新服务器或流量减少（进入新周期）时重新开始记录
+                if series is None or value < series[-1][1]:
+                    series = deque(maxlen=self.max_points)
+                    self.series[key] = series
+                series.append((now, value))
+                while len(series) > 2 and now - series[0][0] > self.window:
+                    series.popleft()
+                changed.append(key)
+        return changed
+
+    def rate(self, key, now):
+        """窗口内的平均消耗速率（字节/秒），数据不足时返回 None"""
+        series = self.series.get(key)
+        if not series or len(series) < 2:
+            return None
+        start_time, start_value = series[0]
+        elapsed = now - start_time
+        if elapsed <= 0:
+            return None
+        return (series[-1][1] - start_value) / elapsed
+
+    def projection(self, key, now):
+        """
+        返回 (速率, 预计耗尽时间)。已超限时耗尽时间为 now，
+        速率为 0 或数据不足时耗尽时间为 None
+        """
+        dashboard_id, rule_id, server_id = key
+        rule = self.rules.get(dashboard_id, {}).get(rule_id)
+        if rule is None:
+            return None, None
+        used = rule["transfer"].get(server_id, 0)
+        limit = rule["max"]
+        if limit and used >= limit:
+            return self.rate(key, now), now
+        rate = self.rate(key, now)
+        if not rate or rate <= 0 or not limit:
+            return rate, None
+        return rate, now + (limit - used) / rate
@@ -1,10 +1,15 @@
 # database.py
 
+import json
+import zlib
+
 import aiosqlite
 
 class Database:
-    def __init__(self, db_path):
+    def __init__(self, db_path, vault):
         self.db_path = db_path
+        # 凭据加解密，用户名、密码与 token 均以密文落盘
+        self.vault = vault
 
     async def initialize(self):
         async with aiosqlite.connect(self.db_path) as db:
@@ -25,9 +30,94 @@ class Database:
                     password TEXT NOT NULL,
                     dashboard_url TEXT NOT NULL,
                     alias TEXT,
+                    token TEXT,
+                    token_expires REAL,
                     FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
                 )
             ''')
+            # 旧版本数据库补充 token 相关字段
+            async with db.execute('PRAGMA table_info(dashboards)') as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if 'token' not in columns:
+                await db.execute('ALTER TABLE dashboards ADD COLUMN token TEXT')
+            if 'token_expires' not in columns:
+                await db.execute('ALTER TABLE dashboards ADD COLUMN token_expires REAL')
+            # 旧版本数据库补充用户最近活跃时间，用于启动预热
+            async with db.execute('PRAGMA table_info(users)') as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if 'last_active' not in columns:
+                await db.execute('ALTER TABLE users ADD COLUMN last_active REAL')
+
+            # 创建用户自定义告警规则表
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS alert_rules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    telegram_id INTEGER NOT NULL,
+                    dashboard_id INTEGER NOT NULL,
+                    metric TEXT NOT NULL,
+                    op TEXT NOT NULL,
+                    threshold REAL NOT NULL,
+                    duration INTEGER NOT NULL DEFAULT 0,
+                    server_id INTEGER,
+                    FOREIGN KEY (dashboard_id) REFERENCES dashboards (id)
+                )
+            ''')
+            # 创建面板告警订阅表（订阅面板中配置的告警规则）
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS alert_subscriptions (
+                    telegram_id INTEGER NOT NULL,
+                    dashboard_id INTEGER NOT NULL,
+                    PRIMARY KEY (telegram_id, dashboard_id),
+                    FOREIGN KEY (dashboard_id) REFERENCES dashboards (id)
+                )
+            ''')
+            # 创建流量阈值表，server_id 为 0 表示面板级阈值
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS traffic_thresholds (
+                    dashboard_id INTEGER NOT NULL,
+                    server_id INTEGER NOT NULL DEFAULT 0,
+                    upload REAL NOT NULL DEFAULT 0,
+                    download REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (dashboard_id, server_id),
+                    FOREIGN KEY (dashboard_id) REFERENCES dashboards (id)
+                )
+            ''')
+            # 创建运行状态表，停机时保存待删除消息、告警状态与未完成的对话，启动时恢复
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS runtime_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            ''')
+            # 创建面板快照表，保存每个面板最近一次的概览汇总（压缩并加密），启动时载入
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS dashboard_snapshots (
+                    dashboard_id INTEGER PRIMARY KEY,
+                    fetched_at REAL NOT NULL,
+                    data BLOB NOT NULL,
+                    FOREIGN KEY (dashboard_id) REFERENCES dashboards (id)
+                )
+            ''')
+            # 创建对话数据表，保存未完成的多步对话中已输入的内容（加密），重启后恢复
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS conversation_state (
+                    telegram_id INTEGER PRIMARY KEY,
+                    updated_at REAL NOT NULL,
+                    data TEXT NOT NULL
+                )
+            ''')
+
+            # 加密旧版本中以明文保存的凭据
+            async with db.execute('SELECT id, username, password FROM dashboards') as cursor:
+                rows = await cursor.fetchall()
+            for dashboard_id, username, password in rows:
+                if self.vault.is_encrypted(password):
+                    continue
+                await db.execute('''
+                    UPDATE dashboards
+                    SET username = ?, password = ?
+                    WHERE id = ?
+                ''', (self.vault.encrypt(username), self.vault.encrypt(password), dashboard_id))
             await db.commit()
 
     async def add_user(self, telegram_id, username, password, dashboard_url, alias=None):
@@ -46,7 +136,7 @@ class Database:
             await db.execute('''
                 INSERT INTO dashboards (telegram_id, username, password, dashboard_url, alias)
                 VALUES (?, ?, ?, ?, ?)
-            ''', (telegram_id, username, password, dashboard_url, alias))
+            ''', (telegram_id, self.vault.encrypt(username), self.vault.encrypt(password), dashboard_url, alias))
             
             # 获取最后插入的 dashboard_id
             cursor = await db.execute('SELECT last_insert_rowid()')
@@ -75,16 +165,84 @@ class Database:
         async with aiosqlite.connect(self.db_path) as db:
             # 获取用户的默认 dashboard
             async with db.execute('''
-                SELECT d.username, d.password, d.dashboard_url, d.alias
-                FROM users u 
-                JOIN dashboards d ON d.id = u.default_dashboard_id 
+                SELECT d.id, d.username, d.password, d.dashboard_url, d.alias,
+                       d.token, d.token_expires
+                FROM users u
+                JOIN dashboards d ON d.id = u.default_dashboard_id
                 WHERE u.telegram_id = ?
             ''', (telegram_id,)) as cursor:
                 row = await cursor.fetchone()
                 if row:
-                    return {'username': row[0], 'password': row[1], 'dashboard_url': row[2], 'alias': row[3]}
+                    return {
+                        'id': row[0],
+                        'username': self.vault.decrypt(row[1]),
+                        'password': self.vault.decrypt(row[2]),
+                        'dashboard_url': row[3],
+                        'alias': row[4],
+                        'token': self.vault.decrypt(row[5]),
+                        'token_expires': row[6]
+                    }
                 return None
 
+    async def get_dashboards(self):
+        # 获取所有用户的面板，供后台轮询使用
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('''
+                SELECT id, telegram_id, username, password, dashboard_url, alias,
+                       token, token_expires
+                FROM dashboards
+            ''') as cursor:
+                rows = await cursor.fetchall()
+                return [
+                    {
+                        'id': row[0],
+                        'telegram_id': row[1],
+                        'username': self.vault.decrypt(row[2]),
+                        'password': self.vault.decrypt(row[3]),
+                        'dashboard_url': row[4],
+                        'alias': row[5],
+                        'token': self.vault.decrypt(row[6]),
+                        'token_expires': row[7]
+                    }
+                    for row in rows
+                ]
+
+    async def get_recent_dashboards(self, since, limit):
+        # 获取最近活跃用户的默认面板，按活跃时间倒序，供启动预热使用
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('''
+                SELECT d.id, d.telegram_id, d.username, d.password, d.dashboard_url, d.alias,
+                       d.token, d.token_expires
+                FROM users u
+                JOIN dashboards d ON d.id = u.default_dashboard_id
+                WHERE u.last_active >= ?
+                ORDER BY u.last_active DESC
+                LIMIT ?
+            ''', (since, limit)) as cursor:
+                rows = await cursor.fetchall()
+                return [
+                    {
+                        'id': row[0],
+                        'telegram_id': row[1],
+                        'username': self.vault.decrypt(row[2]),
+                        'password': self.vault.decrypt(row[3]),
+                        'dashboard_url': row[4],
+                        'alias': row[5],
+                        'token': self.vault.decrypt(row[6]),
+                        'token_expires': row[7]
+                    }
+                    for row in rows
+                ]
+
+    async def touch_user(self, telegram_id, last_active):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                UPDATE users
+                SET last_active = ?
+                WHERE telegram_id = ?
+            ''', (last_active, telegram_id))
+            await db.commit()
+
     async def get_all_dashboards(self, telegram_id):
         async with aiosqlite.connect(self.db_path) as db:
             async with db.execute('''
@@ -98,8 +256,8 @@ class Database:
                 return [
                     {
                         'id': row[0],
-                        'username': row[1],
-                        'password': row[2],
+                        'username': self.vault.decrypt(row[1]),
+                        'password': self.vault.decrypt(row[2]),
                         'dashboard_url': row[3],
                         'alias': row[4],
                         'is_default': bool(row[5])
@@ -107,6 +265,15 @@ class Database:
                     for row in rows
                 ]
 
+    async def save_token(self, dashboard_id, token, token_expires):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                UPDATE dashboards
+                SET token = ?, token_expires = ?
+                WHERE id = ?
+            ''', (self.vault.encrypt(token), token_expires, dashboard_id))
+            await db.commit()
+
     async def set_default_dashboard(self, telegram_id, dashboard_id):
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute('''
@@ -127,11 +294,24 @@ class Database:
                 row = await cursor.fetchone()
                 is_default = row and row[0] == dashboard_id
 
+            # 删除该面板的流量阈值与快照
+            await db.execute('''
+                DELETE FROM traffic_thresholds
+                WHERE dashboard_id IN (SELECT id FROM dashboards WHERE id = ? AND telegram_id = ?)
+            ''', (dashboard_id, telegram_id))
+            await db.execute('''
+                DELETE FROM dashboard_snapshots
+                WHERE dashboard_id IN (SELECT id FROM dashboards WHERE id = ? AND telegram_id = ?)
+            ''', (dashboard_id, telegram_id))
+
             # 删除 dashboard
             await db.execute('''
                 DELETE FROM dashboards 
                 WHERE id = ? AND telegram_id = ?
             ''', (dashboard_id, telegram_id))
+            # 删除该面板的告警规则与订阅
+            await db.execute('DELETE FROM alert_rules WHERE dashboard_id = ? AND telegram_id = ?', (dashboard_id, telegram_id))
+            await db.execute('DELETE FROM alert_subscriptions WHERE dashboard_id = ? AND telegram_id = ?', (dashboard_id, telegram_id))
             
             # 检查是否还有其他面板
             async with db.execute('''
@@ -159,8 +339,173 @@ class Database:
 
     async def delete_user(self, telegram_id):
         async with aiosqlite.connect(self.db_path) as db:
-            # 删除用户的所有 dashboard
+            # 删除用户的所有 dashboard 及告警规则、订阅、流量阈值、快照
+            await db.execute('''
+                DELETE FROM traffic_thresholds
+                WHERE dashboard_id IN (SELECT id FROM dashboards WHERE telegram_id = ?)
+            ''', (telegram_id,))
+            await db.execute('''
+                DELETE FROM dashboard_snapshots
+                WHERE dashboard_id IN (SELECT id FROM dashboards WHERE telegram_id = ?)
+            ''', (telegram_id,))
             await db.execute('DELETE FROM dashboards WHERE telegram_id = ?', (telegram_id,))
+            await db.execute('DELETE FROM alert_rules WHERE telegram_id = ?', (telegram_id,))
+            await db.execute('DELETE FROM alert_subscriptions WHERE telegram_id = ?', (telegram_id,))
             # 删除用户
             await db.execute('DELETE FROM users WHERE telegram_id = ?', (telegram_id,))
             await db.commit()
+
+    async def add_alert_rule(self, telegram_id, dashboard_id, metric, op, threshold, duration, server_id=None):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                INSERT INTO alert_rules (telegram_id, dashboard_id, metric, op, threshold, duration, server_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (telegram_id, dashboard_id, metric, op, threshold, duration, server_id))
+            await db.commit()
+            return cursor.lastrowid
+
+    async def delete_alert_rule(self, telegram_id, rule_id):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                DELETE FROM alert_rules
+                WHERE id = ? AND telegram_id = ?
+            ''', (rule_id, telegram_id))
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def get_alert_rules(self):
+        # 获取所有用户的告警规则，加载到内存中的告警引擎
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('''
+                SELECT id, telegram_id, dashboard_id, metric, op, threshold, duration, server_id
+                FROM alert_rules
+            ''') as cursor:
+                rows = await cursor.fetchall()
+                return [
+                    {
+                        'id': row[0],
+                        'telegram_id': row[1],
+                        'dashboard_id': row[2],
+                        'metric': row[3],
+                        'op': row[4],
+                        'threshold': row[5],
+                        'duration': row[6],
+                        'server_id': row[7]
+                    }
+                    for row in rows
+                ]
+
+    async def set_alert_subscription(self, telegram_id, dashboard_id, subscribed):
+        async with aiosqlite.connect(self.db_path) as db:
+            if subscribed:
+                await db.execute('''
+                    INSERT OR IGNORE INTO alert_subscriptions (telegram_id, dashboard_id)
+                    VALUES (?, ?)
+                ''', (telegram_id, dashboard_id))
+            else:
+                await db.execute('''
+                    DELETE FROM alert_subscriptions
+                    WHERE telegram_id = ? AND dashboard_id = ?
+                ''', (telegram_id, dashboard_id))
+            await db.commit()
+
+    async def get_alert_subscriptions(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('SELECT telegram_id, dashboard_id FROM alert_subscriptions') as cursor:
+                return await cursor.fetchall()
+
+    async def set_traffic_threshold(self, dashboard_id, server_id, upload, download):
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                INSERT OR REPLACE INTO traffic_thresholds (dashboard_id, server_id, upload, download)
+                VALUES (?, ?, ?, ?)
+            ''', (dashboard_id, server_id, upload, download))
+            await db.commit()
+
+    async def delete_traffic_threshold(self, dashboard_id, server_id):
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute('''
+                DELETE FROM traffic_thresholds
+                WHERE dashboard_id = ? AND server_id = ?
+            ''', (dashboard_id, server_id))
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def get_traffic_thresholds(self):
+        # 一次性读取全部流量阈值，加载到内存查找表
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('SELECT dashboard_id, server_id, upload, download FROM traffic_thresholds') as cursor:
+                return await cursor.fetchall()
+
+    async def save_runtime_state(self, key, value):
+        # 对话数据中可能包含密码，整体加密保存
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('''
+                INSERT OR REPLACE INTO runtime_state (key, value)
+                VALUES (?, ?)
+            ''', (key, self.vault.encrypt(json.dumps(value))))
+            await db.commit()
+
+    async def load_runtime_state(self, key, default=None):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('SELECT value FROM runtime_state WHERE key = ?', (key,)) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return default
+        return json.loads(self.vault.decrypt(row[0]))
+
+    async def pop_runtime_state(self, key, default=None):
+        # 读取后删除，保证状态只恢复一次
+        value = await self.load_runtime_state(key, default)
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('DELETE FROM runtime_state WHERE key = ?', (key,))
+            await db.commit()
+        return value
+
+    async def save_snapshots(self, snapshots):
+        # snapshots: [(dashboard_id, 汇总结果)]，JSON 压缩后加密保存
+        rows = [
+            (
+                dashboard_id,
+                summary['fetched_at'],
+                self.vault.encrypt_bytes(zlib.compress(json.dumps(summary, separators=(',', ':')).encode())),
+            )
+            for dashboard_id, summary in snapshots
+        ]
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany('''
+                INSERT OR REPLACE INTO dashboard_snapshots (dashboard_id, fetched_at, data)
+                VALUES (?, ?, ?)
+            ''', rows)
+            await db.commit()
+
+    async def save_conversations(self, rows, removed):
+        # rows: [(telegram_id, 更新时间, 对话数据)]，removed: 已结束的对话，一次事务写入
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany('''
+                INSERT OR REPLACE INTO conversation_state (telegram_id, updated_at, data)
+                VALUES (?, ?, ?)
+            ''', [(telegram_id, updated_at, self.vault.encrypt(json.dumps(data))) for telegram_id, updated_at, data in rows])
+            await db.executemany('DELETE FROM conversation_state WHERE telegram_id = ?', [(telegram_id,) for telegram_id in removed])
+            await db.commit()
+
+    async def get_conversations(self, expired_before):
+        # 删除已过期的对话，返回其余的 [(telegram_id, 更新时间, 对话数据)]
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute('DELETE FROM conversation_state WHERE updated_at < ?', (expired_before,))
+            await db.commit()
+            async with db.execute('SELECT telegram_id, updated_at, data FROM conversation_state') as cursor:
+                rows = await cursor.fetchall()
+        return [
+            (telegram_id, updated_at, json.loads(self.vault.decrypt(data)))
+            for telegram_id, updated_at, data in rows
+        ]
+
+    async def get_snapshots(self):
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute('SELECT dashboard_id, data FROM dashboard_snapshots') as cursor:
+                rows = await cursor.fetchall()
+        return [
+            (dashboard_id, json.loads(zlib.decompress(self.vault.decrypt_bytes(data))))
+            for dashboard_id, data in rows
+        ]
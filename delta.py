@@ -0,0 +1,100 @@
+from summary import SERVER_FIELDS
+
+_F = {name: index for index, name in enumerate(SERVER_FIELDS)}
+
+# 按绝对值比较的指标及其阈值，其余数值字段按相对变化比较
+ABSOLUTE_EPSILON = {"cpu": 0.1, "load_1": 0.01}
+# 相对变化阈值（字节类指标）
+RELATIVE_EPSILON = 1e-3
+
+_ID = _F["id"]
+_NAME = _F["name"]
+_ONLINE = _F["online"]
+_COMPARED = [
+    (index, ABSOLUTE_EPSILON.get(name))
+    for name, index in _F.items()
+    if name not in ("id", "name", "online")
+]
+
+
+def row_changed(old, new):
+    """判断两条汇总行是否有超过阈值的变化"""
+    if old[_NAME] != new[_NAME] or old[_ONLINE] != new[_ONLINE]:
+        return True
+    for index, epsilon in _COMPARED:
+        a, b = old[index], new[index]
+        if a == b:
+            continue
+        if epsilon is not None:
+            if abs(a - b) > epsilon:
+                return True
+        elif abs(a - b) > max(abs(a), abs(b)) * RELATIVE_EPSILON:
+            return True
+    return False
+
+
+class SnapshotDelta:
+    """两次汇总结果之间的差异"""
+
+    __slots__ = ("version", "added", "removed", "changed", "online", "offline", "rows")
+
+    def __init__(self, version, rows):
+        self.version = version
+        # 新增服务器的汇总行
+        self.added = []
+        # 已删除服务器的 id
+        self.removed = []
+        # 指标变化超过阈值的汇总行（不含新增）
+        self.changed = []
+        # 本次上线 / 离线的服务器 id
+        self.online = []
+        self.offline = []
+        # 当前全部汇总行 {server_id: row}
+        self.rows = rows
+
+    @property
+    def updated(self):
+        """需要重新处理的汇总行：新增与变化的服务器"""
+        return self.added + self.changed
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+class SnapshotDiffer:
+    """
+    保存每个面板各服务器最近一次报告为变化的汇总行，计算与新汇总结果之间的差异。
+    未报告的小幅变化不会更新基准，缓慢增长的指标累积超过阈值后同样会被报告。
+    只有存在差异时版本号才会递增，下游可据此跳过未变化的渲染与求值
+    """
+
+    def __init__(self):
+        # dashboard_id -> (版本号, {server_id: 最近一次报告的 row})
+        self._previous = {}
+
+    def diff(self, dashboard_id, summary):
+        version, previous = self._previous.get(dashboard_id, (0, {}))
+        rows = {row[_ID]: row for row in summary["servers"]}
+        delta = SnapshotDelta(version, rows)
+        reported = {}
+        for server_id, row in rows.items():
+            old = previous.get(server_id)
+            if old is None:
+                delta.added.append(row)
+                reported[server_id] = row
+                continue
+            if not row_changed(old, row):
+                reported[server_id] = old
+                continue
+            delta.changed.append(row)
+            reported[server_id] = row
+            if old[_ONLINE] != row[_ONLINE]:
+                (delta.online if row[_ONLINE] else delta.offline).append(server_id)
+        delta.removed = [server_id for server_id in previous if server_id not in rows]
+        if delta:
+            delta.version = version + 1
+        self._previous[dashboard_id] = (delta.version, reported)
+        return delta
+
+    def forget(self, dashboard_id):
+        self._previous.pop(dashboard_id, None)
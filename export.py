@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+
+from models import ServerRecord
+
+# 每个数据块包含的行数，生成与写入都按块进行，内存占用与服务器数量无关
+CHUNK_ROWS = 500
+# 服务器数量超过该值时在工作线程中生成文件，避免阻塞事件循环
+THREAD_THRESHOLD = 1000
+# 支持的导出格式 -> 文件扩展名
+FORMATS = {"csv": "csv", "ndjson": "ndjson"}
+
+# 备注（note）为面板内部信息，/export 可在群组中使用，不导出
+SERVER_COLUMNS = tuple(field for field in ServerRecord.__slots__ if field != "note")
+HISTORY_COLUMNS = (
+    "rule_id",
+    "rule_name",
+    "server_id",
+    "server_name",
+    "time",
+    "transfer",
+)
+
+
+def server_rows(records, masks=None):
+    """按 SERVER_COLUMNS 顺序逐行生成服务器数据，masks 为 字段 -> 脱敏函数"""
+    masks = masks or {}
+    for record in records:
+        row = []
+        for field in SERVER_COLUMNS:
+            value = getattr(record, field)
+            if field == "cpu_info":
+                value = "; ".join(value)
+            elif field in masks and value:
+                value = masks[field](value)
+            row.append(value)
+        yield row
+
+
+def history_rows(tracker, dashboard_id):
+    """逐行生成面板的循环流量采样记录"""
+    rules = tracker.rules.get(dashboard_id, {})
+    for (series_dashboard, rule_id, server_id), series in list(tracker.series.items()):
+        if series_dashboard != dashboard_id or rule_id not in rules:
+            continue
+        rule = rules[rule_id]
+        for timestamp, transfer in list(series):
+            yield [
+                rule_id,
+                rule["name"],
+                server_id,
+                rule["server_name"].get(server_id, ""),
+                datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+                transfer,
+            ]
+
+
+def iter_csv(columns, rows):
+    """将行按块编码为 CSV 文本"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(columns, rows):
+    """将行按块编码为每行一个 JSON 对象的文本"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        if len(lines) >= CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def write_export(chunks, fmt):
+    """
+    将数据块依次写入临时文件并返回路径，调用方负责删除。
+    CSV 带 BOM，便于表格软件正确识别中文
+    """
+    fd, path = tempfile.mkstemp(suffix=f".{FORMATS[fmt]}")
+    encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+    try:
+        with os.fdopen(fd, "w", encoding=encoding, newline="") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def encode(fmt, columns, rows):
+    return (iter_csv if fmt == "csv" else iter_ndjson)(columns, rows)
@@ -0,0 +1,55 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class HealthServer:
+    """
+    容器编排使用的探针：
+    /healthz 存活探针，事件循环能够响应即返回 200；
+    /readyz 就绪探针，启动完成（数据库初始化、规则加载、预热）且未在关闭时返回 200，否则 503
+    """
+
+    def __init__(self, port, host="0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.started_at = time.monotonic()
+        self.ready = False
+        # 当前启动阶段，便于排查卡住的步骤
+        self.stage = "starting"
+        self._runner = None
+
+    def set_stage(self, stage, ready=False):
+        self.stage = stage
+        self.ready = ready
+        logger.info(f"启动阶段: {stage}（{time.monotonic() - self.started_at:.2f}s）")
+
+    async def start(self):
+        # 只在启用探针时才加载 aiohttp.web
+        from aiohttp import web
+
+        async def liveness(request):
+            return web.json_response(
+                {"status": "alive", "uptime": time.monotonic() - self.started_at}
+            )
+
+        async def readiness(request):
+            return web.json_response(
+                {"status": "ready" if self.ready else "not ready", "stage": self.stage},
+                status=200 if self.ready else 503,
+            )
+
+        app = web.Application()
+        app.router.add_get("/healthz", liveness)
+        app.router.add_get("/readyz", readiness)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"健康检查已监听 {self.host}:{self.port}")
+
+    async def stop(self):
+        self.ready = False
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
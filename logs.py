@@ -0,0 +1,178 @@
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# 当前更新的结构化字段（用户、处理器等），由 ContextFilter 附加到每条日志
+log_context = contextvars.ContextVar("log_context", default={})
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# 默认的模块日志级别：httpx 与 apscheduler 会为每次请求、每次任务输出 INFO 日志
+DEFAULT_LOG_LEVELS = "httpx=WARNING,apscheduler=WARNING"
+# 日志队列长度，输出跟不上时丢弃新日志而不是阻塞事件循环
+QUEUE_SIZE = 10000
+
+
+def bind_log_context(**fields):
+    """设置当前上下文（当前更新所在的任务）的日志字段，返回用于 reset 的 token"""
+    return log_context.set(fields)
+
+
+class ContextFilter(logging.Filter):
+    """
+    将 log_context 与调用时 extra={"fields": {...}} 传入的字段合并为 record.fields。
+    在产生日志的线程中执行，才能读到当前任务的上下文
+    """
+
+    def filter(self, record):
+        fields = getattr(record, "fields", None)
+        context = log_context.get()
+        if context:
+            record.fields = {**context, **fields} if fields else context
+        elif fields is None:
+            record.fields = {}
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """按模块对 WARNING 以下的日志采样，rates 为 模块名 -> 保留比例"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition(".")[0]
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    只把日志记录放入队列：格式化与输出都在 QueueListener 的线程中完成，
+    队列已满时丢弃并计数，不阻塞调用方
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 队列在进程内，记录无需序列化；默认实现会在调用方线程中格式化消息
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    """原有的文本格式，结构化字段以 key=value 附加在消息之后"""
+
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if not fields:
+            return text
+        pairs = " ".join(f"{key}={value}" for key, value in fields.items())
+        head, sep, tail = text.partition("\n")
+        return f"{head} [{pairs}]{sep}{tail}"
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行 JSON，结构化字段作为顶层键"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def parse_levels(spec):
+    """解析 "summary=DEBUG,httpx=WARNING" 形式的模块日志级别"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def parse_samples(spec):
+    """解析 "summary=0.01,nezha_api=0.1" 形式的模块采样比例"""
+    return {name: float(rate) for name, rate in parse_levels(spec).items()}
+
+
+def setup_logging(
+    level="INFO", levels="", samples="", fmt="text", stream=None, queue_size=QUEUE_SIZE
+):
+    """
+    配置根日志：各模块只把记录放入队列，由后台线程格式化并写入 stream（默认 stderr），
+    输出缓慢时不会阻塞事件循环。
+    levels 为按模块的日志级别，samples 为按模块的采样比例（只作用于 WARNING 以下），
+    fmt 为 text 或 json。返回已启动的 QueueListener，进程退出时自动停止并输出剩余日志
+    """
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(
+        JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT)
+    )
+
+    handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    # 先采样，被丢弃的日志不再附加上下文
+    handler.addFilter(SamplingFilter(parse_samples(samples)))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, module_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+
+    def stop():
+        if listener._thread is None:
+            return
+        # 队列已满时等待后台线程腾出位置，再放入结束标记
+        while True:
+            try:
+                listener.stop()
+                break
+            except queue.Full:
+                time.sleep(0.01)
+        if handler.dropped:
+            output.handle(
+                logging.makeLogRecord(
+                    {
+                        "name": __name__,
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": f"日志队列已满，共丢弃 {handler.dropped} 条日志",
+                    }
+                )
+            )
+
+    atexit.register(stop)
+    return listener
@@ -0,0 +1,152 @@
+class ServerRecord:
+    """
+    单台服务器的紧凑记录：每次获取 /server 时由原始 JSON 构建一次，
+    只保留机器人用到的字段，避免缓存中长期持有完整的嵌套字典
+    """
+
+    __slots__ = (
+        "id",
+        "name",
+        "note",
+        "public_note",
+        "last_active",
+        "ipv4",
+        "ipv6",
+        "country_code",
+        "platform",
+        "arch",
+        "cpu_info",
+        "mem_total",
+        "swap_total",
+        "disk_total",
+        "uptime",
+        "cpu",
+        "load_1",
+        "load_5",
+        "load_15",
+        "mem_used",
+        "swap_used",
+        "disk_used",
+        "net_in_transfer",
+        "net_out_transfer",
+        "net_in_speed",
+        "net_out_speed",
+    )
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_api(cls, server):
+        host = server.get("host") or {}
+        state = server.get("state") or {}
+        geoip = server.get("geoip") or {}
+        ip = geoip.get("ip") or {}
+        return cls(
+            server.get("id"),
+            server.get("name", "未知"),
+            server.get("note", ""),
+            server.get("public_note", ""),
+            server.get("last_active"),
+            ip.get("ipv4_addr", ""),
+            ip.get("ipv6_addr", ""),
+            geoip.get("country_code", ""),
+            host.get("platform", ""),
+            host.get("arch", ""),
+            tuple(host.get("cpu") or ()),
+            host.get("mem_total", 0),
+            host.get("swap_total", 0),
+            host.get("disk_total", 0),
+            state.get("uptime", 0),
+            state.get("cpu", 0),
+            state.get("load_1", 0),
+            state.get("load_5", 0),
+            state.get("load_15", 0),
+            state.get("mem_used", 0),
+            state.get("swap_used", 0),
+            state.get("disk_used", 0),
+            state.get("net_in_transfer", 0),
+            state.get("net_out_transfer", 0),
+            state.get("net_in_speed", 0),
+            state.get("net_out_speed", 0),
+        )
+
+    def to_row(self):
+        """按 __slots__ 顺序转为列表，用于在状态后端中以 JSON 保存"""
+        return [getattr(self, field) for field in self.__slots__]
+
+    @classmethod
+    def from_row(cls, row):
+        record = cls(*row)
+        record.cpu_info = tuple(record.cpu_info)
+        return record
+
+
+class ServiceRecord:
+    """/service 中单个监测服务的紧凑记录，平均延迟在构建时计算一次"""
+
+    __slots__ = (
+        "id",
+        "name",
+        "current_up",
+        "total_up",
+        "total_down",
+        "avg_delay",
+        "up",
+        "down",
+    )
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_api(cls, service_id, info):
+        delays = info.get("delay") or []
+        return cls(
+            str(service_id),
+            info.get("service_name", "未知"),
+            info.get("current_up", 0),
+            info.get("total_up", 0),
+            info.get("total_down", 0),
+            sum(delays) / len(delays) if delays else None,
+            tuple(info.get("up") or ()),
+            tuple(info.get("down") or ()),
+        )
+
+    @property
+    def availability(self):
+        total = self.total_up + self.total_down
+        return self.total_up / total * 100 if total else 0
+
+
+def compact_servers(data):
+    """将 /server 响应转为紧凑格式：data 中每台服务器为 ServerRecord.to_row() 列表"""
+    if not data or not data.get("success"):
+        return data
+    return {
+        "success": True,
+        "data": [ServerRecord.from_api(s).to_row() for s in data.get("data") or []],
+    }
+
+
+def parse_server_records(data):
+    """从紧凑的 /server 响应构建 ServerRecord 列表，兼容旧格式的原始字典"""
+    return [
+        (
+            ServerRecord.from_api(row)
+            if isinstance(row, dict)
+            else ServerRecord.from_row(row)
+        )
+        for row in data.get("data") or []
+    ]
+
+
+def parse_service_records(data):
+    """从 /service 响应构建 ServiceRecord 字典：{service_id: ServiceRecord}"""
+    services = (data.get("data") or {}).get("services") or {}
+    return {
+        str(service_id): ServiceRecord.from_api(service_id, info)
+        for service_id, info in services.items()
+    }
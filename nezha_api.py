@@ -1,66 +1,206 @@
-import aiohttp
 import asyncio
+import base64
+import json
 import logging
+import time
+
+from ratelimit import current_user
+from state import MemoryStateBackend
+from transport import TransportError, create_transport
+from search import SearchIndex, SEARCH_LIMIT, parse_server_groups
+from models import compact_servers, parse_server_records, parse_service_records
+
+# 使用模块日志器，便于按模块设置日志级别与采样
+logger = logging.getLogger(__name__)
 
 class NezhaAPI:
-    def __init__(self, dashboard_url, username, password):
-        self.base_url = dashboard_url.rstrip('/') + '/api/v1'
+    # 请求前 token 剩余有效期不足该秒数时先行刷新
+    TOKEN_EXPIRY_MARGIN = 10
+    # 响应快照在状态后端中的保存时间（秒）
+    SNAPSHOT_TTL = 3600
+    # 服务器分组很少变化，该时间（秒）内复用上一次的 /server-group 响应
+    GROUP_MAX_AGE = 600
+
+    def __init__(self, dashboard_url, username, password, token=None, token_expires=None, on_token=None, limiter=None, state=None, cache_key=None, transport=None):
+        self.base_url = api_base_url(dashboard_url)
         self.username = username
         self.password = password
-        self.token = None
-        self.session = aiohttp.ClientSession()
-        self.lock = asyncio.Lock()
+        # 复用此前持久化且尚未过期的 token，避免冷启动时重新登录
+        self.token = token
+        self.token_expires = token_expires
+        if self.token is not None and self.token_expires is None:
+            self.token_expires = parse_jwt_exp(self.token)
+        if self.token_expiring(0):
+            self.token = None
+        # 获取到新 token 时的回调，用于持久化
+        self.on_token = on_token
+        # 按面板地址限流的上游调度器，为 None 时不限流
+        self.limiter = limiter
+        # 各 GET 接口最近一次成功的响应保存在状态后端中，限流时用作降级结果
+        self.state = state or MemoryStateBackend()
+        self.cache_key = cache_key or self.base_url
+        # 接口 -> 最近一次 request 返回的响应的获取时间，与快照中的 fetched_at 相同
+        self.fetched_at = {}
+        # 接口 -> (响应的获取时间, 解析结果)，同一响应只解析一次。
+        # 按获取时间而不是对象判断：Redis 状态后端每次读取快照都会得到新的对象
+        self._parsed = {}
+        # 接口 -> 版本号，每次解析新的响应时递增，渲染缓存据此失效
+        self.versions = {}
+        # 基于服务器记录构建的搜索索引
+        self.search_index = None
+        self._search_source = None
+        # HTTP 传输层，默认由 NEZHA_TRANSPORT 环境变量选择
+        self.transport = transport or create_transport()
+        # 正在进行的刷新任务，并发请求共同等待同一次刷新
+        self._auth_task = None
+        # 已发出的上游请求数（含登录与续期），多进程轮询据此补扣限流令牌
+        self.request_count = 0
+
+    def token_expiring(self, margin):
+        """token 不存在，或将在 margin 秒内过期"""
+        if self.token is None:
+            return True
+        return self.token_expires is not None and self.token_expires - margin <= time.time()
 
     async def close(self):
-        await self.session.close()
+        await self.transport.close()
+
+    async def _send(self, method, url, **kwargs):
+        self.request_count += 1
+        return await self.transport.request(method, url, **kwargs)
+
+    async def authenticate(self, margin=TOKEN_EXPIRY_MARGIN):
+        if not self.token_expiring(margin):
+            return
+        if self._auth_task is None:
+            self._auth_task = asyncio.ensure_future(self._refresh())
+            self._auth_task.add_done_callback(self._auth_done)
+        await asyncio.shield(self._auth_task)
+
+    def _auth_done(self, task):
+        self._auth_task = None
+        # 所有等待方都可能已被取消，这里读取异常避免未处理异常告警
+        if not task.cancelled():
+            task.exception()
 
-    async def authenticate(self):
-        async with self.lock:
-            if self.token is not None:
-                return
+    async def _refresh(self):
+        data = None
+        # token 仍有效时优先使用 /refresh-token 续期，失败再重新登录
+        if not self.token_expiring(0):
+            headers = {'Authorization': f'Bearer {self.token}'}
+            try:
+                status, body = await self._send('GET', f'{self.base_url}/refresh-token', headers=headers)
+                if status == 200:
+                    data = body
+            except TransportError as e:
+                logger.warning(f'刷新 token 失败：{e}')
+        if not data or not data.get('success'):
             login_url = f'{self.base_url}/login'
             payload = {
                 'username': self.username,
                 'password': self.password
             }
-            async with self.session.post(login_url, json=payload) as resp:
-                data = await resp.json()
-                if data.get('success'):
-                    self.token = data['data']['token']
-                else:
-                    raise Exception('认证失败，请检查用户名和密码。')
-
-    async def request(self, method, endpoint, **kwargs):
+            status, data = await self._send('POST', login_url, json=payload)
+            if not data or not data.get('success'):
+                raise Exception('认证失败，请检查用户名和密码。')
+
+        self.token = data['data']['token']
+        self.token_expires = parse_expire(data['data'].get('expire')) or parse_jwt_exp(self.token)
+        if self.on_token:
+            await self.on_token(self.token, self.token_expires)
+
+    async def request(self, method, endpoint, cache=False, compact=None, _retried=False, **kwargs):
+        if self.limiter is not None and not _retried:
+            scheduler = self.limiter.get(self.base_url)
+            if not await scheduler.try_acquire():
+                # 超出面板限流时直接返回最近一次的快照，没有快照再排队等待
+                snapshot = await self.get_snapshot(endpoint) if cache else None
+                if snapshot is not None:
+                    self.fetched_at[endpoint] = snapshot['fetched_at']
+                    return snapshot['data']
+                await scheduler.acquire(current_user.get())
+
         await self.authenticate()
+        token = self.token
         url = f'{self.base_url}{endpoint}'
         headers = kwargs.get('headers', {})
-        headers['Authorization'] = f'Bearer {self.token}'
+        headers['Authorization'] = f'Bearer {token}'
         kwargs['headers'] = headers
 
-        async with self.session.request(method, url, **kwargs) as resp:
-            if resp.status == 401:
+        started = time.perf_counter()
+        status, data = await self._send(method, url, **kwargs)
+        fields = {
+            'dashboard': self.cache_key,
+            'endpoint': endpoint,
+            'status': status,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+        logger.debug('面板请求完成', extra={'fields': fields})
+        if status == 401 and not _retried:
+            # 只作废本次使用的 token，其他请求可能已完成刷新
+            if self.token == token:
                 self.token = None
-                return await self.request(method, endpoint, **kwargs)
-            elif resp.status == 200:
-                return await resp.json()
-            else:
-                logging.error(f'API 请求失败：{resp.status}')
-                return None
+                self.token_expires = None
+            return await self.request(method, endpoint, cache=cache, compact=compact, _retried=True, **kwargs)
+        elif status == 200:
+            # 只保留需要的字段，快照中不再持有完整的响应
+            if compact is not None:
+                data = compact(data)
+            if cache:
+                fetched_at = time.time()
+                await self.state.set_snapshot(
+                    f'{self.cache_key}{endpoint}',
+                    {'fetched_at': fetched_at, 'data': data},
+                    self.SNAPSHOT_TTL,
+                )
+                # 返回前不再有 await，调用方随后读取到的即为本次响应的时间
+                self.fetched_at[endpoint] = fetched_at
+            return data
+        else:
+            logger.error(f'API 请求失败：{status}', extra={'fields': fields})
+            return None
+
+    async def get_snapshot(self, endpoint):
+        """最近一次成功响应的快照：{'fetched_at': 时间戳, 'data': 响应}"""
+        return await self.state.get_snapshot(f'{self.cache_key}{endpoint}')
 
     async def get_overview(self):
-        data = await self.request('GET', '/server')
+        data = await self.request('GET', '/server', cache=True, compact=compact_servers)
         return data
 
     async def get_services(self):
-        data = await self.request('GET', '/service')
+        data = await self.request('GET', '/service', cache=True)
         return data
 
     async def get_servers(self):
-        data = await self.request('GET', '/server')
+        data = await self.request('GET', '/server', cache=True, compact=compact_servers)
         return data
 
+    async def get_server_records(self, refresh=True):
+        """
+        获取 ServerRecord 列表。refresh 为 False 时直接使用已缓存的 /server 快照，
+        仅在从未获取过服务器列表时才请求面板。同一响应只构建一次记录
+        """
+        snapshot = None if refresh else await self.get_snapshot('/server')
+        if snapshot is not None:
+            data, fetched_at = snapshot['data'], snapshot['fetched_at']
+        else:
+            data = await self.get_servers()
+            fetched_at = self.fetched_at.get('/server')
+        if not data or not data.get('success'):
+            return None
+        return self._parse('/server', data, fetched_at, parse_server_records)
+
+    def _parse(self, endpoint, data, fetched_at, parse):
+        source, parsed = self._parsed.get(endpoint, (None, None))
+        if fetched_at is None or fetched_at != source:
+            parsed = parse(data)
+            self._parsed[endpoint] = (fetched_at, parsed)
+            self.versions[endpoint] = self.versions.get(endpoint, 0) + 1
+        return parsed
+
     async def get_cron_jobs(self):
-        data = await self.request('GET', '/cron')
+        data = await self.request('GET', '/cron', cache=True)
         return data
 
     async def run_cron_job(self, cron_id):
@@ -68,33 +208,100 @@ class NezhaAPI:
         data = await self.request('GET', endpoint)
         return data
 
-    async def search_servers(self, query):
-        servers = await self.get_servers()
-        if servers and servers.get('success'):
-            result = []
-            for server in servers['data']:
-                if query.lower() in server['name'].lower():
-                    result.append(server)
-            return result
-        return []
+    async def get_server_groups(self):
+        data = await self.request('GET', '/server-group', cache=True)
+        return data
+
+    async def get_group_map(self, max_age=GROUP_MAX_AGE):
+        """
+        获取 server_id -> 分组名称列表。max_age 秒内直接使用已缓存的快照，
+        获取失败时返回空映射，不影响概览与搜索
+        """
+        snapshot = await self.get_snapshot('/server-group')
+        if snapshot is not None and time.time() - snapshot['fetched_at'] <= max_age:
+            data, fetched_at = snapshot['data'], snapshot['fetched_at']
+        else:
+            try:
+                data = await self.get_server_groups()
+                fetched_at = self.fetched_at.get('/server-group')
+            except Exception as e:
+                logger.warning(f'获取服务器分组失败：{e}')
+                data = snapshot['data'] if snapshot is not None else None
+                fetched_at = snapshot['fetched_at'] if snapshot is not None else None
+        if not data:
+            return {}
+        return self._parse('/server-group', data, fetched_at, parse_server_groups)
+
+    async def get_search_index(self, refresh=True):
+        """
+        获取搜索索引。refresh 为 False 时直接使用已缓存的 /server 快照，
+        仅在从未获取过服务器列表时才请求面板
+        """
+        records = await self.get_server_records(refresh)
+        if records is None:
+            return None
+        # 服务器记录未变化时复用已有索引
+        if records is not self._search_source:
+            self.search_index = SearchIndex(records, await self.get_group_map())
+            self._search_source = records
+        return self.search_index
+
+    async def search_servers(self, query, limit=SEARCH_LIMIT):
+        index = await self.get_search_index()
+        if index is None:
+            return []
+        return index.search(query, limit)
 
     async def get_server_detail(self, server_id):
-        servers = await self.get_servers()
-        if servers and servers.get('success'):
-            for server in servers['data']:
-                if server['id'] == server_id:
-                    return server
+        records = await self.get_server_records()
+        for server in records or []:
+            if server.id == server_id:
+                return server
         return None
 
     async def get_services_status(self):
-        data = await self.request('GET', '/service')
+        data = await self.request('GET', '/service', cache=True)
         return data
 
+    async def get_service_records(self):
+        """获取 {service_id: ServiceRecord}，失败时返回 None"""
+        data = await self.get_services_status()
+        if not data or not data.get('success'):
+            return None
+        return self._parse('/service', data, self.fetched_at.get('/service'), parse_service_records)
+
     async def get_service_histories(self, server_id):
         endpoint = f'/service/{server_id}'
-        data = await self.request('GET', endpoint)
+        data = await self.request('GET', endpoint, cache=True)
         return data
 
     async def get_alert_rules(self):
-        data = await self.request('GET', '/alert-rule')
+        data = await self.request('GET', '/alert-rule', cache=True)
         return data
+
+
+def api_base_url(dashboard_url):
+    """面板 API 地址，上游限流按该地址区分面板"""
+    return dashboard_url.rstrip('/') + '/api/v1'
+
+
+def parse_expire(expire):
+    """将 /login 返回的 expire 字段解析为时间戳"""
+    if not expire:
+        return None
+    from dateutil import parser
+    try:
+        return parser.isoparse(expire).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_jwt_exp(token):
+    """读取 JWT payload 中的 exp 字段，无法解析时返回 None"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, AttributeError, TypeError):
+        return None
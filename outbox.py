@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram 的发送限制：全局约 30 条/秒，单个私聊约 1 条/秒，单个群组约 20 条/分钟
+GLOBAL_RATE = 30
+PRIVATE_RATE = 1
+PRIVATE_BURST = 3
+GROUP_RATE = 20 / 60
+GROUP_BURST = 5
+# 不发送消息的接口不参与限速
+UNLIMITED_ENDPOINTS = {"getUpdates", "getMe", "setWebhook", "deleteWebhook"}
+# 删除与编辑已有消息不占用会话的发送配额，只受全局限速
+GLOBAL_ONLY_ENDPOINTS = {
+    "deleteMessage",
+    "editMessageText",
+    "editMessageReplyMarkup",
+    "editMessageCaption",
+    "editMessageMedia",
+}
+# 最多保留的会话令牌桶数量，超过时丢弃已经空闲的令牌桶
+MAX_CHAT_BUCKETS = 10000
+
+
+class PacedBucket:
+    """
+    带先进先出排队的令牌桶：令牌不足时按到达顺序等待，
+    收到 RetryAfter 时暂停到 Telegram 要求的时间之后
+    """
+
+    def __init__(self, rate, capacity):
+        self.bucket = TokenBucket(rate, capacity)
+        self.lock = asyncio.Lock()
+        self.paused_until = 0
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self):
+        self.bucket._fill()
+        return (
+            not self.lock.locked()
+            and self.bucket.tokens >= self.bucket.capacity
+            and self.paused_until <= time.monotonic()
+        )
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                if self.bucket.try_acquire():
+                    return
+                await asyncio.sleep((1 - self.bucket.tokens) / self.bucket.rate)
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """
+    所有 Bot API 请求的统一出口：发送前依次从会话令牌桶与全局令牌桶取令牌，
+    遇到 429 时暂停对应会话（没有 chat_id 时暂停全部请求）并重试。
+    删除与编辑消息只取全局令牌，遇到 429 时只有该请求等待后重试。
+    rate_limit_args 可传入本次请求的最大重试次数
+    """
+
+    def __init__(self, max_retries=2):
+        self.max_retries = max_retries
+        self.global_bucket = None
+        # chat_id -> PacedBucket
+        self.chats = OrderedDict()
+
+    async def initialize(self):
+        # 在事件循环中创建，保证锁绑定到正确的循环
+        self.global_bucket = PacedBucket(GLOBAL_RATE, GLOBAL_RATE)
+
+    async def shutdown(self):
+        self.chats.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is not None:
+            self.chats.move_to_end(chat_id)
+            return bucket
+        if len(self.chats) >= MAX_CHAT_BUCKETS:
+            for key in [key for key, b in self.chats.items() if b.idle]:
+                del self.chats[key]
+        # 群组与频道的 chat_id 为负数，或为 @username
+        if isinstance(chat_id, str) or chat_id < 0:
+            bucket = PacedBucket(GROUP_RATE, GROUP_BURST)
+        else:
+            bucket = PacedBucket(PRIVATE_RATE, PRIVATE_BURST)
+        self.chats[chat_id] = bucket
+        return bucket
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+        chat_bucket = None
+        if chat_id is not None and endpoint not in GLOBAL_ONLY_ENDPOINTS:
+            chat_bucket = self._chat_bucket(chat_id)
+        for attempt in range(max_retries + 1):
+            if chat_bucket is not None:
+                await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == max_retries:
+                    raise
+                logger.info(
+                    f"{endpoint} 触发限流（chat_id={chat_id}），{e.retry_after} 秒后重试"
+                )
+                if chat_bucket is not None:
+                    chat_bucket.pause(e.retry_after + 0.1)
+                elif chat_id is not None:
+                    # 删除与编辑的限流只作用于该会话，不暂停其他会话的请求
+                    await asyncio.sleep(e.retry_after + 0.1)
+                else:
+                    self.global_bucket.pause(e.retry_after + 0.1)
+
+
+class AlertDigest:
+    """
+    告警合并：同一会话收到第一条告警后等待 window 秒，
+    期间的告警合并为一条摘要发送，避免大面积故障时短时间内发送大量消息
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.bot = None
+        # chat_id -> [告警文本]
+        self.pending = {}
+        self._tasks = {}
+
+    async def add(self, bot, chat_id, text):
+        self.bot = bot
+        if self.window <= 0:
+            await self._send(chat_id, [text])
+            return
+        self.pending.setdefault(chat_id, []).append(text)
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.ensure_future(self._flush_later(chat_id))
+
+    async def _flush_later(self, chat_id):
+        await asyncio.sleep(self.window)
+        self._tasks.pop(chat_id, None)
+        await self._send(chat_id, self.pending.pop(chat_id, []))
+
+    async def flush(self):
+        """立即发送所有等待中的告警（停机前调用）"""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        pending, self.pending = self.pending, {}
+        await asyncio.gather(
+            *(self._send(chat_id, texts) for chat_id, texts in pending.items())
+        )
+
+    def render(self, texts):
+        """单条告警原样发送，多条合并为一条摘要，超过消息长度上限的部分只显示条数"""
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        if len(texts) == 1:
+            return texts[0][:limit]
+        lines = [f"🚨 告警汇总（{len(texts)} 条）"]
+        # 为末尾的省略说明预留长度
+        length = len(lines[0]) + 40
+        for index, text in enumerate(texts):
+            if length + len(text) + 2 > limit:
+                lines.append(f"……另有 {len(texts) - index} 条告警未显示")
+                break
+            lines.append(text)
+            length += len(text) + 2
+        return "\n\n".join(lines)
+
+    async def _send(self, chat_id, texts):
+        if not texts:
+            return
+        try:
+            await self.bot.send_message(chat_id, self.render(texts))
+        except Exception as e:
+            logger.warning(f"发送告警失败: {e}")
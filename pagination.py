@@ -0,0 +1,74 @@
+import secrets
+import time
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# 每页按钮数量
+PAGE_SIZE = 8
+# 结果缓存有效期（秒）
+RESULT_TTL = 600
+# 最多缓存的结果集数量
+MAX_RESULTS = 1000
+
+
+class ResultPages:
+    """
+    分页结果缓存：完整按钮列表保存在服务端，callback_data 中只携带短 token 与页码，
+    翻页时直接切片，无需重新请求面板
+    """
+
+    def __init__(self, page_size=PAGE_SIZE, ttl=RESULT_TTL, max_results=MAX_RESULTS):
+        self.page_size = page_size
+        self.ttl = ttl
+        self.max_results = max_results
+        # token -> (过期时间, [(按钮文字, callback_data), ...])
+        self._results = OrderedDict()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._results:
+            token, (expires, _) = next(iter(self._results.items()))
+            if expires > now and len(self._results) <= self.max_results:
+                break
+            del self._results[token]
+
+    def store(self, buttons):
+        """保存结果集，返回用于翻页的 token"""
+        self._evict()
+        token = secrets.token_hex(4)
+        self._results[token] = (time.monotonic() + self.ttl, list(buttons))
+        return token
+
+    def keyboard(self, token, page=0):
+        """构建指定页的键盘，结果已过期时返回 None"""
+        entry = self._results.get(token)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        buttons = entry[1]
+        pages = max(1, -(-len(buttons) // self.page_size))
+        page = min(max(page, 0), pages - 1)
+        start = page * self.page_size
+        keyboard = [
+            [InlineKeyboardButton(text, callback_data=callback_data)]
+            for text, callback_data in buttons[start : start + self.page_size]
+        ]
+        if pages > 1:
+            nav = []
+            if page > 0:
+                nav.append(
+                    InlineKeyboardButton(
+                        "« 上一页", callback_data=f"page_{token}_{page - 1}"
+                    )
+                )
+            nav.append(
+                InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="noop")
+            )
+            if page < pages - 1:
+                nav.append(
+                    InlineKeyboardButton(
+                        "下一页 »", callback_data=f"page_{token}_{page + 1}"
+                    )
+                )
+            keyboard.append(nav)
+        return InlineKeyboardMarkup(keyboard)
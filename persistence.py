@@ -0,0 +1,120 @@
+import logging
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# 可以保存为 JSON 的对话状态类型
+JSON_STATES = (int, str)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    将对话状态保存到数据库的 runtime_state 表，滚动部署时未完成的对话在新实例中继续。
+    对话中已输入的内容由 ConversationStore 保存，这里不保存 user_data。
+    只在 flush（停机排空或 Application 关闭）时写入数据库，
+    恢复时丢弃超过 conversation_ttl 未更新的对话
+    """
+
+    KEY = "persistence"
+
+    def __init__(self, db, conversation_ttl=None, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=False, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.conversation_ttl = conversation_ttl
+        self._loaded = False
+        # name -> {(chat_id, user_id): state}
+        self.conversations = {}
+        # (name, (chat_id, user_id)) -> 状态最近一次变化的时间
+        self.updated = {}
+
+    async def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        stored = await self.db.pop_runtime_state(self.KEY, {})
+        now = time.time()
+        for name, entries in stored.get("conversations", {}).items():
+            for key, state, *updated_at in entries:
+                # 旧版本保存的对话没有更新时间，按刚刚更新处理
+                updated_at = updated_at[0] if updated_at else now
+                if self.conversation_ttl and updated_at + self.conversation_ttl <= now:
+                    continue
+                self.conversations.setdefault(name, {})[tuple(key)] = state
+                self.updated[(name, tuple(key))] = updated_at
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        await self._load()
+        return dict(self.conversations.get(name, {}))
+
+    async def update_conversation(self, name, key, new_state):
+        conversation = self.conversations.setdefault(name, {})
+        if new_state is None:
+            conversation.pop(key, None)
+            self.updated.pop((name, key), None)
+        else:
+            conversation[key] = new_state
+            self.updated[(name, key)] = time.time()
+
+    async def update_user_data(self, user_id, data):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        conversations = {}
+        for name, entries in self.conversations.items():
+            saved = []
+            for key, state in entries.items():
+                # 只保存可序列化的状态，个别对话无法恢复不影响停机
+                if not isinstance(state, JSON_STATES):
+                    logger.warning(f"对话 {name} 的状态 {state!r} 无法保存，已跳过")
+                    continue
+                saved.append(
+                    [list(key), state, self.updated.get((name, key), time.time())]
+                )
+            if saved:
+                conversations[name] = saved
+        if not conversations:
+            return
+        await self.db.save_runtime_state(self.KEY, {"conversations": conversations})
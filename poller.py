@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import multiprocessing
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from nezha_api import NezhaAPI, api_base_url
+from summary import summarize_servers
+from cycles import compact_cycles
+
+logger = logging.getLogger(__name__)
+
+# 每次轮询一个面板预先取得的令牌数（/server 与 /service），
+# 分组、登录与续期等额外请求由子进程报告，在下一轮补扣
+POLL_REQUESTS = 2
+
+# 子进程内常驻的事件循环与面板会话，跨轮询复用连接与 token
+_loop = None
+_clients = {}
+
+
+async def _poll_one(dashboard):
+    api = _clients.get(dashboard["id"])
+    if api is None or api.password != dashboard["password"]:
+        if api is not None:
+            await api.close()
+        api = NezhaAPI(
+            dashboard["dashboard_url"],
+            dashboard["username"],
+            dashboard["password"],
+            token=dashboard["token"],
+            token_expires=dashboard["token_expires"],
+        )
+        _clients[dashboard["id"]] = api
+
+    result = {"id": dashboard["id"]}
+    sent = api.request_count
+    try:
+        await _fetch(api, result)
+    finally:
+        result["requests"] = api.request_count - sent
+    return result
+
+
+async def _fetch(api, result):
+    try:
+        records = await api.get_server_records()
+    except Exception as e:
+        result["error"] = str(e)
+        return
+    if records is None:
+        result["error"] = "获取服务器信息失败"
+        return
+
+    result["summary"] = summarize_servers(records, await api.get_group_map())
+    # 循环流量统计获取失败不影响概览与告警
+    try:
+        result["cycles"] = compact_cycles(await api.get_services_status())
+    except Exception:
+        result["cycles"] = None
+    result["token"] = api.token
+    result["token_expires"] = api.token_expires
+
+
+async def _poll_all(dashboards, ids):
+    # 不再属于本分区的面板，关闭其会话
+    for dashboard_id in [i for i in _clients if i not in ids]:
+        await _clients.pop(dashboard_id).close()
+    return await asyncio.gather(*(_poll_one(d) for d in dashboards))
+
+
+def poll_partition(dashboards, ids):
+    """
+    在子进程中轮询一个分区的面板：请求 /server、解析 JSON 并汇总，
+    只把紧凑的汇总结果传回主进程。ids 为属于该分区的全部面板，
+    本轮因限流跳过的面板保留会话
+    """
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(_poll_all(dashboards, ids))
+
+
+class ShardedPoller:
+    """
+    多进程轮询：每个子进程固定负责按 dashboard id 哈希划分的一个分区，
+    JSON 解析与汇总的 CPU 开销不再占用机器人主事件循环。
+    子进程直接请求面板，提供 limiter 时由主进程先按面板地址取得令牌，
+    令牌不足的面板本轮跳过
+    """
+
+    def __init__(self, processes, limiter=None):
+        self.limiter = limiter
+        # 面板地址 -> 子进程实际请求数超出预取令牌、尚未补扣的部分
+        self.debt = {}
+        self.context = multiprocessing.get_context("spawn")
+        # 每个分区一个单进程执行器，保证分区与进程一一对应
+        self.executors = [self._create_executor() for _ in range(processes)]
+
+    def _create_executor(self):
+        """
+        spawn 启动的子进程会以 __mp_main__ 重新导入主模块，
+        主模块为 bot.py 时会再次执行日志、密钥与状态后端等模块级初始化。
+        启动子进程期间将主模块替换为本模块，子进程只导入轮询所需的模块
+        """
+        executor = ProcessPoolExecutor(max_workers=1, mp_context=self.context)
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = sys.modules[__name__]
+        try:
+            # 执行器在首次提交任务时同步启动子进程
+            executor.submit(int)
+        finally:
+            sys.modules["__main__"] = main
+        return executor
+
+    def partition(self, dashboard_id):
+        return zlib.crc32(str(dashboard_id).encode()) % len(self.executors)
+
+    async def allowed(self, dashboard):
+        """先补扣上一轮超出的请求数，再按本次轮询的请求数从上游限流中取令牌"""
+        if self.limiter is None:
+            return True
+        base_url = api_base_url(dashboard["dashboard_url"])
+        scheduler = self.limiter.get(base_url)
+        debt = self.debt.pop(base_url, 0)
+        taken = 0
+        while taken < debt + POLL_REQUESTS and await scheduler.try_acquire():
+            taken += 1
+        if taken < debt + POLL_REQUESTS:
+            if taken < debt:
+                self.debt[base_url] = debt - taken
+            logger.debug(f"面板 {dashboard['id']} 上游限流，本轮跳过")
+            return False
+        return True
+
+    def charge(self, dashboard, requests):
+        """记录子进程实际请求数超出预取令牌的部分"""
+        if self.limiter is None or requests <= POLL_REQUESTS:
+            return
+        base_url = api_base_url(dashboard["dashboard_url"])
+        self.debt[base_url] = self.debt.get(base_url, 0) + requests - POLL_REQUESTS
+
+    async def poll(self, dashboards):
+        partitions = [[] for _ in self.executors]
+        ids = [set() for _ in self.executors]
+        for dashboard in dashboards:
+            index = self.partition(dashboard["id"])
+            ids[index].add(dashboard["id"])
+            if await self.allowed(dashboard):
+                partitions[index].append(dashboard)
+
+        results = await asyncio.gather(
+            *(
+                self._poll_partition(index, partition, ids[index])
+                for index, partition in enumerate(partitions)
+            )
+        )
+        by_id = {d["id"]: d for d in dashboards}
+        results = [result for partition in results for result in partition]
+        for result in results:
+            self.charge(by_id[result["id"]], result.get("requests", 0))
+        return results
+
+    async def _poll_partition(self, index, dashboards, ids):
+        """
+        轮询一个分区，失败时该分区的面板均返回错误结果；
+        子进程意外退出后执行器不再可用，重新创建，下一轮轮询恢复
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self.executors[index], poll_partition, dashboards, ids
+            )
+        except BrokenProcessPool as e:
+            logger.error(f"轮询子进程 {index} 已退出，重新创建: {e}")
+            self.executors[index].shutdown(wait=False, cancel_futures=True)
+            self.executors[index] = self._create_executor()
+            error = "轮询子进程已退出"
+        except Exception as e:
+            logger.exception(f"轮询分区 {index} 失败")
+            error = str(e)
+        return [{"id": d["id"], "error": error} for d in dashboards]
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,105 @@
+import asyncio
+import contextvars
+import functools
+import time
+from collections import OrderedDict, deque
+
+# 当前正在处理的 Telegram 用户，用于上游请求的公平调度
+current_user = contextvars.ContextVar("current_user", default=None)
+
+
+class TokenBucket:
+    """
+    令牌桶：以 rate 个/秒的速度补充令牌，最多积累 capacity 个
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _fill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        self._fill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class FairScheduler:
+    """
+    单个面板的上游请求调度：令牌不足时按 Telegram 用户轮转排队，
+    避免单个用户的大量请求饿死其他用户
+    """
+
+    def __init__(self, take, retry_interval):
+        # take: 从（可能由多个实例共享的）令牌桶中取令牌的协程函数
+        self.take = take
+        self.retry_interval = retry_interval
+        # user_id -> 等待中的 Future 队列，按轮转顺序排列
+        self.queues = OrderedDict()
+        self._dispatcher = None
+
+    async def try_acquire(self):
+        """无人排队且有令牌时立即放行"""
+        return not self.queues and await self.take()
+
+    async def acquire(self, user_id=None):
+        if await self.try_acquire():
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(user_id, deque()).append(future)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await future
+
+    def _pop(self, user_id, queue):
+        future = queue.popleft()
+        if queue:
+            # 该用户还有请求，排到队尾等待下一轮
+            self.queues.move_to_end(user_id)
+        else:
+            del self.queues[user_id]
+        return future
+
+    async def _dispatch(self):
+        while self.queues:
+            user_id, queue = next(iter(self.queues.items()))
+            # 等待方已取消时不消耗令牌
+            if queue[0].done():
+                self._pop(user_id, queue)
+                continue
+            if not await self.take():
+                await asyncio.sleep(self.retry_interval)
+                continue
+            future = self._pop(user_id, queue)
+            if not future.done():
+                future.set_result(None)
+
+
+class UpstreamLimiter:
+    """
+    按面板地址维护令牌桶与公平调度器，令牌桶存放在状态后端中，多实例共享
+    """
+
+    def __init__(self, state, rate, capacity):
+        self.state = state
+        self.rate = rate
+        self.capacity = capacity
+        self.schedulers = {}
+
+    def get(self, base_url):
+        scheduler = self.schedulers.get(base_url)
+        if scheduler is None:
+            take = functools.partial(
+                self.state.take_token, base_url, self.rate, self.capacity
+            )
+            scheduler = FairScheduler(take, 1 / self.rate)
+            self.schedulers[base_url] = scheduler
+        return scheduler
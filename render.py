@@ -0,0 +1,45 @@
+import os
+from collections import OrderedDict
+
+# 最多缓存的 (面板, 视图) 数量
+MAX_VIEWS = 2000
+
+
+class RenderCache:
+    """
+    渲染结果缓存：按 (dashboard_id, 视图) 保存最近一次渲染的文本与键盘，
+    并记录渲染时的快照版本与时区。查看同一快照的用户共用同一份渲染结果，
+    新快照到达后版本号变化，旧结果在下次查看时被替换
+    """
+
+    def __init__(self, max_views=MAX_VIEWS):
+        self.max_views = max_views
+        # (dashboard_id, view) -> ((version, tz), (text, reply_markup))
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, dashboard_id, view, version, render):
+        """
+        view 为视图标识（如 "overview"、("server", 1)），version 为数据快照的版本。
+        命中时返回缓存结果，否则调用 render() 渲染并缓存
+        """
+        key = (dashboard_id, view)
+        stamp = (version, os.environ.get("TZ"))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        rendered = render()
+        self._entries[key] = (stamp, rendered)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_views:
+            self._entries.popitem(last=False)
+        return rendered
+
+    def invalidate(self, dashboard_id):
+        """渲染所依赖的配置（如流量阈值）变化时清除该面板的全部结果"""
+        for key in [key for key in self._entries if key[0] == dashboard_id]:
+            del self._entries[key]
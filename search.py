@@ -0,0 +1,146 @@
+import heapq
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+
+# 搜索结果数量上限
+SEARCH_LIMIT = 20
+
+# 名称以外字段（备注、分组、IP、地区）的匹配得分折扣
+FIELD_PENALTY = 15
+
+# 模糊匹配最多计算相似度的候选数量，候选按与查询共有的二元组数量选出
+FUZZY_CANDIDATES = 200
+
+_TOKEN_SPLIT = re.compile(r"[^0-9a-z\u4e00-\u9fff]+")
+
+
+def _match_score(query, text, tokens):
+    """单个字段的匹配得分：完全 > 前缀 > 词前缀 > 子串 > 模糊，不匹配返回 0"""
+    # 前缀与词前缀匹配都意味着子串匹配，先排除不包含查询的字段
+    if not text or query not in text:
+        return 0
+    if text == query:
+        return 100
+    if text.startswith(query):
+        return 80
+    if any(token.startswith(query) for token in tokens):
+        return 70
+    return 60
+
+
+def _bigrams(text):
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def _fuzzy_score(query, text):
+    """按顺序包含全部字符时按相似度给分，用于容忍漏字、错字"""
+    it = iter(text)
+    if not all(ch in it for ch in query):
+        # 相似度不超过 2 * 较短长度 / 总长度，达不到 0.6 时无需计算
+        if 2 * min(len(query), len(text)) < 0.6 * (len(query) + len(text)):
+            return 0
+        ratio = SequenceMatcher(None, query, text).ratio()
+        return int(ratio * 40) if ratio >= 0.6 else 0
+    return 30 + int(SequenceMatcher(None, query, text).ratio() * 20)
+
+
+class SearchIndex:
+    """
+    面板服务器的搜索索引，由一次 /server 快照预先构建，
+    支持名称、备注、分组、IP 与地区的前缀、子串及模糊匹配。
+    模糊匹配只在直接匹配不足时进行，且只对与查询共有二元组最多的名称计算相似度
+    """
+
+    def __init__(self, servers, groups=None):
+        # servers: ServerRecord 列表；groups: server_id -> 分组名称列表
+        groups = groups or {}
+        self.entries = []
+        # 名称中的二元组 -> 条目序号，用于筛选模糊匹配的候选
+        self.bigrams = {}
+        # 每个条目全部字段拼接的文本：任何直接匹配都意味着查询是其子串
+        self.haystacks = []
+        for server in servers:
+            name = server.name.lower()
+            fields = [
+                server.note,
+                server.public_note,
+                server.ipv4,
+                server.ipv6,
+                server.country_code,
+                *groups.get(server.id, []),
+            ]
+            extra = [
+                (text, [t for t in _TOKEN_SPLIT.split(text) if t])
+                for text in (str(f).lower() for f in fields if f)
+            ]
+            for gram in _bigrams(name):
+                self.bigrams.setdefault(gram, []).append(len(self.entries))
+            self.entries.append(
+                (server, name, [t for t in _TOKEN_SPLIT.split(name) if t], extra)
+            )
+            self.haystacks.append("\0".join([name, *(text for text, _ in extra)]))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _score(self, query, name, name_tokens, extra):
+        """完全、前缀与子串匹配的得分，不含模糊匹配"""
+        score = _match_score(query, name, name_tokens)
+        if score:
+            return score
+        for text, tokens in extra:
+            score = max(score, _match_score(query, text, tokens) - FIELD_PENALTY)
+        return score
+
+    def _fuzzy_candidates(self, query, matched):
+        """与查询共有二元组最多的至多 FUZZY_CANDIDATES 个未匹配条目"""
+        counts = Counter()
+        for gram in _bigrams(query):
+            counts.update(self.bigrams.get(gram, ()))
+        candidates = []
+        for index, _ in counts.most_common():
+            if index in matched:
+                continue
+            candidates.append(index)
+            if len(candidates) >= FUZZY_CANDIDATES:
+                break
+        return candidates
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        query = query.strip().lower()
+        if not query:
+            return [entry[0] for entry in self.entries[:limit]]
+        scored = []
+        matched = set()
+        for index, haystack in enumerate(self.haystacks):
+            if query not in haystack:
+                continue
+            server, name, name_tokens, extra = self.entries[index]
+            score = self._score(query, name, name_tokens, extra)
+            if score > 0:
+                scored.append((-score, len(name), index, server))
+                matched.add(index)
+        # 模糊匹配的得分低于任何直接匹配，直接匹配已足够时跳过
+        if len(scored) < limit:
+            for index in self._fuzzy_candidates(query, matched):
+                server, name = self.entries[index][:2]
+                score = _fuzzy_score(query, name)
+                if score > 0:
+                    scored.append((-score, len(name), index, server))
+        # 只需要前 limit 个结果，无需对全部匹配项排序
+        return [item[3] for item in heapq.nsmallest(limit, scored)]
+
+
+def parse_server_groups(data):
+    """将 /server-group 响应转换为 server_id -> 分组名称列表"""
+    groups = {}
+    if not data or not data.get("success"):
+        return groups
+    for item in data.get("data") or []:
+        group_name = (item.get("group") or {}).get("name")
+        if not group_name:
+            continue
+        for server_id in item.get("servers") or []:
+            groups.setdefault(server_id, []).append(group_name)
+    return groups
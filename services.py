@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+
+# 服务监测历史的缓存有效期（秒），期间重复查看不再请求面板或重新计算
+HISTORY_TTL = 60
+# 最多缓存的 (面板, 服务器) 数量
+MAX_HISTORIES = 1000
+# 可用率统计窗口（天），对应 /service 返回的按天 up/down 数组
+AVAILABILITY_WINDOWS = (1, 7, 30)
+
+
+def percentiles(values, qs):
+    """
+    对延迟序列只排序一次，按线性插值一次性取出多个分位数。
+    values 为空时返回 None 列表
+    """
+    if not values:
+        return [None] * len(qs)
+    ordered = sorted(values)
+    last = len(ordered) - 1
+    result = []
+    for q in qs:
+        position = last * q
+        lower = int(position)
+        upper = min(lower + 1, last)
+        weight = position - lower
+        result.append(ordered[lower] + (ordered[upper] - ordered[lower]) * weight)
+    return result
+
+
+def availability_windows(service, windows=AVAILABILITY_WINDOWS):
+    """
+    根据 ServiceRecord 中按天的 up/down 数组（最后一个元素为当天）计算各窗口的可用率，
+    返回 {天数: 可用率百分比}，窗口内没有数据时为 None
+    """
+    ups = service.up
+    downs = service.down
+    result = {}
+    for days in windows:
+        up = sum(ups[-days:])
+        total = up + sum(downs[-days:])
+        result[days] = up / total * 100 if total else None
+    return result
+
+
+def summarize_histories(data):
+    """
+    将 /service/{server_id} 返回的监测历史汇总为每个服务的延迟统计：
+    p50/p95/p99、平均值、样本数与时间跨度
+    """
+    summaries = []
+    if not data or not data.get("success"):
+        return summaries
+    for item in data.get("data") or []:
+        # 延迟为 0 的点表示该时段监测失败，不参与延迟统计
+        delays = [d for d in item.get("avg_delay") or [] if d > 0]
+        created_at = item.get("created_at") or []
+        p50, p95, p99 = percentiles(delays, (0.5, 0.95, 0.99))
+        summaries.append(
+            {
+                "service_id": item.get("service_id"),
+                "name": item.get("service_name", "未知"),
+                "samples": len(created_at),
+                "failed": len(created_at) - len(delays),
+                "p50": p50,
+                "p95": p95,
+                "p99": p99,
+                "avg": sum(delays) / len(delays) if delays else None,
+                # created_at 为毫秒时间戳
+                "span": (created_at[-1] - created_at[0]) / 1000 if created_at else 0,
+            }
+        )
+    return summaries
+
+
+class HistoryCache:
+    """按 (dashboard_id, server_id) 缓存汇总后的服务监测历史"""
+
+    def __init__(self, ttl=HISTORY_TTL, max_entries=MAX_HISTORIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (过期时间, 汇总结果)
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        now = time.monotonic()
+        while self._entries:
+            oldest, (expires, _) = next(iter(self._entries.items()))
+            if expires > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[oldest]
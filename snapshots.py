@@ -0,0 +1,51 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WarmSnapshotStore:
+    """
+    每个面板最近一次成功的概览汇总：常驻内存，定期与停机时写入数据库，启动时载入。
+    面板无法访问或响应过慢时用作降级结果，重启后的首个请求也无需等待面板
+    """
+
+    def __init__(self, db):
+        self.db = db
+        # dashboard_id -> 汇总结果
+        self.latest = {}
+        # 尚未写入数据库的面板
+        self.dirty = set()
+
+    async def load(self):
+        try:
+            snapshots = await self.db.get_snapshots()
+        except Exception as e:
+            logger.warning(f"载入面板快照失败: {e}")
+            return
+        self.latest.update(snapshots)
+        logger.info(f"已载入 {len(snapshots)} 个面板快照")
+
+    def get(self, dashboard_id):
+        return self.latest.get(dashboard_id)
+
+    def put(self, dashboard_id, summary):
+        self.latest[dashboard_id] = summary
+        self.dirty.add(dashboard_id)
+
+    def forget(self, dashboard_id):
+        self.latest.pop(dashboard_id, None)
+        self.dirty.discard(dashboard_id)
+
+    async def flush(self):
+        """将变化过的快照批量写入数据库"""
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        try:
+            await self.db.save_snapshots(
+                [(dashboard_id, self.latest[dashboard_id]) for dashboard_id in dirty]
+            )
+        except Exception:
+            # 下次 flush 时重试，期间已 forget 的面板不再写入
+            self.dirty |= dirty & self.latest.keys()
+            raise
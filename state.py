@@ -0,0 +1,316 @@
+import json
+import time
+import zlib
+
+from ratelimit import TokenBucket
+
+
+class StateBackend:
+    """
+    机器人运行状态的存储后端：快照缓存、限流计数、待删除消息、告警去重以及多实例协调。
+    单实例使用 MemoryStateBackend，多实例部署使用共享的 RedisStateBackend。
+    """
+
+    async def get_snapshot(self, key):
+        raise NotImplementedError
+
+    async def set_snapshot(self, key, snapshot, ttl):
+        raise NotImplementedError
+
+    async def take_token(self, key, rate, capacity):
+        """从令牌桶中取一个令牌，成功返回 True"""
+        raise NotImplementedError
+
+    async def schedule_deletion(self, chat_id, message_id, due):
+        raise NotImplementedError
+
+    async def pop_due_deletions(self, now):
+        """取出并移除所有到期的待删除消息，返回 [(chat_id, message_id), ...]"""
+        raise NotImplementedError
+
+    async def mark_alert(self, key, ttl):
+        """告警去重：ttl 内首次标记返回 True，重复标记返回 False"""
+        raise NotImplementedError
+
+    async def export_deletions(self):
+        """
+        停机时需要持久化的待删除消息 [(chat_id, message_id, due), ...]。
+        共享后端中的状态本身可以跨重启保留，返回空列表
+        """
+        return []
+
+    async def export_alerts(self):
+        """停机时需要持久化的告警去重标记 {key: 过期时间}"""
+        return {}
+
+    async def heartbeat(self, worker_id, ttl):
+        raise NotImplementedError
+
+    async def live_workers(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """进程内状态，适用于单实例部署"""
+
+    def __init__(self):
+        self.snapshots = {}
+        self.buckets = {}
+        self.deletions = {}
+        self.alerts = {}
+        self.workers = {}
+
+    async def get_snapshot(self, key):
+        entry = self.snapshots.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    async def set_snapshot(self, key, snapshot, ttl):
+        self.snapshots[key] = (time.time() + ttl, snapshot)
+
+    async def take_token(self, key, rate, capacity):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate, capacity)
+        return bucket.try_acquire()
+
+    async def schedule_deletion(self, chat_id, message_id, due):
+        self.deletions[(chat_id, message_id)] = due
+
+    async def pop_due_deletions(self, now):
+        due = [key for key, due_at in self.deletions.items() if due_at <= now]
+        for key in due:
+            del self.deletions[key]
+        return due
+
+    async def mark_alert(self, key, ttl):
+        now = time.time()
+        expires = self.alerts.get(key)
+        if expires is not None and expires > now:
+            return False
+        self.alerts[key] = now + ttl
+        return True
+
+    async def export_deletions(self):
+        return [
+            (chat_id, message_id, due)
+            for (chat_id, message_id), due in self.deletions.items()
+        ]
+
+    async def export_alerts(self):
+        now = time.time()
+        return {key: expires for key, expires in self.alerts.items() if expires > now}
+
+    async def heartbeat(self, worker_id, ttl):
+        self.workers[worker_id] = time.time() + ttl
+
+    async def live_workers(self):
+        now = time.time()
+        return sorted(w for w, expires in self.workers.items() if expires > now)
+
+
+class RedisStateBackend(StateBackend):
+    """
+    基于 Redis 的共享状态，多个机器人实例共用。
+    client 需提供 redis.asyncio 的子集命令，测试时可使用 LocalRedis 代替
+    """
+
+    PREFIX = "nezhabot:"
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise Exception("使用 Redis 状态后端需要先安装 redis：pip install redis")
+        return cls(redis.from_url(url))
+
+    def _key(self, *parts):
+        return self.PREFIX + ":".join(str(p) for p in parts)
+
+    async def get_snapshot(self, key):
+        raw = await self.client.get(self._key("snapshot", key))
+        if raw is None:
+            return None
+        return json.loads(zlib.decompress(raw))
+
+    async def set_snapshot(self, key, snapshot, ttl):
+        raw = zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode())
+        await self.client.set(self._key("snapshot", key), raw, px=int(ttl * 1000))
+
+    async def take_token(self, key, rate, capacity):
+        # 固定窗口计数：每个窗口最多 capacity 次，平均速率为 rate
+        window = capacity / rate
+        slot = int(time.time() / window)
+        counter = self._key("rate", key, slot)
+        count = await self.client.incr(counter)
+        if count == 1:
+            await self.client.pexpire(counter, int(window * 2000))
+        return count <= capacity
+
+    async def schedule_deletion(self, chat_id, message_id, due):
+        await self.client.zadd(self._key("deletions"), {f"{chat_id}:{message_id}": due})
+
+    async def pop_due_deletions(self, now):
+        key = self._key("deletions")
+        members = await self.client.zrangebyscore(key, "-inf", now)
+        due = []
+        for member in members:
+            # 只有成功移除的实例负责删除，避免重复删除
+            if await self.client.zrem(key, member):
+                if isinstance(member, bytes):
+                    member = member.decode()
+                chat_id, message_id = member.split(":")
+                due.append((int(chat_id), int(message_id)))
+        return due
+
+    async def mark_alert(self, key, ttl):
+        return bool(
+            await self.client.set(
+                self._key("alert", key), 1, nx=True, px=int(ttl * 1000)
+            )
+        )
+
+    async def heartbeat(self, worker_id, ttl):
+        key = self._key("workers")
+        now = time.time()
+        await self.client.zadd(key, {worker_id: now + ttl})
+        await self.client.zremrangebyscore(key, "-inf", now)
+
+    async def live_workers(self):
+        members = await self.client.zrangebyscore(
+            self._key("workers"), time.time(), "+inf"
+        )
+        return sorted(m.decode() if isinstance(m, bytes) else m for m in members)
+
+    async def close(self):
+        await self.client.close()
+
+
+class LocalRedis:
+    """
+    进程内的 Redis 替身，实现 RedisStateBackend 用到的命令，
+    用于在没有 Redis 的环境下验证共享后端的行为
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.zsets = {}
+
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.time():
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.values
+
+    async def get(self, key):
+        return self.values[key] if self._alive(key) else None
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and self._alive(key):
+            return None
+        if isinstance(value, str):
+            value = value.encode()
+        elif isinstance(value, int):
+            value = str(value).encode()
+        self.values[key] = value
+        if px is not None:
+            self.expires[key] = time.time() + px / 1000
+        else:
+            self.expires.pop(key, None)
+        return True
+
+    async def incr(self, key):
+        value = int(self.values[key]) + 1 if self._alive(key) else 1
+        self.values[key] = str(value).encode()
+        return value
+
+    async def pexpire(self, key, px):
+        if not self._alive(key):
+            return False
+        self.expires[key] = time.time() + px / 1000
+        return True
+
+    async def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    @staticmethod
+    def _bound(value):
+        if value == "-inf":
+            return float("-inf")
+        if value == "+inf":
+            return float("inf")
+        return float(value)
+
+    async def zrangebyscore(self, key, low, high):
+        low, high = self._bound(low), self._bound(high)
+        members = self.zsets.get(key, {})
+        return [
+            m.encode()
+            for m, score in sorted(members.items(), key=lambda item: item[1])
+            if low <= score <= high
+        ]
+
+    async def zrem(self, key, member):
+        if isinstance(member, bytes):
+            member = member.decode()
+        return 1 if self.zsets.get(key, {}).pop(member, None) is not None else 0
+
+    async def zremrangebyscore(self, key, low, high):
+        low, high = self._bound(low), self._bound(high)
+        members = self.zsets.get(key, {})
+        removed = [m for m, score in members.items() if low <= score <= high]
+        for m in removed:
+            del members[m]
+        return len(removed)
+
+    async def close(self):
+        pass
+
+
+class ShardCoordinator:
+    """
+    多实例分片：各实例定期上报心跳，按存活实例列表做最高随机权重（rendezvous）哈希，
+    每个 dashboard 只由一个实例轮询，实例增减时只有少量 dashboard 迁移
+    """
+
+    def __init__(self, state, worker_id, ttl):
+        self.state = state
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.workers = [worker_id]
+
+    async def heartbeat(self):
+        await self.state.heartbeat(self.worker_id, self.ttl)
+        self.workers = await self.state.live_workers() or [self.worker_id]
+
+    def owner(self, dashboard_id):
+        return max(
+            self.workers, key=lambda w: zlib.crc32(f"{w}:{dashboard_id}".encode())
+        )
+
+    def owns(self, dashboard_id):
+        return self.owner(dashboard_id) == self.worker_id
+
+
+def create_state_backend(url=None):
+    """
+    根据 STATE_BACKEND 配置创建状态后端：
+    为空或 memory 使用进程内状态，redis:// 使用共享 Redis，local-redis 使用进程内替身
+    """
+    if not url or url == "memory":
+        return MemoryStateBackend()
+    if url == "local-redis":
+        return RedisStateBackend(LocalRedis())
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStateBackend.from_url(url)
+    raise Exception(f"不支持的状态后端：{url}")
@@ -0,0 +1,156 @@
+import logging
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# 汇总结果中每台服务器保留的字段（按顺序存为列表，体积小且可 JSON 序列化）
+SERVER_FIELDS = (
+    "id",
+    "name",
+    "online",
+    "cpu",
+    "mem_used",
+    "mem_total",
+    "disk_used",
+    "disk_total",
+    "net_in_transfer",
+    "net_out_transfer",
+    "swap_used",
+    "swap_total",
+    "load_1",
+    "net_in_speed",
+    "net_out_speed",
+)
+
+# 分组与地区统计中累加的字段
+BUCKET_FIELDS = (
+    "mem_used",
+    "mem_total",
+    "disk_used",
+    "disk_total",
+    "net_in_speed",
+    "net_out_speed",
+    "net_in_transfer",
+    "net_out_transfer",
+)
+# 不属于任何分组 / 没有地区信息的服务器归入的桶
+UNGROUPED = "未分组"
+UNKNOWN_COUNTRY = "未知"
+
+
+def _add_to_bucket(buckets, key, server, online):
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = dict.fromkeys(("total", "online", *BUCKET_FIELDS), 0)
+        bucket["servers"] = []
+    bucket["total"] += 1
+    bucket["online"] += online
+    for field in BUCKET_FIELDS:
+        bucket[field] += getattr(server, field)
+    bucket["servers"].append(server.id)
+
+
+def is_online(server):
+    """根据last_active判断服务器是否在线，如果最后活跃时间在10秒内则为在线。"""
+    # 延迟导入，缩短启动时间
+    from dateutil import parser
+
+    now_utc = datetime.now(timezone.utc)
+    last_active_str = server.last_active
+    if not last_active_str:
+        return False
+    try:
+        last_active_dt = parser.isoparse(last_active_str)
+    except ValueError:
+        return False
+    last_active_utc = last_active_dt.astimezone(timezone.utc)
+    diff = now_utc - last_active_utc
+    is_on = diff.total_seconds() < 10
+    # 每台服务器一条，默认不输出，可通过 LOG_LEVELS=summary=DEBUG 开启
+    logger.debug(
+        "Checking online: diff=%s now=%s last=%s is_online=%s",
+        diff,
+        now_utc,
+        last_active_utc,
+        is_on,
+    )
+    return is_on
+
+
+def summarize_servers(servers, groups=None):
+    """
+    将 ServerRecord 列表汇总为紧凑的统计结果，供概览与告警使用。
+    groups 为 server_id -> 分组名称列表，同一次遍历中按分组与地区分别统计
+    """
+    groups = groups or {}
+    summary = {
+        "fetched_at": time.time(),
+        "total": len(servers),
+        "online": 0,
+        "mem_total": 0,
+        "mem_used": 0,
+        "swap_total": 0,
+        "swap_used": 0,
+        "disk_total": 0,
+        "disk_used": 0,
+        "net_in_speed": 0,
+        "net_out_speed": 0,
+        "net_in_transfer": 0,
+        "net_out_transfer": 0,
+        # [名称, last_active]
+        "offline": [],
+        # 按 SERVER_FIELDS 顺序的列表
+        "servers": [],
+        # 分组名称 / 国家代码 -> 统计结果与服务器 id 列表
+        "groups": {},
+        "countries": {},
+    }
+    for s in servers:
+        online = is_online(s)
+        if online:
+            summary["online"] += 1
+        else:
+            summary["offline"].append([s.name, s.last_active])
+
+        summary["mem_total"] += s.mem_total
+        summary["swap_total"] += s.swap_total
+        summary["disk_total"] += s.disk_total
+        summary["mem_used"] += s.mem_used
+        summary["swap_used"] += s.swap_used
+        summary["disk_used"] += s.disk_used
+        summary["net_in_speed"] += s.net_in_speed
+        summary["net_out_speed"] += s.net_out_speed
+        summary["net_in_transfer"] += s.net_in_transfer
+        summary["net_out_transfer"] += s.net_out_transfer
+
+        # 同一台服务器可属于多个分组，在每个分组中都计入
+        for group in groups.get(s.id) or (UNGROUPED,):
+            _add_to_bucket(summary["groups"], group, s, online)
+        _add_to_bucket(
+            summary["countries"],
+            (s.country_code or UNKNOWN_COUNTRY).upper(),
+            s,
+            online,
+        )
+
+        summary["servers"].append(
+            [
+                s.id,
+                s.name,
+                online,
+                s.cpu,
+                s.mem_used,
+                s.mem_total,
+                s.disk_used,
+                s.disk_total,
+                s.net_in_transfer,
+                s.net_out_transfer,
+                s.swap_used,
+                s.swap_total,
+                s.load_1,
+                s.net_in_speed,
+                s.net_out_speed,
+            ]
+        )
+    return summary
@@ -0,0 +1,40 @@
+class TrafficThresholds:
+    """
+    流量阈值查找表：启动与修改时从数据库整体加载，概览与后台轮询按
+    (dashboard_id, server_id) 直接查字典，汇总时不再逐台服务器查询数据库。
+    查找顺序：服务器阈值 → 面板阈值 → 全局默认值（环境变量）
+    """
+
+    # 面板级阈值使用的 server_id
+    DASHBOARD = 0
+
+    def __init__(self, default_upload=0, default_download=0):
+        self.default = (default_upload, default_download)
+        # dashboard_id -> {server_id: (上行阈值, 下行阈值)}
+        self._table = {}
+
+    def load(self, rows):
+        """rows 为 (dashboard_id, server_id, upload, download) 列表"""
+        table = {}
+        for dashboard_id, server_id, upload, download in rows:
+            table.setdefault(dashboard_id, {})[server_id] = (upload, download)
+        self._table = table
+
+    def for_dashboard(self, dashboard_id):
+        """返回面板的服务器阈值字典，未单独设置的面板返回空字典"""
+        return self._table.get(dashboard_id, {})
+
+    def active(self, dashboard_id):
+        """面板中是否有服务器会按大于 0 的阈值告警"""
+        servers = self._table.get(dashboard_id, {})
+        fallback = servers.get(self.DASHBOARD, self.default)
+        return any(
+            limit > 0 for limits in (fallback, *servers.values()) for limit in limits
+        )
+
+    def get(self, dashboard_id, server_id):
+        """返回 (上行阈值, 下行阈值)，单位为字节，0 表示不告警"""
+        servers = self._table.get(dashboard_id)
+        if not servers:
+            return self.default
+        return servers.get(server_id) or servers.get(self.DASHBOARD) or self.default
@@ -0,0 +1,24 @@
+import heapq
+from operator import itemgetter
+
+from alerts import METRICS
+from summary import SERVER_FIELDS
+
+_ONLINE = SERVER_FIELDS.index("online")
+
+# /top 按钮中提供的指标，其余 METRICS 中的指标可通过参数指定
+TOP_METRICS = ("cpu", "memory", "disk", "load", "net_all_speed", "transfer_all")
+DEFAULT_TOP_N = 10
+MAX_TOP_N = 50
+
+
+def top_servers(rows, metric, n):
+    """
+    用堆从汇总行中选出指标最大的 n 台服务器，O(len(rows) log n)，
+    返回按指标从大到小排列的 [(值, 行)]。
+    实时指标只统计在线服务器，累计流量包括离线服务器
+    """
+    value = METRICS[metric]
+    if not metric.startswith("transfer_"):
+        rows = (row for row in rows if row[_ONLINE])
+    return heapq.nlargest(n, ((value(row), row) for row in rows), key=itemgetter(0))
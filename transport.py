@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+
+import aiohttp
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 面板请求使用的 HTTP 客户端：aiohttp（默认）或 httpx（支持 HTTP/2 多路复用）
+DEFAULT_TRANSPORT = os.getenv("NEZHA_TRANSPORT", "aiohttp")
+# httpx 的请求超时（秒）
+HTTPX_TIMEOUT = 30
+
+
+class TransportError(Exception):
+    """连接失败、超时等传输层错误，与具体的 HTTP 客户端无关"""
+
+
+def _decode(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+class AiohttpTransport:
+    """基于 aiohttp.ClientSession 的 HTTP/1.1 传输，每个面板一个连接池"""
+
+    name = "aiohttp"
+
+    def __init__(self):
+        self.session = aiohttp.ClientSession()
+
+    async def request(self, method, url, headers=None, json=None):
+        """发送请求，返回 (状态码, 解析后的 JSON)，响应不是 JSON 时为 None"""
+        try:
+            async with self.session.request(
+                method, url, headers=headers, json=json
+            ) as resp:
+                return resp.status, _decode(await resp.read())
+        except aiohttp.ClientError as e:
+            raise TransportError(str(e) or type(e).__name__) from e
+
+    async def close(self):
+        await self.session.close()
+
+
+class HttpxTransport:
+    """
+    基于 httpx.AsyncClient 的传输。面板支持 HTTP/2（HTTPS + ALPN）时，
+    同一面板的并发请求在一个连接上多路复用；未安装 h2 时退回 HTTP/1.1
+    """
+
+    name = "httpx"
+
+    def __init__(self, http2=True):
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，httpx 传输使用 HTTP/1.1（pip install httpx[http2]）")
+                http2 = False
+        self.client = httpx.AsyncClient(http2=http2, timeout=HTTPX_TIMEOUT)
+
+    async def request(self, method, url, headers=None, json=None):
+        """发送请求，返回 (状态码, 解析后的 JSON)，响应不是 JSON 时为 None"""
+        try:
+            resp = await self.client.request(method, url, headers=headers, json=json)
+        except httpx.HTTPError as e:
+            raise TransportError(str(e) or type(e).__name__) from e
+        return resp.status_code, _decode(resp.content)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+TRANSPORTS = {"aiohttp": AiohttpTransport, "httpx": HttpxTransport}
+
+
+def create_transport(name=None):
+    name = name or DEFAULT_TRANSPORT
+    if name not in TRANSPORTS:
+        raise Exception(f"未知的传输类型：{name}，可选 {', '.join(TRANSPORTS)}")
+    return TRANSPORTS[name]()
@@ -0,0 +1,61 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import Application
+
+
+def order_key(update):
+    """同一用户（没有用户时为同一会话）的更新按顺序处理"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+    return None
+
+
+class _Unlimited:
+    """不限制并发的异步上下文管理器"""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class UserOrderedApplication(Application):
+    """
+    开启 concurrent_updates 时不同用户的更新并发处理，同一用户的更新仍按到达顺序处理，
+    ConversationHandler 依赖的逐条处理语义因此保持不变。
+    PTB 在调用 process_update 之前就占用 concurrent_updates 名额，
+    同一用户的一批更新会占满全部名额并等待该用户自己的锁，阻塞其他聊天。
+    因此改为先按用户排队，轮到该更新时才占用名额
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # order_key -> [锁, 正在使用该锁的更新数]
+        self._order_locks = {}
+        # 正在处理的更新数上限，只由各用户队首的更新占用
+        self._update_slots = asyncio.BoundedSemaphore(self.concurrent_updates or 1)
+        self._concurrent_updates_sem = _Unlimited()
+
+    async def process_update(self, update):
+        key = order_key(update)
+        if key is None:
+            async with self._update_slots:
+                await super().process_update(update)
+            return
+        entry = self._order_locks.get(key)
+        if entry is None:
+            entry = self._order_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._update_slots:
+                await super().process_update(update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._order_locks[key]
@@ -0,0 +1,116 @@
+import base64
+import binascii
+import logging
+import os
+import re
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet, InvalidToken
+
+logger = logging.getLogger(__name__)
+
+# Fernet 密文：版本字节 0x80、8 字节时间戳、16 字节 IV、按 16 字节分组的密文、32 字节 HMAC，
+# 整体为 URL 安全的 base64
+FERNET_VERSION = 0x80
+FERNET_OVERHEAD = 57
+_BASE64_URLSAFE = re.compile(r"^[A-Za-z0-9_-]+={0,2}$")
+
+
+def token_shaped(value):
+    """value 的结构与 Fernet 密文一致（不校验 HMAC）"""
+    if not _BASE64_URLSAFE.match(value):
+        return False
+    try:
+        data = base64.urlsafe_b64decode(value.encode())
+    except (binascii.Error, ValueError):
+        return False
+    return (
+        len(data) > FERNET_OVERHEAD
+        and data[0] == FERNET_VERSION
+        and (len(data) - FERNET_OVERHEAD) % 16 == 0
+    )
+
+
+def load_key(key_path):
+    """
+    读取加密密钥：优先使用环境变量 ENCRYPTION_KEY，
+    未设置时使用（或生成）与数据库同目录的密钥文件。
+    """
+    key = os.getenv("ENCRYPTION_KEY")
+    if key:
+        return key.encode()
+
+    if os.path.exists(key_path):
+        with open(key_path, "rb") as f:
+            return f.read().strip()
+
+    logger.warning(
+        "未设置 ENCRYPTION_KEY 环境变量，已生成密钥文件 %s，请妥善保管。", key_path
+    )
+    key = Fernet.generate_key()
+    os.makedirs(os.path.dirname(key_path) or ".", exist_ok=True)
+    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+class CredentialVault:
+    """
+    凭据加解密，解密结果在内存中缓存，避免热路径上反复进行解密运算
+    """
+
+    def __init__(self, key, cache_size=1024):
+        self.fernet = Fernet(key)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def is_encrypted(self, value):
+        """
+        能用当前密钥解密的值为密文，明文恰好以 Fernet 前缀开头时仍视为明文。
+        结构与 Fernet 密文一致却无法解密时多半是密钥不正确，同样视为密文，避免再次加密
+        """
+        if not isinstance(value, str):
+            return False
+        try:
+            self.fernet.decrypt(value.encode())
+            return True
+        except InvalidToken:
+            return token_shaped(value)
+
+    def encrypt(self, plaintext):
+        if plaintext is None:
+            return None
+        ciphertext = self.fernet.encrypt(plaintext.encode()).decode()
+        self._remember(ciphertext, plaintext)
+        return ciphertext
+
+    def decrypt(self, ciphertext):
+        if ciphertext is None:
+            return None
+        plaintext = self._cache.get(ciphertext)
+        if plaintext is not None:
+            self._cache.move_to_end(ciphertext)
+            return plaintext
+        try:
+            plaintext = self.fernet.decrypt(ciphertext.encode()).decode()
+        except InvalidToken:
+            raise Exception("凭据解密失败，请检查 ENCRYPTION_KEY 是否正确。")
+        self._remember(ciphertext, plaintext)
+        return plaintext
+
+    def encrypt_bytes(self, data):
+        """加密二进制数据，明文不进入缓存（用于较大的快照）"""
+        return self.fernet.encrypt(data)
+
+    def decrypt_bytes(self, token):
+        try:
+            return self.fernet.decrypt(token)
+        except InvalidToken:
+            raise Exception("数据解密失败，请检查 ENCRYPTION_KEY 是否正确。")
+
+    def _remember(self, ciphertext, plaintext):
+        self._cache[ciphertext] = plaintext
+        self._cache.move_to_end(ciphertext)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)